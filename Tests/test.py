@@ -21,12 +21,19 @@ This will generate:
 """
 
 import pytest
+import numpy as np
 import pandas as pd
 import yaml
 import tempfile
 import os
 import sys
+import json
+import sqlite3
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
 from unittest.mock import Mock, patch, MagicMock
+from contextlib import nullcontext
 import requests
 
 # Add src directory to Python path
@@ -145,6 +152,52 @@ def sample_lead_df():
     })
 
 
+@pytest.fixture
+def carto_server():
+    """Local stand-in for the Carto SQL API backed by an in-memory SQLite table."""
+    db = sqlite3.connect(':memory:', check_same_thread=False)
+    db.row_factory = sqlite3.Row
+    db.execute('CREATE TABLE child_blood_lead_levels_by_zip (cartodb_id INTEGER, zip_code INTEGER, num_screen INTEGER)')
+    db.executemany('INSERT INTO child_blood_lead_levels_by_zip VALUES (?, ?, ?)',
+                   [(i, 19020 + i, 100 + i) for i in range(1, 26)])
+    lock = threading.Lock()
+    queries = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            query = parse_qs(urlsplit(self.path).query)['q'][0]
+            with lock:
+                queries.append(query)
+                rows = [dict(row) for row in db.execute(query)]
+            body = json.dumps({'rows': rows}).encode()
+            etag = f'"{hash(body) & 0xffffffff:x}"'
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.queries = queries
+    server.db = db
+    server.url = f"http://127.0.0.1:{server.server_port}/api/v2/sql?q=SELECT cartodb_id AS lead_id, zip_code, num_screen FROM child_blood_lead_levels_by_zip"
+
+    yield server
+
+    server.shutdown()
+    db.close()
+
+
 # ===== Reader Tests =====
 
 class TestReader:
@@ -184,6 +237,56 @@ class TestReader:
         assert isinstance(df, pd.DataFrame)
         assert len(df) == 3
     
+    def test_csv_typed_at_parse_time(self, config_dict, sample_csv_file):
+        """Test that schema dtypes are applied while parsing the CSV."""
+        from src.Reader import reader
+        from src.Validator import validator
+        
+        config_dict['sources'][0]['path'] = sample_csv_file
+        
+        df = reader(config_dict).read('tax_csv')
+        
+        assert str(df['objectid'].dtype) == 'Int64'
+        assert str(df['balance'].dtype) == 'float64'
+        
+        v = validator(config_dict)
+        with patch.object(v, '_try_convert_column') as mock_convert:
+            v.validate(df, 'tax_csv')
+            mock_convert.assert_not_called()
+    
+    def test_csv_dirty_column_left_to_validator(self, config_dict, tmp_path):
+        """Test that a column its dtype cannot parse falls back to inference."""
+        from src.Reader import reader
+        from src.Validator import validator
+        
+        path = tmp_path / 'dirty.csv'
+        path.write_text("objectid,zip_code,num_props,balance\n1,19020,10,1.5\n2,Other,20,2.5\n")
+        config_dict['sources'][0]['path'] = str(path)
+        
+        df = reader(config_dict).read('tax_csv')
+        assert len(df) == 2
+        
+        valid, invalid_schema, invalid_rules = validator(config_dict).validate(df, 'tax_csv')
+        assert list(valid['objectid']) == [1]
+        assert list(invalid_rules['objectid']) == [2]
+    
+    def test_stream_resumes_after_dirty_chunk(self, config_dict, tmp_path):
+        """Test that streaming continues untyped from the first dirty chunk."""
+        from src.Reader import reader
+        
+        path = tmp_path / 'dirty.csv'
+        path.write_text("objectid,zip_code,num_props,balance\n1,19020,10,1.5\n2,19021,20,2.5\n"
+                        "3,Other,30,3.5\n4,19023,40,4.5\n5,19024,50,5.5\n")
+        config_dict['sources'][0]['path'] = str(path)
+        config_dict['defaults']['batch_size'] = 2
+        
+        chunks = list(reader(config_dict).stream('tax_csv'))
+        
+        assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+        assert str(chunks[0]['zip_code'].dtype) == 'Int64'
+        assert list(pd.concat(chunks)['objectid']) == [1, 2, 3, 4, 5]
+        assert list(chunks[1]['zip_code']) == ['Other', '19023']
+    
     @patch('requests.get')
     def test_api_reader_success(self, mock_get, config_dict):
         """Test API reader with successful response."""
@@ -222,6 +325,165 @@ class TestReader:
         with pytest.raises(requests.exceptions.HTTPError):
             r.apiReader('https://example.com/api/data')
     
+    def test_stream_csv_in_batches(self, config_dict, sample_csv_file):
+        """Test streaming a CSV source in batch_size chunks."""
+        from src.Reader import reader
+        
+        config_dict['sources'][0]['path'] = sample_csv_file
+        config_dict['defaults']['batch_size'] = 2
+        
+        r = reader(config_dict)
+        chunks = list(r.stream('tax_csv'))
+        
+        assert [len(chunk) for chunk in chunks] == [2, 1]
+        assert list(pd.concat(chunks)['objectid']) == [1, 2, 3]
+    
+    @patch('requests.get')
+    def test_stream_api_single_chunk(self, mock_get, config_dict):
+        """Test that non-CSV sources stream as a single chunk."""
+        from src.Reader import reader
+        
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = {'rows': [{'id': 1, 'zip_code': 19020}]}
+        mock_get.return_value = mock_response
+        
+        r = reader(config_dict)
+        chunks = list(r.stream('lead_api'))
+        
+        assert len(chunks) == 1
+        assert len(chunks[0]) == 1
+    
+    def test_paged_reader_streams_pages(self, config_dict, carto_server):
+        """Test that a paginated API source streams ordered pages."""
+        from src.Reader import reader
+        
+        config_dict['sources'][1]['path'] = carto_server.url
+        config_dict['sources'][1]['paginate'] = {'key': 'lead_id', 'page_size': 10, 'workers': 3}
+        
+        r = reader(config_dict)
+        pages = list(r.stream('lead_api'))
+        
+        assert [len(page) for page in pages] == [10, 10, 5]
+        assert list(pd.concat(pages)['lead_id']) == list(range(1, 26))
+        assert sum('LIMIT 10 OFFSET' in query for query in carto_server.queries) == 3
+    
+    def test_paged_reader_read_concatenates(self, config_dict, carto_server):
+        """Test that read() on a paginated source returns one frame."""
+        from src.Reader import reader
+        
+        config_dict['sources'][1]['path'] = carto_server.url
+        config_dict['sources'][1]['paginate'] = {'key': 'lead_id', 'page_size': 7}
+        
+        df = reader(config_dict).read('lead_api')
+        
+        assert len(df) == 25
+        assert list(df.index) == list(range(25))
+
+    def test_paged_reader_read_empty_source(self, config_dict, carto_server):
+        """Test that read() on a paginated source with no rows returns an empty frame."""
+        from src.Reader import reader
+
+        config_dict['sources'][1]['path'] = carto_server.url + ' WHERE zip_code < 0'
+        config_dict['sources'][1]['paginate'] = {'key': 'lead_id', 'page_size': 7}
+
+        df = reader(config_dict).read('lead_api')
+
+        assert df.empty
+        assert not any('OFFSET' in query for query in carto_server.queries)
+
+    def test_cached_api_source_skips_request_within_ttl(self, config_dict, carto_server, tmp_path):
+        """Test that a fresh cached response is served without a request."""
+        from src.Reader import reader
+        
+        config_dict['sources'][1]['path'] = carto_server.url
+        config_dict['sources'][1]['cache'] = {'dir': str(tmp_path), 'ttl': 3600}
+        
+        first = reader(config_dict).read('lead_api')
+        second = reader(config_dict).read('lead_api')
+        
+        assert len(carto_server.queries) == 1
+        pd.testing.assert_frame_equal(first, second)
+    
+    def test_cached_api_source_revalidates_with_etag(self, config_dict, carto_server, tmp_path):
+        """Test that a stale cached response is revalidated and reused on 304."""
+        from src.Reader import reader
+        
+        config_dict['sources'][1]['path'] = carto_server.url
+        config_dict['sources'][1]['cache'] = {'dir': str(tmp_path), 'ttl': 0}
+        
+        r = reader(config_dict)
+        first = r.read('lead_api')
+        
+        with patch.object(pd.DataFrame, 'to_parquet') as mock_store:
+            second = r.read('lead_api')
+            mock_store.assert_not_called()
+        
+        assert len(carto_server.queries) == 2
+        assert len(second) == len(first) == 25
+    
+    def test_response_cache_evicts_least_recently_used(self, tmp_path, sample_valid_df):
+        """Test that the cache stays under max_bytes by evicting old entries."""
+        from src.Cache import responseCache
+        
+        cache = responseCache(str(tmp_path), ttl=3600, max_bytes=1)
+        cache.store('http://a', sample_valid_df, {})
+        cache.store('http://b', sample_valid_df, {})
+        
+        assert cache.meta('http://a') is None
+        assert cache.load('http://a') is None
+        assert not cache.fresh('http://a')
+
+    def test_response_cache_stores_parquet(self, tmp_path):
+        """Test that responses are cached as Parquet and ones Parquet cannot hold go uncached."""
+        pytest.importorskip('pyarrow')
+        from src.Cache import responseCache
+
+        cache = responseCache(str(tmp_path), ttl=3600)
+        cache.store('http://a', pd.DataFrame({'zip_code': [19104, 19143]}), {})
+        cache.store('http://b', pd.DataFrame({'zip_code': [19104, 'unknown']}), {})
+
+        assert [name for name in os.listdir(tmp_path) if not name.endswith('.json')] == \
+            [os.path.basename(cache._paths('http://a')[0])]
+        assert list(cache.load('http://a')['zip_code']) == [19104, 19143]
+        assert cache.load('http://b') is None
+    
+    @pytest.mark.parametrize("source_type", ["parquet", "arrow_ipc"])
+    def test_read_columnar_pushdown(self, config_dict, tmp_path, source_type):
+        """Test that columnar sources read only schema columns and rows the rules can pass."""
+        pa = pytest.importorskip('pyarrow')
+        from pyarrow import feather
+        import pyarrow.parquet as pq
+        from src.Reader import reader
+        
+        table = pa.table({
+            'objectid': [1, 2, 3, 4],
+            'zip_code': [19020, 18000, 19150, 20000],
+            'num_props': [10, 20, 30, 40],
+            'balance': [1.5, 2.5, 3.5, 4.5],
+            'notes': ['a', 'b', 'c', 'd'],
+        })
+        path = str(tmp_path / f'tax.{source_type}')
+        if source_type == 'parquet':
+            pq.write_table(table, path)
+        else:
+            feather.write_feather(table, path, compression='uncompressed')
+        config_dict['sources'][0].update({'type': source_type, 'path': path})
+        
+        r = reader(config_dict)
+        dataset, columns, where = r.columnarScan('tax_csv')
+        df = r.read('tax_csv')
+        
+        assert columns == ['objectid', 'zip_code', 'num_props', 'balance']
+        assert where is not None
+        assert list(df['objectid']) == [1, 3]
+        assert 'notes' not in df.columns
+        assert str(df['objectid'].dtype) == 'Int64'
+        
+        config_dict['defaults']['batch_size'] = 1
+        chunks = list(reader(config_dict).stream('tax_csv'))
+        assert [len(chunk) for chunk in chunks] == [1, 1]
+    
     def test_read_invalid_source(self, config_dict):
         """Test reading from non-existent source."""
         from src.Reader import reader
@@ -230,6 +492,80 @@ class TestReader:
         
         with pytest.raises(ValueError, match="not found in config"):
             r.read('nonexistent_source')
+    
+    @pytest.mark.parametrize("incremental", [True, False])
+    def test_json_stream_object_records(self, tmp_path, incremental):
+        """Test that an object of records decodes into typed, renamed columns a batch at a time."""
+        from src.Reader import reader
+        if incremental:
+            pytest.importorskip('ijson')
+        
+        path = tmp_path / 'intraday.json'
+        path.write_text(json.dumps({
+            'Meta Data': {'2. Symbol': 'IBM'},
+            'Time Series (5min)': {
+                '2025-11-14 19:55:00': {'1. open': '306.4600', '3. low': '306.4600', '5. volume': '10'},
+                '2025-11-14 19:50:00': {'1. open': '306.3000', '3. low': '306.3000', '5. volume': '5'},
+                '2025-11-14 19:45:00': {'1. open': 'n/a', '3. low': '305.6900'},
+            },
+        }))
+        cfg = {'defaults': {'batch_size': 2}, 'sources': [{
+            'name': 'ibm', 'type': 'json_stream', 'path': str(path),
+            'records': ['Time Series (5min)'], 'key': 'date',
+            'columns': {'1. open': 'open', '3. low': 'low', '5. volume': 'volume'},
+            'schema': {'date': 'str', 'open': 'float', 'low': 'float', 'volume': 'int'},
+        }]}
+        
+        with patch('JsonStream.ijson', None) if not incremental else nullcontext():
+            chunks = list(reader(cfg).stream('ibm'))
+            df = reader(cfg).read('ibm')
+        
+        assert [len(chunk) for chunk in chunks] == [2, 1]
+        assert chunks[0]['open'].dtype == 'float64' and chunks[0]['volume'].dtype == 'Int64'
+        assert chunks[0]['open'].tolist() == [306.46, 306.3]
+        # A dirty value leaves its column to the validator; a missing field is NA
+        assert chunks[1]['open'].tolist() == ['n/a'] and chunks[1]['volume'].isna().all()
+        assert list(df.columns) == ['date', 'open', 'low', 'volume']
+        assert df['date'].tolist() == ['2025-11-14 19:55:00', '2025-11-14 19:50:00', '2025-11-14 19:45:00']
+        assert df['low'].tolist() == [306.46, 306.3, 305.69]
+    
+    def test_json_stream_array_over_http(self, config_dict, carto_server):
+        """Test that an array of records is streamed from an HTTP response."""
+        from src.Reader import reader
+        
+        config_dict['defaults']['batch_size'] = 10
+        config_dict['sources'][1].update({'type': 'json_stream', 'path': carto_server.url, 'records': 'rows'})
+        
+        chunks = list(reader(config_dict).stream('lead_api'))
+        
+        assert [len(chunk) for chunk in chunks] == [10, 10, 5]
+        assert chunks[0]['zip_code'].dtype == 'Int64'
+        assert pd.concat(chunks)['lead_id'].tolist() == list(range(1, 26))
+
+
+class TestRules:
+    """Tests for translating rules to other engines."""
+    
+    def test_arrow_filter_translation(self):
+        """Test which rules are pushed down to Arrow and which are left to the validator."""
+        pytest.importorskip('pyarrow')
+        import pyarrow as pa
+        from src.Rules import compileRules, arrowFilter
+        
+        table = pa.table({'zip_code': [19020, 18000, None, 19200], 'perc': [5.0, 1.0, 2.0, None]})
+        
+        def kept(rule):
+            where = arrowFilter(compileRules([{'rule': rule}]), table.column_names)
+            return None if where is None else table.filter(where)['zip_code'].to_pylist()
+        
+        assert kept("zip_code >= 19019 and zip_code <= 19160") == [19020]
+        assert kept("19019 <= zip_code <= 19160") == [19020]
+        assert kept("zip_code > 19000 and perc != perc") == [19020, 19200]
+        assert kept("zip_code < 19000 or perc >= 5") == [19020, 18000]
+        # Rules Arrow would drop different rows for are not pushed down
+        assert kept("perc <= 100 or perc != perc") is None
+        assert kept("not zip_code > 19100") is None
+        assert kept("missing > 1") is None
 
 
 # ===== Validator Tests =====
@@ -267,6 +603,114 @@ class TestValidator:
         assert len(valid) == 2
         assert len(invalid_rules) == 2
     
+    def test_validate_reports_failed_rules(self, config_dict, sample_invalid_df):
+        """Test that rejected rows name the rules they failed."""
+        from src.Validator import validator
+        
+        v = validator(config_dict)
+        valid, invalid_schema, invalid_rules = v.validate(sample_invalid_df, 'tax_csv')
+        
+        assert list(invalid_rules['objectid']) == [2, 4]
+        assert list(invalid_rules['failed_rules']) == ['zip_code >= 19019', 'zip_code <= 19160']
+        assert 'failed_rules' not in valid.columns
+    
+    def test_validate_rules_single_pass(self, config_dict, sample_invalid_df):
+        """Test that rules are evaluated without per-rule query copies."""
+        from src.Validator import validator
+        
+        v = validator(config_dict)
+        
+        with patch.object(pd.DataFrame, 'query') as mock_query, patch.object(pd.DataFrame, 'eval') as mock_eval:
+            valid, invalid_schema, invalid_rules = v.validate(sample_invalid_df, 'tax_csv')
+            mock_query.assert_not_called()
+            mock_eval.assert_not_called()
+        
+        assert len(valid) == 2
+    
+    def test_rules_compiled_once_per_source(self, config_dict, sample_valid_df):
+        """Test that repeated validate calls reuse the compiled rules."""
+        from src.Validator import validator
+        import Rules
+        
+        v = validator(config_dict)
+        
+        with patch.object(Rules, 'ruleEvaluator', wraps=Rules.ruleEvaluator) as mock_compile:
+            for _ in range(3):
+                v.validate(sample_valid_df.copy(), 'tax_csv')
+            mock_compile.assert_not_called()
+    
+    def test_rules_recompiled_when_config_changes(self, config_dict, sample_valid_df):
+        """Test that editing a source's rules invalidates its compiled cache."""
+        from src.Validator import validator
+        
+        v = validator(config_dict)
+        v.validate(sample_valid_df.copy(), 'tax_csv')
+        
+        config_dict['sources'][0]['rules'] = [{'rule': 'num_props > 15'}]
+        valid, invalid_schema, invalid_rules = v.validate(sample_valid_df.copy(), 'tax_csv')
+        
+        assert list(valid['objectid']) == [2, 3]
+        assert list(invalid_rules['failed_rules']) == ['num_props > 15']
+    
+    @pytest.mark.parametrize("rule,expected", [
+        ("zip_code >= 19050 and zip_code <= 19120", [False, True, False]),
+        ("19050 <= zip_code <= 19120", [False, True, False]),
+        ("not (num_props == 20) or balance > 3000", [True, False, True]),
+        ("`num_props` * 2 < 50", [True, True, False]),
+    ])
+    def test_rule_evaluator(self, sample_valid_df, rule, expected):
+        """Test compiled rules match pandas query semantics."""
+        from src.Rules import ruleEvaluator
+        
+        assert list(ruleEvaluator(rule)(sample_valid_df)) == expected
+
+    @pytest.mark.parametrize("rule", [
+        "zip_code > 19050 & zip_code < 19200",
+        "num_props > 15 | balance < 2000 & zip_code > 19000",
+        "~(num_props == 20) | balance > 3000",
+    ])
+    def test_rule_evaluator_bitwise_precedence(self, sample_valid_df, rule):
+        """Test & and | bind looser than comparisons, as in pandas."""
+        from src.Rules import ruleEvaluator
+
+        assert list(ruleEvaluator(rule)(sample_valid_df)) == list(sample_valid_df.eval(rule))
+
+    @pytest.mark.parametrize("rule", [
+        "zip_code in [19020, 19160]",
+        "zip_code not in (19020,) and balance > 2000",
+        "zip_code == [19100, 19160] | num_props < 15",
+    ])
+    def test_rule_evaluator_membership(self, sample_valid_df, rule):
+        """Test in/not in and == against a list of constants, as in pandas."""
+        from src.Rules import ruleEvaluator
+
+        assert list(ruleEvaluator(rule)(sample_valid_df)) == list(sample_valid_df.eval(rule))
+
+    def test_rule_evaluator_rejects_calls(self):
+        """Test that rules cannot call functions."""
+        from src.Rules import ruleEvaluator
+        
+        with pytest.raises(ValueError, match="Unsupported expression"):
+            ruleEvaluator("__import__('os').system('true')")
+    
+    def test_validate_rules_missing_values_fail(self, config_dict):
+        """Test that a rule comparing a missing value rejects the row."""
+        from src.Validator import validator
+        
+        df = pd.DataFrame({
+            'objectid': [1, 2],
+            'zip_code': [19020, None],
+            'num_props': [10, 20],
+            'balance': [1500.50, 2500.75]
+        })
+        df['zip_code'] = df['zip_code'].astype('Int64')
+        
+        v = validator(config_dict)
+        valid, invalid_schema, invalid_rules = v.validate(df, 'tax_csv')
+        
+        assert list(valid['objectid']) == [1]
+        assert list(invalid_rules['objectid']) == [2]
+    
     def test_validate_schema_null_pk(self, config_dict):
         """Test validation catches null primary keys."""
         from src.Validator import validator
@@ -285,6 +729,44 @@ class TestValidator:
         assert len(valid) == 2
         assert len(invalid_schema) == 1
     
+    def test_validate_schema_null_pk_single_row(self, config_dict):
+        """Test that a row missing several pk columns is rejected once."""
+        from src.Validator import validator
+        
+        config_dict['sources'][0]['pk'] = ['objectid', 'zip_code']
+        df = pd.DataFrame({
+            'objectid': [1, None, 3],
+            'zip_code': [19020, None, 19150],
+            'num_props': [10, 20, 30],
+            'balance': [1500.50, 2500.75, 3500.25]
+        })
+        
+        v = validator(config_dict)
+        valid, invalid_schema, invalid_rules = v.validate(df, 'tax_csv')
+        
+        assert len(valid) == 2
+        assert len(invalid_schema) == 1
+        assert list(invalid_schema['reason']) == ['null_pk']
+    
+    def test_validate_schema_duplicate_pk(self, config_dict):
+        """Test optional rejection of repeated primary keys."""
+        from src.Validator import validator
+        
+        config_dict['defaults']['unique_pk'] = True
+        df = pd.DataFrame({
+            'objectid': [1, 2, 1, None, 2],
+            'zip_code': [19020, 19100, 19020, 19100, 19150],
+            'num_props': [10, 20, 30, 40, 50],
+            'balance': [1.0, 2.0, 3.0, 4.0, 5.0]
+        })
+        
+        v = validator(config_dict)
+        valid, invalid_schema, invalid_rules = v.validate(df, 'tax_csv')
+        
+        assert list(valid['num_props']) == [10, 20]
+        assert list(invalid_schema['num_props']) == [30, 40, 50]
+        assert list(invalid_schema['reason']) == ['duplicate_pk', 'null_pk', 'duplicate_pk']
+    
     def test_type_conversion(self, config_dict):
         """Test that validator converts types correctly."""
         from src.Validator import validator
@@ -400,6 +882,232 @@ class TestCleaner:
         # Should preserve original non-null values
         assert sample_lead_df.loc[0, 'perc_5plus'] == original_perc
 
+    
+    def test_cleantax_financial_columns(self, config_dict):
+        """Test clipping, zero-filling, derived balances and rounding."""
+        from src.Cleaner import cleaner
+        
+        df = pd.DataFrame({
+            'objectid': [1, 2, 3, 3],
+            'num_props': [2, 0, 4, 4],
+            'principal': [100.004, -5.0, None, None],
+            'interest': [10.0, 1.0, None, None],
+            'penalty': [0.0, 0.0, None, None],
+            'other': [0.0, 0.0, None, None],
+            'balance': [0.0, -3.0, 50.0, 50.0],
+            'avg_balance': [None, 0.0, 12.5, 12.5]
+        })
+        
+        c = cleaner(config_dict)
+        c.cleantax(df)
+        
+        assert len(df) == 3
+        assert list(df['principal']) == [100.0, 0.0, 0.0]
+        assert list(df['balance']) == [110.0, 1.0, 50.0]
+        assert list(df['avg_balance']) == [55.0, 0.0, 12.5]
+        assert list(df['num_props']) == [2, 1, 4]
+        assert df[['principal', 'interest', 'penalty', 'other']].notna().all().all()
+    
+    def test_cleantax_without_financial_columns(self, config_dict):
+        """Test that frames without money columns are only deduplicated."""
+        from src.Cleaner import cleaner
+        
+        df = pd.DataFrame({'objectid': [1, 1], 'zip_code': [19020, 19020]})
+        cleaner(config_dict).cleantax(df)
+        
+        assert len(df) == 1
+    
+    def test_cleanlead_nullable_columns(self, config_dict):
+        """Test lead cleaning on nullable integer columns from schema parsing."""
+        from src.Cleaner import cleaner
+        
+        df = pd.DataFrame({
+            'id': [1, 2],
+            'zip_code': [19020, 19100],
+            'num_screen': pd.array([100, None], dtype='Int64'),
+            'num_bll_5plus': pd.array([None, 4], dtype='Int64'),
+            'perc_5plus': [None, None]
+        })
+        
+        cleaner(config_dict).cleanlead(df)
+        
+        assert list(df['num_bll_5plus']) == [2, 4]
+        assert df.loc[0, 'perc_5plus'] == 2.0
+        assert np.isnan(df.loc[1, 'perc_5plus'])
+
+    def test_clean_plan_matches_cleantax(self):
+        """Test that the configured tax clean steps reproduce cleantax on pk-unique rows."""
+        from src.Cleaner import cleaner
+        
+        with open('config/sources.yml') as f:
+            cfg = yaml.safe_load(f)
+        
+        df = pd.DataFrame({
+            'objectid': [1, 2, 3, 4],
+            'num_props': pd.array([2, 0, 4, None], dtype='Int64'),
+            'principal': [100.004, -5.0, None, 7.0],
+            'interest': [10.0, 1.0, None, 0.0],
+            'penalty': [0.0, 0.0, None, 0.0],
+            'other': [0.0, 0.0, None, 0.0],
+            'balance': [0.0, -3.0, 50.0, 0.0],
+            'avg_balance': [None, 0.0, 12.5, 0.0]
+        })
+        expected = cleaner(cfg).cleantax(df.copy())
+        
+        c = cleaner(cfg)
+        c.cleanSource(df, 'tax_csv')
+        
+        pd.testing.assert_frame_equal(df, expected)
+    
+    def test_clean_plan_matches_cleanlead(self):
+        """Test that the configured lead clean steps reproduce cleanlead on pk-unique rows."""
+        from src.Cleaner import cleaner
+        
+        with open('config/sources.yml') as f:
+            cfg = yaml.safe_load(f)
+        
+        df = pd.DataFrame({
+            'lead_id': [1, 2, 3],
+            'num_screen': pd.array([100, 150, None], dtype='Int64'),
+            'num_bll_5plus': pd.array([5, None, 4], dtype='Int64'),
+            'perc_5plus': [5.0, None, None]
+        })
+        expected = cleaner(cfg).cleanlead(df.copy())
+        
+        cleaner(cfg).cleanSource(df, 'lead_api')
+        
+        pd.testing.assert_frame_equal(df, expected)
+    
+    def test_clean_plan_fuses_steps(self):
+        """Test that elementwise steps share one stage and dependent derives do not."""
+        from src.Planner import cleaningPlan
+        
+        plan = cleaningPlan([
+            {'clip_negative': ['a', 'b']},
+            {'fillna': {'columns': ['a'], 'value': 0}},
+            {'round': {'columns': ['a', 'b'], 'decimals': 1}},
+            {'derive': {'column': 'c', 'expr': 'a + b'}},
+            {'derive': {'column': 'd', 'expr': 'a * 2'}},
+            {'derive': {'column': 'e', 'expr': 'c + 1'}},
+        ])
+        
+        assert [type(stage).__name__ for stage in plan.stages] == \
+            ['_block', '_derivations', '_derivations']
+        assert len(plan.stages[1].steps) == 2
+        
+        df = pd.DataFrame({'a': [-1.0, None, 2.26], 'b': pd.array([3, -4, None], dtype='Int64'),
+                           'c': 0.0, 'd': 0.0, 'e': 0.0})
+        plan.run(df)
+        
+        assert list(df['a']) == [0.0, 0.0, 2.3]
+        assert df['b'].dtype == 'Int64'
+        assert list(df['b'].fillna(-1)) == [3, 0, -1]
+        assert list(df['d']) == [0.0, 0.0, 4.6]
+        assert df['e'].iloc[0] == 4.0
+    
+    def test_clean_plan_column_threads(self, config_dict):
+        """Test that column threads give the same result as a single thread."""
+        from src.Planner import cleaningPlan
+        
+        steps = [
+            {'clip_negative': ['a', 'b', 'c']},
+            {'fillna': {'columns': ['a', 'b', 'c'], 'value': 0}},
+            {'derive': {'column': 'b', 'expr': 'a * 2', 'when': 'b == 0'}},
+            {'derive': {'column': 'c', 'expr': 'a + 1', 'when': 'c == 0'}},
+        ]
+        rng = np.random.default_rng(0)
+        df = pd.DataFrame(rng.normal(size=(1000, 3)), columns=['a', 'b', 'c'])
+        df.iloc[::7, 1] = None
+        
+        single, threaded = df.copy(), df.copy()
+        cleaningPlan(steps).run(single)
+        cleaningPlan(steps, workers=3).run(threaded)
+        
+        pd.testing.assert_frame_equal(single, threaded)
+    
+    def test_clean_plan_unknown_step(self):
+        """Test that an unknown step is rejected when the plan is compiled."""
+        from src.Planner import cleaningPlan
+        
+        with pytest.raises(ValueError, match="Unknown clean step"):
+            cleaningPlan([{'scrub': ['a']}])
+
+# ===== Compactor Tests =====
+
+class TestCompactor:
+    """Tests for the Compactor class."""
+    
+    def test_compact_downcasts_and_categorizes(self, config_dict):
+        """Test integer downcasting, categoricals and the bytes-saved report."""
+        from src.Compactor import compactor
+        
+        config_dict['sources'][0]['compact'] = {'enabled': True, 'categoricals': ['zip_code']}
+        df = pd.DataFrame({
+            'objectid': pd.array(range(1000), dtype='Int64'),
+            'zip_code': [19020, 19100] * 500,
+            'num_props': [10] * 1000,
+            'balance': [1500.50] * 1000
+        })
+        
+        k = compactor(config_dict)
+        assert k.enabled('tax_csv')
+        df, saved = k.compact(df, 'tax_csv')
+        
+        assert str(df['objectid'].dtype) == 'Int16'
+        assert str(df['num_props'].dtype) == 'int8'
+        assert isinstance(df['zip_code'].dtype, pd.CategoricalDtype)
+        assert str(df['balance'].dtype) == 'float64'
+        assert saved > 0
+    
+    def test_compact_money_cents(self, config_dict, sample_valid_df):
+        """Test that money columns become integer cents and are recorded."""
+        from src.Compactor import compactor
+        
+        config_dict['sources'][0]['compact'] = {'enabled': True, 'money_cents': ['balance']}
+        
+        df, saved = compactor(config_dict).compact(sample_valid_df, 'tax_csv')
+        
+        assert list(df['balance']) == [150050, 250075, 350025]
+        assert df.attrs['money_cents'] == ['balance']
+    
+    def test_compact_disabled_by_default(self, config_dict):
+        """Test that compaction is opt-in."""
+        from src.Compactor import compactor
+        
+        assert not compactor(config_dict).enabled('tax_csv')
+    
+    def test_loader_restores_compacted_columns(self, config_dict, sample_valid_df, tmp_path):
+        """Test that the loader writes categoricals and cents back as plain values."""
+        from src.Compactor import compactor
+        from src.Loader import loader
+        from sqlalchemy import create_engine
+        
+        config_dict['defaults']['db_url'] = f"sqlite:///{tmp_path / 'test.db'}"
+        config_dict['sources'][0]['compact'] = {'categoricals': ['zip_code'], 'money_cents': ['balance']}
+        df, saved = compactor(config_dict).compact(sample_valid_df, 'tax_csv')
+        
+        loader(config_dict).load(df, 'test_table', pk=['objectid'], on_conflict='upsert')
+        
+        result = pd.read_sql('SELECT * FROM test_table ORDER BY objectid', create_engine(config_dict['defaults']['db_url']))
+        assert list(result['zip_code']) == [19020, 19100, 19150]
+        assert list(result['balance']) == [1500.50, 2500.75, 3500.25]
+
+    def test_loader_widens_downcast_integers(self, config_dict, sample_valid_df, tmp_path):
+        """Test that a compacted first chunk does not create SMALLINT columns for later chunks."""
+        from src.Compactor import compactor
+        from src.Loader import loader
+        from sqlalchemy import create_engine
+
+        config_dict['defaults']['db_url'] = f"sqlite:///{tmp_path / 'test.db'}"
+        df, saved = compactor(config_dict).compact(sample_valid_df, 'tax_csv')
+        assert df['objectid'].dtype.itemsize < 8
+
+        loader(config_dict).load(df, 'test_table')
+
+        ddl = create_engine(config_dict['defaults']['db_url']).connect().exec_driver_sql(
+            "SELECT sql FROM sqlite_master WHERE name = 'test_table'").scalar()
+        assert 'SMALLINT' not in ddl and 'BIGINT' in ddl
+
 
 # ===== Loader Tests =====
 
@@ -466,10 +1174,212 @@ class TestLoader:
             mock_to_sql.assert_called_once()
             args, kwargs = mock_to_sql.call_args
             assert args[0] == 'test_table'
-            assert kwargs['con'] == mock_engine
+            assert kwargs['con'] == mock_engine.begin.return_value.__enter__.return_value
             assert kwargs['if_exists'] == 'replace'
             assert kwargs['index'] == False
 
+    
+    def test_load_appends_chunks(self, config_dict, sample_valid_df, tmp_path):
+        """Test that streamed chunks are appended after the first one."""
+        from src.Loader import loader
+        from sqlalchemy import create_engine
+        
+        config_dict['defaults']['db_url'] = f"sqlite:///{tmp_path / 'test.db'}"
+        
+        l = loader(config_dict)
+        l.load(sample_valid_df.iloc[:2], 'test_table')
+        l.load(sample_valid_df.iloc[2:], 'test_table', if_exists='append')
+        
+        result = pd.read_sql('SELECT * FROM test_table', create_engine(config_dict['defaults']['db_url']))
+        assert list(result['objectid']) == [1, 2, 3]
+    
+    @patch('sqlalchemy.create_engine')
+    def test_load_postgres_uses_copy(self, mock_create_engine, config_dict, sample_valid_df):
+        """Test that PostgreSQL loads stream CSV batches through COPY."""
+        from src.Loader import loader
+        
+        cursor = MagicMock()
+        copied = []
+        cursor.copy_expert.side_effect = lambda sql, buf: copied.append((sql, buf.read()))
+        conn = mock_create_engine.return_value.begin.return_value.__enter__.return_value
+        conn.connection.cursor.return_value = cursor
+        config_dict['defaults']['batch_size'] = 2
+        
+        with patch.object(pd.DataFrame, 'to_sql') as mock_to_sql:
+            loader(config_dict).load(sample_valid_df, 'test_table')
+            
+            # Table is created from the empty frame, rows go through COPY
+            args, kwargs = mock_to_sql.call_args
+            assert args[0] == 'test_table'
+            assert kwargs['if_exists'] == 'replace'
+        
+        assert len(copied) == 2
+        assert copied[0][0].startswith('COPY "test_table" ("objectid", "zip_code", "num_props", "balance") FROM STDIN')
+        assert copied[0][1] == '1,19020,10,1500.5\n2,19100,20,2500.75\n'
+        assert copied[1][1] == '3,19150,30,3500.25\n'
+        cursor.close.assert_called_once()
+    
+    @pytest.fixture
+    def sqlite_loader(self, config_dict, tmp_path):
+        """Loader writing to a throwaway SQLite database."""
+        from src.Loader import loader
+        
+        config_dict['defaults']['db_url'] = f"sqlite:///{tmp_path / 'test.db'}"
+        return loader(config_dict)
+    
+    def _read_table(self, l, name):
+        from sqlalchemy import create_engine
+        return pd.read_sql(f'SELECT * FROM {name} ORDER BY objectid', create_engine(l.db_url))
+    
+    def test_load_upsert_updates_and_inserts(self, sqlite_loader, sample_valid_df):
+        """Test that upsert updates existing keys and inserts new ones."""
+        sqlite_loader.load(sample_valid_df, 'test_table', pk=['objectid'], on_conflict='upsert')
+        
+        changed = pd.DataFrame({
+            'objectid': [2, 4],
+            'zip_code': [19100, 19120],
+            'num_props': [25, 40],
+            'balance': [2600.00, 4500.00]
+        })
+        sqlite_loader.load(changed, 'test_table', pk=['objectid'], on_conflict='upsert')
+        
+        result = self._read_table(sqlite_loader, 'test_table')
+        assert list(result['objectid']) == [1, 2, 3, 4]
+        assert list(result['num_props']) == [10, 25, 30, 40]
+        assert result.loc[1, 'balance'] == 2600.00
+    
+    def test_load_append_skips_existing_keys(self, sqlite_loader, sample_valid_df):
+        """Test that append keeps existing rows and adds only new keys."""
+        sqlite_loader.load(sample_valid_df, 'test_table', pk=['objectid'], on_conflict='append')
+        
+        changed = sample_valid_df.assign(num_props=[99, 99, 99])
+        changed.loc[2, 'objectid'] = 4
+        sqlite_loader.load(changed, 'test_table', pk=['objectid'], on_conflict='append')
+        
+        result = self._read_table(sqlite_loader, 'test_table')
+        assert list(result['objectid']) == [1, 2, 3, 4]
+        assert list(result['num_props']) == [10, 20, 30, 99]
+    
+    def test_load_fail_rejects_existing_keys(self, sqlite_loader, sample_valid_df):
+        """Test that fail mode rolls back a batch that hits an existing key."""
+        sqlite_loader.load(sample_valid_df.iloc[:2], 'test_table', pk=['objectid'], on_conflict='fail')
+        
+        with patch('builtins.print') as mock_print:
+            sqlite_loader.load(sample_valid_df, 'test_table', pk=['objectid'], on_conflict='fail')
+            assert "Error writing DataFrame" in str(mock_print.call_args)
+        
+        result = self._read_table(sqlite_loader, 'test_table')
+        assert list(result['objectid']) == [1, 2]
+    
+    def test_mergeSql_postgres_upsert(self, config_dict):
+        """Test the PostgreSQL upsert statement only rewrites changed rows."""
+        from src.Loader import loader
+        
+        sql = loader(config_dict)._mergeSql('t', 's', ['id', 'a', 'b'], ['id'], 'upsert')
+        
+        assert 'ON CONFLICT ("id") DO UPDATE SET "a" = excluded."a", "b" = excluded."b"' in sql
+        assert 'WHERE "t"."a" IS DISTINCT FROM excluded."a" OR "t"."b" IS DISTINCT FROM excluded."b"' in sql
+    
+    def test_loader_shares_connection_manager(self, config_dict, sample_valid_df, tmp_path):
+        """Test that loads reuse one pooled engine and report its metrics."""
+        from src.Loader import loader
+        from src.Connection import connectionManager
+        
+        config_dict['defaults']['db_url'] = f"sqlite:///{tmp_path / 'test.db'}"
+        connections = connectionManager(config_dict)
+        
+        with patch('sqlalchemy.create_engine', wraps=__import__('sqlalchemy').create_engine) as mock_create:
+            l = loader(config_dict, connections)
+            l.load(sample_valid_df, 'test_table')
+            l.load(sample_valid_df, 'test_table', pk=['objectid'], on_conflict='upsert')
+            mock_create.assert_called_once()
+        
+        metrics = connections.metrics()
+        assert metrics['checkouts'] == 2
+        assert metrics['connections_opened'] == 1
+        assert metrics['connections_reused'] == 1
+        assert metrics['wait_seconds_total'] >= 0
+    
+    def test_connection_manager_pool_options(self, config_dict):
+        """Test that pool settings from the config reach create_engine."""
+        from src.Connection import connectionManager
+        
+        config_dict['defaults']['pool'] = {'size': 3, 'max_overflow': 1, 'pre_ping': False}
+        
+        with patch('sqlalchemy.create_engine') as mock_create:
+            connectionManager(config_dict).engine
+            
+            args, kwargs = mock_create.call_args
+            assert kwargs == {'pool_pre_ping': False, 'pool_size': 3, 'max_overflow': 1}
+    
+    def test_parquet_load_partitions(self, config_dict, sample_valid_df, tmp_path):
+        """Test that a partitioned Parquet target is replaced, appended to and read back."""
+        pytest.importorskip('pyarrow')
+        from src.Loader import loader
+        from src.Reader import reader
+        
+        path = str(tmp_path / 'tax_levels')
+        l = loader(config_dict)
+        
+        assert l.parquetLoad(sample_valid_df, path, ['zip_code'])
+        assert sorted(os.listdir(path)) == ['zip_code=19020', 'zip_code=19100', 'zip_code=19150']
+        assert l.parquetLoad(sample_valid_df.assign(objectid=[4, 5, 6]), path, ['zip_code'], if_exists='append')
+        
+        config_dict['sources'][0].update({'type': 'parquet', 'path': path})
+        df = reader(config_dict).read('tax_csv')
+        assert sorted(df['objectid']) == [1, 2, 3, 4, 5, 6]
+        
+        assert l.parquetLoad(sample_valid_df.head(1), path, ['zip_code'])
+        assert os.listdir(path) == ['zip_code=19020']
+        assert not os.path.exists(path + '.tmp')
+    
+    def test_summary_refreshes_touched_zip_codes(self, sqlite_loader):
+        """Test that loads into the lead and tax tables keep zip_summary up to date per zip code."""
+        from sqlalchemy import create_engine
+        
+        l = sqlite_loader
+        l.summary = {'table': 'zip_summary', 'lead': 'lead_levels', 'tax': 'tax_levels'}
+        engine = create_engine(l.db_url)
+        summary = lambda: pd.read_sql('SELECT * FROM zip_summary ORDER BY zip_code', engine).set_index('zip_code')
+        tax = pd.DataFrame({'objectid': [1, 2, 3], 'zip_code': [19020, 19020, 19100],
+                            'num_props': [2, 4, 5], 'balance': [100.0, 300.0, 50.0], 'avg_balance': [50.0, 75.0, 10.0]})
+        lead = pd.DataFrame({'lead_id': [1, 2], 'zip_code': [19100, 19150],
+                             'num_screen': [10, 20], 'perc_5plus': [5.0, np.nan]})
+        
+        # Only tax loaded so far: lead columns are null
+        assert l.load(tax, 'tax_levels', pk=['objectid', 'zip_code'], on_conflict='upsert')
+        got = summary()
+        assert got.loc[19020, 'num_props'] == 6 and got.loc[19020, 'avg_balance'] == 62.5
+        assert got['num_screen'].isna().all()
+        
+        assert l.load(lead, 'lead_levels', pk=['lead_id', 'zip_code'], on_conflict='upsert')
+        got = summary()
+        assert list(got.index) == [19020, 19100, 19150]
+        assert got.loc[19100, 'num_screen'] == 10 and got.loc[19100, 'balance'] == 50.0
+        assert np.isnan(got.loc[19150, 'perc_5plus']) and np.isnan(got.loc[19150, 'num_props'])
+        
+        # A later chunk recomputes its own zip codes and leaves the others alone
+        with engine.begin() as conn:
+            conn.exec_driver_sql('UPDATE zip_summary SET balance = -1 WHERE zip_code = 19020')
+        assert l.load(tax.iloc[[2]].assign(balance=80.0), 'tax_levels', pk=['objectid', 'zip_code'],
+                      on_conflict='upsert')
+        got = summary()
+        assert got.loc[19100, 'balance'] == 80.0 and got.loc[19020, 'balance'] == -1
+    
+    def test_summary_rebuilt_on_replace(self, sqlite_loader):
+        """Test that replacing a table rebuilds the summary, dropping zip codes no table has."""
+        from sqlalchemy import create_engine
+        
+        l = sqlite_loader
+        l.summary = {'table': 'zip_summary', 'lead': 'lead_levels', 'tax': 'tax_levels'}
+        tax = pd.DataFrame({'zip_code': [19020, 19100], 'num_props': [2, 5], 'balance': [100.0, 50.0],
+                            'avg_balance': [50.0, 10.0]})
+        
+        assert l.load(tax, 'tax_levels')
+        assert l.load(tax.iloc[[1]], 'tax_levels')
+        
+        got = pd.read_sql('SELECT zip_code, num_props FROM zip_summary', create_engine(l.db_url))
+        assert got.to_dict('list') == {'zip_code': [19100], 'num_props': [5]}
 
 # ===== Integration Tests =====
 
@@ -545,6 +1455,746 @@ class TestIntegration:
             l.load(valid_df, 'lead_table')
 
 
+# ===== Pipeline Tests =====
+
+class TestPipeline:
+    """Tests for concurrent source orchestration."""
+    
+    @pytest.fixture
+    def pipeline_config(self, config_dict, sample_csv_file, tmp_path):
+        """Config with both sources pointed at local stand-ins."""
+        config_dict['defaults']['db_url'] = f"sqlite:///{tmp_path / 'test.db'}"
+        config_dict['sources'][0]['path'] = sample_csv_file
+        config_dict['sources'][0]['clean_method'] = 'cleantax'
+        config_dict['sources'][1]['clean_method'] = 'cleanlead'
+        return config_dict
+    
+    @pytest.fixture
+    def mock_lead_api(self):
+        """Patch requests.get with a two-row lead response."""
+        with patch('requests.get') as mock_get:
+            mock_response = Mock()
+            mock_response.status_code = 200
+            mock_response.json.return_value = {
+                'rows': [
+                    {'id': 1, 'zip_code': 19020, 'num_screen': 100, 'num_bll_5plus': 5.0, 'perc_5plus': 5.0},
+                    {'id': 2, 'zip_code': 30000, 'num_screen': 150, 'num_bll_5plus': 1.0, 'perc_5plus': 0.7}
+                ]
+            }
+            mock_get.return_value = mock_response
+            yield mock_get
+    
+    @pytest.mark.parametrize("processes", [0, 2])
+    def test_run_returns_results_per_source(self, pipeline_config, mock_lead_api, processes):
+        """Test that every source is processed and reported separately."""
+        from src.Pipeline import pipeline
+        from sqlalchemy import create_engine
+        
+        pipeline_config['defaults']['workers'] = {'threads': 2, 'processes': processes}
+        
+        results = pipeline(pipeline_config).run()
+        
+        assert set(results) == {'tax_csv', 'lead_api'}
+        assert results['tax_csv']['rows_loaded'] == 3
+        assert results['lead_api']['rows_loaded'] == 1
+        assert len(results['lead_api']['invalid_rules']) == 1
+        
+        engine = create_engine(pipeline_config['defaults']['db_url'])
+        assert len(pd.read_sql('SELECT * FROM tax_table', engine)) == 3
+        assert len(pd.read_sql('SELECT * FROM lead_table', engine)) == 1
+    
+    def test_run_reports_source_errors(self, pipeline_config, mock_lead_api):
+        """Test that a failing source does not stop the others."""
+        from src.Pipeline import pipeline
+        
+        pipeline_config['sources'][0]['path'] = 'missing.csv'
+        
+        results = pipeline(pipeline_config).run()
+        
+        assert isinstance(results['tax_csv']['error'], FileNotFoundError)
+        assert results['lead_api']['error'] is None
+        assert results['lead_api']['rows_loaded'] == 1
+
+    def test_run_reports_setup_errors(self, pipeline_config, mock_lead_api, tmp_path):
+        """Test that a source failing before its first read still leaves the others a result."""
+        from src.Pipeline import pipeline
+
+        pipeline_config['defaults']['state'] = {'path': str(tmp_path / 'state.db')}
+        pipeline_config['sources'][0]['incremental'] = {'watermark': 'objectid'}
+
+        with patch('State.stateStore.watermark', side_effect=sqlite3.OperationalError('database is locked')):
+            results = pipeline(pipeline_config).run()
+
+        assert isinstance(results['tax_csv']['error'], sqlite3.OperationalError)
+        assert results['tax_csv']['rows_loaded'] == 0
+        assert results['lead_api']['error'] is None
+        assert results['lead_api']['rows_loaded'] == 1
+
+    def test_run_parquet_target(self, pipeline_config, mock_lead_api, tmp_path):
+        """Test that a source with a Parquet target is written as a partitioned dataset."""
+        pytest.importorskip('pyarrow')
+        from src.Pipeline import pipeline
+        
+        path = str(tmp_path / 'tax_levels')
+        pipeline_config['sources'][0]['target'] = {'format': 'parquet', 'path': path, 'partition_by': ['zip_code']}
+        
+        results = pipeline(pipeline_config).run()
+        
+        assert results['tax_csv']['error'] is None
+        assert results['tax_csv']['table'] == path
+        assert len(os.listdir(path)) == 3
+
+    def test_run_skips_unchanged_rows(self, pipeline_config, mock_lead_api, tmp_path):
+        """Test that a second run loads only rows that changed since the first."""
+        from src.Pipeline import pipeline
+        from sqlalchemy import create_engine
+        
+        pipeline_config['defaults']['skip_unchanged'] = True
+        pipeline_config['defaults']['state'] = {'path': str(tmp_path / 'state.db')}
+        
+        first = pipeline(pipeline_config).run()
+        assert first['tax_csv']['rows_loaded'] == 3
+        
+        with open(pipeline_config['sources'][0]['path'], 'a') as f:
+            f.write('4,19120,40,4500.00\n')
+        
+        second = pipeline(pipeline_config).run()
+        assert second['tax_csv']['rows_loaded'] == 1
+        assert second['tax_csv']['rows_unchanged'] == 3
+        assert second['lead_api']['rows_loaded'] == 0
+        
+        engine = create_engine(pipeline_config['defaults']['db_url'])
+        assert len(pd.read_sql('SELECT * FROM tax_table', engine)) == 4
+
+    def test_run_skips_disabled_sources(self, pipeline_config, mock_lead_api):
+        """Test that a source with enabled: false is not run."""
+        from src.Pipeline import pipeline
+
+        pipeline_config['sources'][1]['enabled'] = False
+
+        results = pipeline(pipeline_config).run()
+
+        assert list(results) == ['tax_csv']
+        mock_lead_api.assert_not_called()
+
+    def test_run_refreshes_summary_once_per_source(self, pipeline_config, mock_lead_api, tmp_path):
+        """Test that a streamed source refreshes zip_summary once, after its last chunk."""
+        from src.Pipeline import pipeline
+        from sqlalchemy import create_engine
+        import Loader
+
+        pipeline_config['defaults']['batch_size'] = 1
+        pipeline_config['defaults']['summary'] = {'tax': 'tax_table', 'lead': 'lead_table'}
+        pipeline_config['sources'] = pipeline_config['sources'][:1]
+
+        with patch.object(Loader.loader, '_summarize', autospec=True, side_effect=Loader.loader._summarize) as refresh:
+            result = pipeline(pipeline_config).run()['tax_csv']
+
+        assert result['error'] is None and result['chunks'] == 3
+        assert refresh.call_count == 1
+        got = pd.read_sql('SELECT zip_code FROM zip_summary ORDER BY zip_code',
+                          create_engine(pipeline_config['defaults']['db_url']))
+        assert list(got['zip_code']) == [19020, 19100, 19150]
+
+    def test_skip_unchanged_state_follows_the_target(self, pipeline_config, mock_lead_api, tmp_path):
+        """Test that a new database or a dropped table gets every row again."""
+        from src.Pipeline import pipeline
+        from sqlalchemy import create_engine, text
+
+        pipeline_config['defaults']['skip_unchanged'] = True
+        pipeline_config['defaults']['state'] = {'path': str(tmp_path / 'state.db')}
+        assert pipeline(pipeline_config).run()['tax_csv']['rows_loaded'] == 3
+
+        pipeline_config['defaults']['db_url'] = f"sqlite:///{tmp_path / 'other.db'}"
+        assert pipeline(pipeline_config).run()['tax_csv']['rows_loaded'] == 3
+
+        engine = create_engine(pipeline_config['defaults']['db_url'])
+        with engine.begin() as conn:
+            conn.execute(text('DROP TABLE tax_table'))
+        engine.dispose()
+        again = pipeline(pipeline_config).run()['tax_csv']
+        assert again['rows_loaded'] == 3 and again['rows_unchanged'] == 0
+
+    def test_skip_unchanged_state_follows_the_transform(self, pipeline_config, mock_lead_api, tmp_path):
+        """Test that changing how a source's rows are cleaned loads every row again."""
+        from src.Pipeline import pipeline
+
+        pipeline_config['defaults']['skip_unchanged'] = True
+        pipeline_config['defaults']['state'] = {'path': str(tmp_path / 'state.db')}
+        assert pipeline(pipeline_config).run()['tax_csv']['rows_loaded'] == 3
+        assert pipeline(pipeline_config).run()['tax_csv']['rows_unchanged'] == 3
+
+        pipeline_config['sources'][0]['clean'] = [{'fillna': {'columns': ['balance'], 'value': 0}}]
+        again = pipeline(pipeline_config).run()['tax_csv']
+        assert again['rows_loaded'] == 3 and again['rows_unchanged'] == 0
+
+    def test_run_commits_fingerprints_only_after_load(self, pipeline_config, mock_lead_api, tmp_path):
+        """Test that rows from a failed load are sent again on the next run."""
+        from src.Pipeline import pipeline
+        
+        pipeline_config['defaults']['skip_unchanged'] = True
+        pipeline_config['defaults']['state'] = {'path': str(tmp_path / 'state.db')}
+        
+        with patch('Loader.loader.load', return_value=False):
+            failed = pipeline(pipeline_config).run()
+        assert isinstance(failed['tax_csv']['error'], RuntimeError)
+        
+        retried = pipeline(pipeline_config).run()
+        assert retried['tax_csv']['rows_loaded'] == 3
+        assert retried['tax_csv']['rows_unchanged'] == 0
+
+    
+    def test_incremental_csv_loads_new_and_changed_rows(self, pipeline_config, mock_lead_api, tmp_path):
+        """Test that rows beyond the watermark and edited rows below it are the only ones loaded."""
+        from src.Pipeline import pipeline
+        from src.State import stateStore
+        from sqlalchemy import create_engine
+        
+        pipeline_config['defaults']['state'] = {'path': str(tmp_path / 'state.db')}
+        pipeline_config['sources'][0]['incremental'] = {'watermark': 'objectid'}
+        key = pipeline(pipeline_config)._stateKey('tax_csv')
+        
+        first = pipeline(pipeline_config).run()
+        assert first['tax_csv']['rows_loaded'] == 3
+        assert stateStore(str(tmp_path / 'state.db')).watermark(key, 'objectid') == 3
+        
+        with open(pipeline_config['sources'][0]['path'], 'w') as f:
+            f.write('objectid,zip_code,num_props,balance\n'
+                    '1,19020,10,1500.50\n2,19100,20,9999.99\n3,19150,30,3500.25\n4,19120,40,4500.00\n')
+        
+        second = pipeline(pipeline_config).run()
+        assert second['tax_csv']['rows_loaded'] == 2
+        assert second['tax_csv']['rows_unchanged'] == 2
+        assert stateStore(str(tmp_path / 'state.db')).watermark(key, 'objectid') == 4
+        
+        engine = create_engine(pipeline_config['defaults']['db_url'])
+        balances = pd.read_sql('SELECT objectid, balance FROM tax_table ORDER BY objectid', engine)
+        assert list(balances['balance']) == [1500.50, 9999.99, 3500.25, 4500.00]
+    
+    def test_incremental_api_pushes_down_watermark(self, pipeline_config, carto_server, tmp_path):
+        """Test that an incremental API source only asks the server for rows beyond its watermark."""
+        from src.Pipeline import pipeline
+        
+        pipeline_config['defaults']['state'] = {'path': str(tmp_path / 'state.db')}
+        pipeline_config['sources'] = [{
+            'name': 'lead_api', 'type': 'api_json', 'path': carto_server.url,
+            'target_table': 'lead_table', 'pk': ['lead_id'],
+            'paginate': {'key': 'lead_id', 'page_size': 10, 'workers': 2},
+            'incremental': {'watermark': 'lead_id', 'append_only': True},
+            'clean': [{'fillna': {'columns': ['num_screen'], 'value': 0}}],
+            'schema': {'lead_id': 'int', 'zip_code': 'int', 'num_screen': 'int'},
+        }]
+        
+        assert pipeline(pipeline_config).run()['lead_api']['rows_loaded'] == 25
+        
+        carto_server.queries.clear()
+        again = pipeline(pipeline_config).run()['lead_api']
+        
+        assert again['error'] is None
+        assert again['rows_loaded'] == 0
+        assert carto_server.queries
+        assert all('WHERE lead_id > 25' in query for query in carto_server.queries)
+
+    def test_incremental_api_fetches_edited_rows(self, pipeline_config, carto_server, tmp_path):
+        """Test that an incremental API source that is not append-only picks up edits below its watermark."""
+        from src.Pipeline import pipeline
+
+        pipeline_config['defaults']['state'] = {'path': str(tmp_path / 'state.db')}
+        pipeline_config['sources'] = [{
+            'name': 'lead_api', 'type': 'api_json', 'path': carto_server.url,
+            'target_table': 'lead_table', 'pk': ['lead_id'],
+            'incremental': {'watermark': 'lead_id'},
+            'clean': [{'fillna': {'columns': ['num_screen'], 'value': 0}}],
+            'schema': {'lead_id': 'int', 'zip_code': 'int', 'num_screen': 'int'},
+        }]
+
+        assert pipeline(pipeline_config).run()['lead_api']['rows_loaded'] == 25
+
+        carto_server.db.execute('UPDATE child_blood_lead_levels_by_zip SET num_screen = 0 WHERE cartodb_id = 3')
+        carto_server.queries.clear()
+        again = pipeline(pipeline_config).run()['lead_api']
+
+        assert again['error'] is None
+        assert again['rows_loaded'] == 1
+        assert again['rows_unchanged'] == 24
+        assert not any('WHERE lead_id >' in query for query in carto_server.queries)
+    
+    def test_incremental_watermark_kept_on_failed_load(self, pipeline_config, mock_lead_api, tmp_path):
+        """Test that the watermark only advances once the rows are loaded."""
+        from src.Pipeline import pipeline
+        from src.State import stateStore
+        
+        pipeline_config['defaults']['state'] = {'path': str(tmp_path / 'state.db')}
+        pipeline_config['sources'][0]['incremental'] = {'watermark': 'objectid'}
+        key = pipeline(pipeline_config)._stateKey('tax_csv')
+        
+        with patch('Loader.loader.load', return_value=False):
+            pipeline(pipeline_config).run()
+        
+        assert stateStore(str(tmp_path / 'state.db')).watermark(key, 'objectid') is None
+    
+    def test_staged_run_resumes_after_failed_load(self, pipeline_config, mock_lead_api, tmp_path):
+        """Test that a failed load is resumed from the staged rows without transforming them again."""
+        pytest.importorskip('pyarrow')
+        from src.Pipeline import pipeline
+        
+        stage_dir = tmp_path / 'stages'
+        pipeline_config['defaults']['stages'] = {'dir': str(stage_dir)}
+        pipeline_config['defaults']['skip_unchanged'] = True
+        pipeline_config['defaults']['state'] = {'path': str(tmp_path / 'state.db')}
+        
+        with patch('Loader.loader.load', return_value=False):
+            failed = pipeline(pipeline_config).run()
+        assert isinstance(failed['tax_csv']['error'], RuntimeError)
+        assert (stage_dir / 'tax_csv' / '000000.valid.arrow').exists()
+        
+        resumed_pipeline = pipeline(pipeline_config)
+        with patch.object(resumed_pipeline.validator, 'validate', side_effect=AssertionError('re-validated')):
+            resumed = resumed_pipeline.run()
+        
+        assert resumed['tax_csv']['error'] is None
+        assert resumed['tax_csv']['rows_loaded'] == 3
+        assert resumed['lead_api']['rows_loaded'] == 1
+        assert len(resumed['lead_api']['invalid_rules']) == 1
+        assert not (stage_dir / 'tax_csv').exists()
+        
+        assert pipeline(pipeline_config).run()['tax_csv']['rows_unchanged'] == 3
+    
+    def test_staged_run_with_processes(self, pipeline_config, mock_lead_api, tmp_path):
+        """Test that process workers transform staged chunks from their files."""
+        pytest.importorskip('pyarrow')
+        from src.Pipeline import pipeline
+        
+        pipeline_config['defaults']['stages'] = {'dir': str(tmp_path / 'stages')}
+        pipeline_config['defaults']['workers'] = {'threads': 2, 'processes': 2}
+        
+        results = pipeline(pipeline_config).run()
+        
+        assert results['tax_csv']['rows_loaded'] == 3
+        assert results['lead_api']['rows_loaded'] == 1
+        assert os.listdir(tmp_path / 'stages') == []
+    
+    @pytest.mark.parametrize("shared", [True, False])
+    def test_partitioned_transform_matches_serial(self, config_dict, shared):
+        """Test that row partitions merge into the same frames, in the same order, as one pass."""
+        from concurrent.futures import ProcessPoolExecutor
+        import Pipeline
+        
+        config_dict['sources'][0]['clean_method'] = 'cleantax'
+        config_dict['defaults']['unique_pk'] = True
+        rng = np.random.default_rng(1)
+        n = 400
+        df = pd.DataFrame({
+            'objectid': rng.integers(0, 300, n),
+            'zip_code': rng.choice([19020, 19100, 18000, 19150], n),
+            'num_props': rng.integers(0, 5, n),
+            'balance': rng.normal(100, 80, n).round(2),
+        })
+        df['zip_code'] = df['zip_code'].astype(object)
+        df.loc[7, 'zip_code'] = 'Other'
+        
+        Pipeline._init_worker(config_dict)
+        expected = Pipeline._transform(df.copy(), 'tax_csv')
+        
+        with patch.object(Pipeline, 'pa', Pipeline.pa if shared else None), \
+             ProcessPoolExecutor(2, initializer=Pipeline._init_worker, initargs=(config_dict,)) as pool:
+            got = Pipeline.transformPartitioned(pool, df, 'tax_csv', 4, ['objectid'])
+        
+        for frame, want in zip(got[:3], expected[:3]):
+            pd.testing.assert_frame_equal(frame, want, check_dtype=False)
+        assert len(got[1]) > 0 and len(got[2]) > 0
+    
+    def test_run_partitioned(self, pipeline_config, mock_lead_api):
+        """Test that a partitioned run loads the same rows as a serial one."""
+        from src.Pipeline import pipeline
+        
+        pipeline_config['defaults']['workers'] = {'threads': 2, 'processes': 2, 'partitions': 3}
+        
+        results = pipeline(pipeline_config).run()
+        
+        assert results['tax_csv']['rows_loaded'] == 3
+        assert results['lead_api']['rows_loaded'] == 1
+        assert len(results['lead_api']['invalid_rules']) == 1
+
+
+
+    @pytest.mark.parametrize("processes", [0, 2])
+    def test_run_records_stage_metrics(self, pipeline_config, mock_lead_api, tmp_path, processes):
+        """Test that every stage call is written as a JSON line and totalled per source."""
+        from src.Pipeline import pipeline
+        
+        pipeline_config['defaults']['workers'] = {'threads': 2, 'processes': processes}
+        pipeline_config['defaults']['metrics'] = {'path': str(tmp_path / 'logs' / 'metrics.jsonl'),
+                                                  'prometheus': str(tmp_path / 'logs' / 'metrics.prom')}
+        
+        results = pipeline(pipeline_config).run()
+        
+        with open(tmp_path / 'logs' / 'metrics.jsonl') as f:
+            records = [json.loads(line) for line in f]
+        lead = {record['stage']: record for record in records if record['source'] == 'lead_api'}
+        assert set(lead) == {'read', 'validate', 'clean', 'load'}
+        assert lead['read']['rows_out'] == 2 and lead['read']['bytes'] > 0
+        assert lead['validate']['rows_in'] == 2
+        assert lead['validate']['rows_out'] == 1 and lead['validate']['rows_rejected'] == 1
+        assert lead['load']['rows_out'] == 1
+        assert all(record['chunk'] == 0 and record['wall_s'] >= 0 for record in lead.values())
+        
+        totals = results['tax_csv']['metrics']
+        assert totals['load']['rows_out'] == results['tax_csv']['rows_loaded']
+        assert totals['validate']['calls'] == results['tax_csv']['chunks']
+        
+        with open(tmp_path / 'logs' / 'metrics.prom') as f:
+            prom = f.read()
+        assert '# TYPE pipeline_stage_rows_out_total counter' in prom
+        assert 'pipeline_stage_rows_rejected_total{source="lead_api",stage="validate"} 1' in prom
+
+
+class TestMetrics:
+    """Tests for stage timing and memory instrumentation."""
+    
+    def test_measure_fills_timing(self):
+        """Test that a measured call gets wall and CPU time alongside the caller's counts."""
+        from src.Metrics import measure
+        
+        with measure('validate', chunk=3) as record:
+            record.update(rows_in=10, rows_out=8, rows_rejected=2)
+            sum(range(10000))
+        
+        assert record['stage'] == 'validate' and record['chunk'] == 3
+        assert record['wall_s'] > 0 and record['cpu_s'] >= 0
+        assert record['rss_delta_bytes'] >= 0 and record['pid'] == os.getpid()
+    
+    def test_stage_records_failures(self, tmp_path):
+        """Test that a failing stage is still recorded, with its error."""
+        from src.Metrics import metrics
+        
+        m = metrics({'defaults': {'metrics': {'path': str(tmp_path / 'm.jsonl')}}})
+        with pytest.raises(ValueError):
+            with m.stage('tax_csv', 'load', 0):
+                raise ValueError('boom')
+        
+        with open(tmp_path / 'm.jsonl') as f:
+            record = json.loads(f.readline())
+        assert record['stage'] == 'load' and 'boom' in record['error']
+    
+    def test_summary_and_prometheus(self, tmp_path):
+        """Test that records are summed per source and stage and dumped as Prometheus text."""
+        from src.Metrics import metrics
+        
+        m = metrics({'defaults': {}})
+        for rows in (5, 7):
+            m.record('tax_csv', {'stage': 'read', 'rows_out': rows, 'wall_s': 0.5, 'rss_delta_bytes': rows})
+        
+        totals = m.summary()['tax_csv']['read']
+        assert totals['rows_out'] == 12 and totals['calls'] == 2
+        assert totals['wall_s'] == 1.0 and totals['rss_delta_bytes_max'] == 7
+        
+        m.writePrometheus(str(tmp_path / 'm.prom'))
+        with open(tmp_path / 'm.prom') as f:
+            prom = f.read()
+        assert 'pipeline_stage_rows_out_total{source="tax_csv",stage="read"} 12' in prom
+        assert '# TYPE pipeline_stage_rss_delta_bytes_max gauge' in prom
+
+
+class TestReports:
+    """Tests for the aggregated reporting queries."""
+    
+    @pytest.fixture
+    def report(self, tmp_path):
+        """Reports over small lead and tax tables in SQLite."""
+        from src.Connection import connectionManager
+        from src.Reports import reports
+        
+        cfg = {'defaults': {'db_url': f"sqlite:///{tmp_path / 'reports.db'}",
+                            'reports': {'fetch_size': 2, 'percentiles': [0.25, 0.5, 0.9]}}}
+        connections = connectionManager(cfg)
+        rng = np.random.default_rng(1)
+        lead = pd.DataFrame({
+            'zip_code': rng.integers(19100, 19105, 50),
+            'num_screen': rng.integers(1, 100, 50),
+            'num_bll_5plus': rng.integers(0, 5, 50).astype(float),
+            'perc_5plus': rng.uniform(0, 20, 50),
+        })
+        lead.loc[::7, 'perc_5plus'] = np.nan
+        tax = pd.DataFrame({
+            'zip_code': rng.integers(19102, 19108, 40),
+            'num_props': rng.integers(1, 9, 40),
+            'balance': rng.uniform(0, 1e4, 40),
+            'avg_balance': rng.uniform(0, 1e3, 40),
+        })
+        lead.to_sql('lead_levels', connections.engine, index=False)
+        tax.to_sql('tax_levels', connections.engine, index=False)
+        yield reports(cfg, connections), lead, tax
+        connections.dispose()
+    
+    def test_aggregates_match_pandas(self, report):
+        """Test that per-zip sums, means and percentiles computed in SQL match pandas."""
+        report, lead, _ = report
+        
+        got = report.frame('lead_by_zip')
+        
+        grouped = lead.groupby('zip_code')
+        assert got['zip_code'].tolist() == sorted(lead['zip_code'].unique())
+        assert got['row_count'].tolist() == grouped.size().tolist()
+        np.testing.assert_allclose(got['perc_5plus'], grouped['perc_5plus'].mean())
+        for p in (0.25, 0.5, 0.9):
+            np.testing.assert_allclose(got[f'perc_5plus_p{round(p * 100)}'], grouped['perc_5plus'].quantile(p))
+    
+    def test_join_keeps_shared_zip_codes(self, report):
+        """Test that lead levels are joined to tax balances on zip code."""
+        report, lead, tax = report
+        
+        arrays = report.arrays('lead_vs_tax')
+        
+        shared = sorted(set(lead['zip_code']) & set(tax['zip_code']))
+        assert arrays['zip_code'].tolist() == shared
+        np.testing.assert_allclose(arrays['avg_balance'],
+                                   tax.groupby('zip_code')['avg_balance'].mean().loc[shared])
+    
+    def test_batches_stream_fetch_size_rows(self, report):
+        """Test that raw queries stream in fetch_size batches and empty results keep their columns."""
+        report, lead, _ = report
+        
+        batches = list(report.batches('SELECT zip_code FROM lead_levels WHERE zip_code = :zip', {'zip': 19100}))
+        assert all(len(batch) <= 2 for batch in batches)
+        assert sum(len(batch) for batch in batches) == (lead['zip_code'] == 19100).sum()
+        
+        empty = report.frame('SELECT zip_code, perc_5plus FROM lead_levels WHERE zip_code < 0')
+        assert empty.empty and list(empty.columns) == ['zip_code', 'perc_5plus']
+
+
+class TestCharts:
+    """Tests for headless chart rendering."""
+    
+    @pytest.fixture
+    def summary(self):
+        return pd.DataFrame({'zip_code': [19020, 19100, 19150], 'perc_5plus': [5.0, np.nan, 2.5],
+                             'avg_balance': [50.0, 10.0, np.nan]})
+    
+    def test_render_caches_on_data(self, summary, tmp_path):
+        """Test that charts are written once and redrawn only when their data changes."""
+        pytest.importorskip('matplotlib')
+        from src.Charts import chartRenderer
+        
+        renderer = chartRenderer({'defaults': {'charts': {'dir': str(tmp_path), 'formats': ['png', 'svg']}}})
+        
+        first = renderer.render({'lead_vs_tax': ('zip_bars', summary)})['lead_vs_tax']
+        assert not first['cached']
+        assert [os.path.basename(path) for path in first['paths']] == ['lead_vs_tax.png', 'lead_vs_tax.svg']
+        with open(first['paths'][0], 'rb') as f:
+            assert f.read(8) == b'\x89PNG\r\n\x1a\n'
+        
+        with patch('Charts.renderChart') as draw:
+            assert renderer.render({'lead_vs_tax': ('zip_bars', summary.copy())})['lead_vs_tax']['cached']
+            draw.assert_not_called()
+        
+        changed = summary.assign(avg_balance=[50.0, 11.0, np.nan])
+        assert not renderer.render({'lead_vs_tax': ('zip_bars', changed)})['lead_vs_tax']['cached']
+        
+        os.remove(first['paths'][1])
+        assert not renderer.render({'lead_vs_tax': ('zip_bars', changed)})['lead_vs_tax']['cached']
+    
+    def test_render_in_pool(self, summary, tmp_path):
+        """Test that several stale charts are drawn by pool workers."""
+        pytest.importorskip('matplotlib')
+        from src.Charts import chartRenderer
+        
+        renderer = chartRenderer({'defaults': {'charts': {'dir': str(tmp_path), 'workers': 2}}})
+        ibm = pd.DataFrame({'date': ['"10:00"', '"10:05"', '"10:10"'], 'low': [140.0, 141.5, 139.9]})
+        
+        results = renderer.render({'lead_vs_tax': ('zip_bars', summary), 'ibm_intraday': ('intraday', ibm)})
+        
+        assert all(os.path.getsize(result['paths'][0]) > 0 for result in results.values())
+        with pytest.raises(ValueError, match='Unknown chart kind'):
+            renderer.render({'pie': ('pie', summary)})
+
+    def test_graph_out_renders_all_charts_at_once(self, tmp_path):
+        """Test that graphOut renders the zip and intraday charts in one render call."""
+        pytest.importorskip('matplotlib')
+        from sqlalchemy import create_engine
+        from Connection import connectionManager
+        import main
+
+        cfg = {'defaults': {'db_url': f"sqlite:///{tmp_path / 'charts.db'}",
+                            'charts': {'dir': str(tmp_path / 'charts'), 'workers': 2}}}
+        engine = create_engine(cfg['defaults']['db_url'])
+        pd.DataFrame({'zip_code': [19020, 19100], 'num_screen': [10, 20], 'num_bll_5plus': [1, 2],
+                      'perc_5plus': [5.0, 2.5]}).to_sql('lead_levels', engine, index=False)
+        pd.DataFrame({'zip_code': [19020, 19100], 'num_props': [2, 5], 'balance': [100.0, 50.0],
+                      'avg_balance': [50.0, 10.0]}).to_sql('tax_levels', engine, index=False)
+        pd.DataFrame({'date': ['2024-01-02 10:05:00', '2024-01-02 10:00:00'],
+                      'low': [141.5, 140.0]}).to_sql('ibm', engine, index=False)
+
+        connections = connectionManager(cfg)
+        with patch('main.chartRenderer.render', autospec=True, return_value={}) as render:
+            main.graphOut(cfg, connections)
+        connections.dispose()
+
+        charts = render.call_args.args[1]
+        assert render.call_count == 1
+        assert {name: kind for name, (kind, _) in charts.items()} == {'lead_vs_tax': 'zip_bars',
+                                                                      'ibm_intraday': 'intraday'}
+        assert list(charts['ibm_intraday'][1]['low']) == [140.0, 141.5]
+
+
+class TestStage:
+    """Tests for the Arrow IPC stage store."""
+    
+    def test_stage_round_trip(self, tmp_path):
+        """Test that staged frames reopen with their dtypes, index and attrs."""
+        pytest.importorskip('pyarrow')
+        from src.Stage import stageStore
+        
+        stages = stageStore(str(tmp_path))
+        df = pd.DataFrame({'id': pd.array([1, None], dtype='Int64'), 'zip': pd.Categorical(['a', 'b'])},
+                          index=[4, 7])
+        df.attrs['money_cents'] = ['id']
+        stages.write('src', 0, 'valid', df)
+        
+        back = stages.read('src', 0, 'valid')
+        pd.testing.assert_frame_equal(back, df)
+        assert back.attrs == {'money_cents': ['id']}
+        
+        stages.write('src', 1, 'invalid_rules', pd.DataFrame({'zip': [19020, 'Other']}, dtype=object))
+        assert list(stages.read('src', 1, 'invalid_rules')['zip']) == ['19020', 'Other']
+    
+    def test_manifest_discarded_on_config_change(self, tmp_path):
+        """Test that stages from a run with other settings are not resumed."""
+        pytest.importorskip('pyarrow')
+        from src.Stage import stageStore
+        
+        stages = stageStore(str(tmp_path))
+        manifest = stages.manifest('src', 'v1')
+        manifest['chunks']['0'] = {'stage': 'read'}
+        stages.write('src', 0, 'read', pd.DataFrame({'a': [1]}))
+        stages.save('src', manifest)
+        
+        assert stages.manifest('src', 'v1')['chunks'] == {'0': {'stage': 'read'}}
+        assert stages.manifest('src', 'v2')['chunks'] == {}
+        assert not stages.has('src', 0, 'read')
+
+    def test_staged_chunk_cleaned_without_rules(self, config_dict, tmp_path):
+        """Test that a staged chunk validation passes through unchanged is copied before cleaning."""
+        pytest.importorskip('pyarrow')
+        from src.Stage import stageStore
+        from src.Pipeline import transform
+        from src.Validator import validator
+        from src.Compactor import compactor
+        from src.Cleaner import cleaner
+
+        config_dict['sources'][0].update(rules=[], schema={}, clean_method='cleantax')
+        stages = stageStore(str(tmp_path))
+        stages.write('tax_csv', 0, 'read', pd.DataFrame({'objectid': [1, 2], 'num_props': [0.0, 2.0],
+                                                         'balance': [5.0, 0.0]}))
+        staged = stages.read('tax_csv', 0, 'read')
+
+        valid = transform(validator(config_dict), compactor(config_dict), cleaner(config_dict),
+                          staged, 'tax_csv', readonly=True)[0]
+
+        assert valid is not staged
+        assert list(valid['num_props']) == [1.0, 2.0]
+        assert list(staged['num_props']) == [0.0, 2.0]
+
+
+class TestPartition:
+    """Tests for row partitioning and merging."""
+    
+    def test_partitions_keep_keys_together(self):
+        """Test that rows sharing a pk share a partition and keep their order."""
+        from src.Partition import partitionRows
+        
+        df = pd.DataFrame({'id': [3, 1, 3, 2, 1, 3], 'v': range(6)})
+        parts = partitionRows(df, ['id'], 4)
+        
+        assert sorted(np.concatenate(parts)) == list(range(6))
+        for part in parts:
+            assert list(part) == sorted(part)
+            assert all(set(df['id'].iloc[part]).isdisjoint(df['id'].iloc[other]) for other in parts if other is not part)
+    
+    def test_merge_restores_order_and_categoricals(self):
+        """Test that merged partitions follow the original rows and keep categoricals."""
+        from src.Partition import mergePartitions
+        
+        df = pd.DataFrame({'zip': ['a', 'b', 'c', 'd']}, index=[10, 11, 12, 13])
+        first = df.iloc[[1, 3]].astype({'zip': 'category'})
+        second = df.iloc[[0, 2]]
+        first.attrs['money_cents'] = ['x']
+        
+        merged = mergePartitions(df, [first, second])
+        
+        assert list(merged.index) == [10, 11, 12, 13]
+        assert isinstance(merged['zip'].dtype, pd.CategoricalDtype)
+        assert merged.attrs == {'money_cents': ['x']}
+
+    def test_shared_frame_round_trip(self):
+        """Test that a shared frame, its text, categoricals and index outlive the unlinked block."""
+        pytest.importorskip('pyarrow')
+        from multiprocessing import shared_memory
+        from src.Partition import sharedFrame
+
+        df = pd.DataFrame({
+            'zip': pd.Categorical(['a', 'b', 'a']),
+            'name': ['x', None, 'z'],
+            'num': pd.array([1, None, 3], dtype='Int64'),
+        }, index=pd.Index([10, 11, 12], name='row'))
+        df.attrs['money_cents'] = ['num']
+        handle = sharedFrame(df).handle
+
+        loaded = sharedFrame.load(handle, unlink=True)
+
+        pd.testing.assert_frame_equal(loaded, df)
+        assert loaded.attrs == {'money_cents': ['num']}
+        with pytest.raises(FileNotFoundError):
+            shared_memory.SharedMemory(name=handle[0])
+
+class TestState:
+    """Tests for the row fingerprint store."""
+    
+    def test_unchanged_matches_key_and_content(self, tmp_path):
+        """Test that only rows with a known key and identical content are flagged."""
+        from src.State import stateStore
+        
+        store = stateStore(str(tmp_path / 'state.db'))
+        df = pd.DataFrame({'id': [1, 2, 3], 'value': [1.0, 2.0, 3.0]})
+        mask, keys, digests = store.unchanged(df, 'src', ['id'])
+        assert not mask.any()
+        store.commit('src', keys, digests)
+        
+        edited = pd.DataFrame({'id': [1, 2, 4], 'value': [1.0, 2.5, 4.0]})
+        mask, _, _ = store.unchanged(edited, 'src', ['id'])
+        assert list(mask) == [True, False, False]
+    
+    def test_fingerprints_persist_per_source(self, tmp_path):
+        """Test that fingerprints survive a new store and are kept apart per source."""
+        from src.State import stateStore
+        
+        path = str(tmp_path / 'state.db')
+        df = pd.DataFrame({'id': [1, 2], 'value': ['a', 'b']})
+        _, keys, digests = stateStore(path).unchanged(df, 'src', ['id'])
+        stateStore(path).commit('src', keys, digests)
+        
+        reopened = stateStore(path)
+        assert reopened.unchanged(df, 'src', ['id'])[0].all()
+        assert not reopened.unchanged(df, 'other', ['id'])[0].any()
+        
+        reopened.reset('src')
+        assert not stateStore(path).unchanged(df, 'src', ['id'])[0].any()
+    
+    def test_watermark_tied_to_column(self, tmp_path):
+        """Test that a watermark is only returned for the column it was kept on."""
+        from src.State import stateStore
+        
+        store = stateStore(str(tmp_path / 'state.db'))
+        assert store.watermark('src', 'id') is None
+        
+        store.setWatermark('src', 'id', np.int64(42))
+        assert store.watermark('src', 'id') == 42
+        assert store.watermark('src', 'period') is None
+        
+        store.reset('src')
+        assert store.watermark('src', 'id') is None
+
+
 # ===== Parametrized Tests =====
 
 class TestParametrized:
@@ -0,0 +1,60 @@
+"""
+Synthetic source data for the benchmarks, seeded so every run and every
+machine sees the same rows.
+"""
+import numpy as np
+import pandas as pd
+
+
+def taxFrame(rows: int, seed: int = 0) -> pd.DataFrame:
+    """
+    Synthetic rows shaped like real_estate_tax_balances_zip_code.csv.
+
+    Like the real file, some amounts are negative or missing and some zip
+    codes fall outside the city, so the clip/fillna/derive steps and the
+    zip rule all have rows to act on.
+    """
+    rng = np.random.default_rng(seed)
+
+    def money():
+        values = rng.normal(500, 900, rows).round(2)
+        values[rng.random(rows) < 0.01] = np.nan
+        return values
+
+    return pd.DataFrame({
+        'objectid': np.arange(rows),
+        'zip_code': rng.integers(19000, 19180, rows),
+        'num_props': rng.integers(0, 40, rows),
+        'min_period': rng.integers(1990, 2010, rows),
+        'max_period': rng.integers(2010, 2024, rows),
+        'principal': money(),
+        'interest': money(),
+        'penalty': money(),
+        'other': money(),
+        'balance': money(),
+        'avg_balance': money(),
+    })
+
+
+def leadFrame(rows: int, seed: int = 0) -> pd.DataFrame:
+    """
+    Synthetic rows shaped like the Carto child_blood_lead_levels_by_zip query.
+
+    Redacted rows have no counts or percentage, as in the real table, and a
+    few percentages exceed 100 so the perc_5plus rule rejects them.
+    """
+    rng = np.random.default_rng(seed)
+    screened = rng.integers(1, 3000, rows)
+    elevated = (screened * rng.uniform(0, 0.15, rows)).round()
+    redacted = rng.random(rows) < 0.05
+
+    df = pd.DataFrame({
+        'lead_id': np.arange(1, rows + 1),
+        'zip_code': rng.integers(19000, 19180, rows),
+        'num_screen': screened,
+        'num_bll_5plus': np.where(redacted, np.nan, elevated),
+        'perc_5plus': np.where(redacted, np.nan, (elevated / screened * 100).round(1)),
+        'data_redacted': redacted,
+    })
+    df.loc[rng.random(rows) < 0.001, 'perc_5plus'] = 150.0
+    return df
@@ -0,0 +1,58 @@
+"""
+Time validate + clean of one large tax chunk in a single process against
+row partitions over a process pool.
+
+    python benchmarks/partitioned.py --rows 2000000 --processes 1 2 4 8
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import Pipeline
+from data import taxFrame
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--processes', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--config', default=os.path.join(os.path.dirname(__file__), '..', 'config', 'sources.yml'))
+    parser.add_argument('--source', default='tax_csv')
+    args = parser.parse_args()
+
+    with open(args.config) as f:
+        cfg = yaml.safe_load(f)
+    pk = next(src for src in cfg['sources'] if src['name'] == args.source).get('pk')
+    df = taxFrame(args.rows)
+
+    Pipeline._init_worker(cfg)
+    start = time.perf_counter()
+    serial = Pipeline._transform(df.copy(), args.source)
+    baseline = time.perf_counter() - start
+    print(f'{"processes":>9} {"seconds":>9} {"speedup":>8}  rows valid / rejected')
+    print(f'{"serial":>9} {baseline:9.2f} {1:8.2f}  {len(serial[0])} / {len(serial[1]) + len(serial[2])}')
+
+    context = multiprocessing.get_context('forkserver')
+    for processes in args.processes:
+        with ProcessPoolExecutor(processes, mp_context=context,
+                                 initializer=Pipeline._init_worker, initargs=(cfg,)) as pool:
+            # Start the workers before timing
+            list(pool.map(abs, range(processes)))
+            start = time.perf_counter()
+            valid, invalidSchema, invalidRules, _ = Pipeline.transformPartitioned(
+                pool, df, args.source, processes, pk)
+            elapsed = time.perf_counter() - start
+        assert valid.index.equals(serial[0].index), 'partitioned rows differ from the serial run'
+        print(f'{processes:>9} {elapsed:9.2f} {baseline / elapsed:8.2f}  '
+              f'{len(valid)} / {len(invalidSchema) + len(invalidRules)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,247 @@
+"""
+Time each stage of both sources on synthetic data at several sizes, save
+the timings as JSON and compare them with a saved baseline.
+
+    python benchmarks/suite.py --rows 10000 1000000 --output benchmarks/results/current.json
+    python benchmarks/suite.py --rows 10000 --baseline benchmarks/results/baseline.json
+
+Stages are read, validate, clean and load on the whole frame, then the
+full streamed pipeline (skip-unchanged state, chunking and all). Tax rows
+are read from a CSV and lead rows from a local HTTP stand-in for Carto;
+both load into a SQLite file unless --db-url points elsewhere, e.g. at a
+scratch Postgres database. Each stage runs --repeat times and the median
+is kept; load and pipeline start every repeat from a dropped target
+table. With --baseline the run exits 1 if any stage is slower than the
+baseline by more than --tolerance.
+"""
+import argparse
+import copy
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from itertools import count
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+import pandas as pd
+import yaml
+from sqlalchemy import text
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from Reader import reader
+from Validator import validator
+from Cleaner import cleaner
+from Loader import loader
+from Connection import connectionManager
+from Pipeline import pipeline
+from Metrics import measure
+from data import taxFrame, leadFrame
+
+
+SIZES = [10_000, 1_000_000, 10_000_000]
+
+
+class _cartoHandler(BaseHTTPRequestHandler):
+    """Serves the lead rows as one Carto SQL API response."""
+    body = b'{"rows": []}'
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *args):
+        pass
+
+
+def benchConfig(cfg: dict, directory: str, csv_path: str, url: str, db_url: str) -> dict:
+    """The project config pointed at the synthetic data, a scratch database and scratch state."""
+    cfg = copy.deepcopy(cfg)
+    defaults = cfg['defaults']
+    defaults['db_url'] = db_url or f"sqlite:///{os.path.join(directory, 'bench.db')}"
+    defaults['state'] = {'path': os.path.join(directory, 'state.db')}
+    defaults['workers'] = {**defaults.get('workers', {}), 'threads': 1, 'processes': 0, 'partitions': 0}
+    for key in ('stages', 'metrics'):
+        defaults.pop(key, None)
+
+    for src in cfg['sources']:
+        if src['type'] == 'csv':
+            src['path'] = csv_path
+        elif src['type'] == 'api_json':
+            src['path'] = url
+            # One response from the stand-in rather than Carto's paged SQL
+            src.pop('paginate', None)
+            src.pop('cache', None)
+    return cfg
+
+
+def timeStage(repeat: int, run, setup=lambda: None) -> dict:
+    """Run a stage repeat times, each on fresh input from setup, and keep the median."""
+    records = []
+    for _ in range(repeat):
+        args = setup()
+        with measure('bench') as record:
+            run(*(args or ()))
+        records.append(record)
+    seconds = statistics.median(record['wall_s'] for record in records)
+    return {
+        'seconds': seconds,
+        'min_seconds': min(record['wall_s'] for record in records),
+        'cpu_seconds': statistics.median(record['cpu_s'] for record in records),
+        'rss_delta_bytes': max(record['rss_delta_bytes'] for record in records),
+    }
+
+
+def benchSource(cfg: dict, name: str, rows: int, repeat: int, directory: str) -> dict:
+    """Time every stage of one source, returning {stage: timings}."""
+    source = next(src for src in cfg['sources'] if src['name'] == name)
+    r, v, c = reader(cfg), validator(cfg), cleaner(cfg)
+    connections = connectionManager(cfg)
+    l = loader(cfg, connections)
+    results = {}
+
+    df = r.read(name)
+    results['read'] = timeStage(repeat, lambda: r.read(name))
+
+    valid = v.validate(df, name)[0]
+    results['validate'] = timeStage(repeat, lambda: v.validate(df, name))
+
+    results['clean'] = timeStage(repeat, lambda frame: c.cleanSource(frame, name), lambda: (valid.copy(),))
+    c.cleanSource(valid, name)
+
+    table = source.get('target_table') or name
+    def empty():
+        # Each repeat loads into a new table; merging into the last repeat's rows changes nothing
+        with connections.begin() as conn:
+            conn.execute(text(f'DROP TABLE IF EXISTS "{table}"'))
+
+    def load():
+        if not l.load(valid, table, if_exists='replace', pk=source.get('pk'), on_conflict=source.get('on_conflict')):
+            raise RuntimeError(f'Loading {name} failed')
+    results['load'] = timeStage(repeat, load, empty)
+
+    def streamed(run_cfg):
+        p = pipeline(run_cfg)
+        result = p.runSource(name)
+        p.connections.dispose()
+        if result['error'] is not None:
+            raise result['error']
+
+    runs = count()
+    def fresh():
+        # A new table and state file each time, so no run skips or merges rows an earlier one loaded
+        empty()
+        run_cfg = copy.deepcopy(cfg)
+        run_cfg['defaults']['state']['path'] = os.path.join(directory, f'state-{name}-{next(runs)}.db')
+        return (run_cfg,)
+    results['pipeline'] = timeStage(repeat, streamed, fresh)
+    connections.dispose()
+
+    for timings in results.values():
+        timings['rows_per_second'] = rows / timings['seconds'] if timings['seconds'] else None
+    return results
+
+
+def environment() -> dict:
+    """What the timings depend on besides the code, recorded with them."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'commit': commit,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def compare(current: dict, baseline: dict, tolerance: float) -> list:
+    """Print current timings against the baseline and return the stages that regressed."""
+    before = {(r['source'], r['rows'], r['stage']): r for r in baseline['results']}
+    regressions = []
+    print(f'\n{"source":<10} {"rows":>10} {"stage":<9} {"baseline":>9} {"current":>9} {"ratio":>6}')
+    for result in current['results']:
+        key = (result['source'], result['rows'], result['stage'])
+        if key not in before:
+            continue
+        ratio = result['seconds'] / before[key]['seconds'] if before[key]['seconds'] else float('inf')
+        flag = ''
+        if ratio > 1 + tolerance:
+            regressions.append(key)
+            flag = '  slower'
+        print(f'{key[0]:<10} {key[1]:>10} {key[2]:<9} {before[key]["seconds"]:9.3f} '
+              f'{result["seconds"]:9.3f} {ratio:6.2f}{flag}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--sources', nargs='+', default=['tax_csv', 'lead_api'])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--config', default=os.path.join(os.path.dirname(__file__), '..', 'config', 'sources.yml'))
+    parser.add_argument('--db-url', help='database to load into instead of a scratch SQLite file')
+    parser.add_argument('--output', help='JSON file the results are written to')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='slowdown over the baseline counted as a regression (0.2 = 20%%)')
+    args = parser.parse_args()
+
+    with open(args.config) as f:
+        cfg = yaml.safe_load(f)
+
+    current = {'environment': environment(), 'seed': args.seed, 'repeat': args.repeat, 'results': []}
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _cartoHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_port}/api/v2/sql'
+
+    print(f'{"source":<10} {"rows":>10} {"stage":<9} {"seconds":>9} {"rows/s":>12}')
+    try:
+        for rows in args.rows:
+            with tempfile.TemporaryDirectory() as directory:
+                csv_path = os.path.join(directory, 'tax.csv')
+                taxFrame(rows, args.seed).to_csv(csv_path, index=False)
+                leads = leadFrame(rows, args.seed).to_json(orient='records')
+                _cartoHandler.body = f'{{"rows": {leads}}}'.encode()
+                run_cfg = benchConfig(cfg, directory, csv_path, url, args.db_url)
+
+                for name in args.sources:
+                    for stage, timings in benchSource(run_cfg, name, rows, args.repeat, directory).items():
+                        current['results'].append({'source': name, 'rows': rows, 'stage': stage, **timings})
+                        print(f'{name:<10} {rows:>10} {stage:<9} {timings["seconds"]:9.3f} '
+                              f'{timings["rows_per_second"]:12,.0f}')
+    finally:
+        server.shutdown()
+
+    if args.output:
+        if os.path.dirname(args.output):
+            os.makedirs(os.path.dirname(args.output), exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump(current, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(current, baseline, args.tolerance)
+        if regressions:
+            print(f'\n{len(regressions)} stage(s) slower than the baseline by more than {args.tolerance:.0%}')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,17 @@
+import os
+import sys
 import psycopg2 as psy
 import pandas as pd
 from sqlalchemy import create_engine
 import requests
 import matplotlib.pyplot as plt
 import json
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'src'))
+
+from Charts import chartRenderer
+from Reader import reader
 
 
 def csvReader() -> pd.DataFrame:
@@ -23,31 +31,29 @@ def trogdorDF() :
 
     return df
 
+def loadConfig():
+    with open(os.path.join(os.path.dirname(__file__), 'config', 'sources.yml')) as f:
+        return yaml.safe_load(f)
+
 def ibmDF():
     url = "https://www.alphavantage.co/query?function=TIME_SERIES_INTRADAY&symbol=IBM&interval=5min&outputsize=full&apikey=demo"
-    response = requests.get(url)
 
-    if response.status_code == 200:
-        data = response.json()
-        imp = []
+    cfg = loadConfig()
+    # The ibm_intraday json_stream source, pointed at the live API rather than Holder.json
+    source = next(src for src in cfg['sources'] if src['name'] == 'ibm_intraday')
 
-        for item in data["Time Series (5min)"]:
-            imp.append(data["Time Series (5min)"][item])
-
-        df = pd.DataFrame(imp, index=data["Time Series (5min)"])
-        df['5. volume'] = df['5. volume'].astype(float)
-        df['4. close'] = df['4. close'].astype(float)
-        df['3. low'] = df['3. low'].astype(float)
-        df['2. high'] = df['2. high'].astype(float)
-        df['1. open'] = df['1. open'].astype(float)
+    try:
+        df = reader({'sources': [{**source, 'path': url}]}).read('ibm_intraday')
+    except requests.exceptions.RequestException:
+        return None
+    if df.empty:
+        # e.g. a rate limit note in place of the time series
+        return None
 
-        df = df.rename(columns={'1. open': 'open', '2. high': 'high', '3. low': 'low', '4. close': 'close', '5. volume': 'volume'})
-        df['date'] = data["Time Series (5min)"].keys()
-        df['date'] = df['date'].apply(json.dumps)
+    df.index = df['date'].to_numpy()
+    df['date'] = df['date'].apply(json.dumps)
 
-        return df
-    else:
-        return None
+    return df
 
 def progreSQLTest(df):
 
@@ -107,11 +113,13 @@ def progreSQLTest(df):
                 print("PostgreSQL connection closed.")
 
 def ibmPlot(df):
-    df.plot(kind='line', x='date', y='low', legend=False, color='red', title='Stocks')
-    plt.ylabel('USD (thousands)')
-    plt.show()
+    # Written under defaults.charts.dir without a display; skipped if the prices are unchanged
+    result = chartRenderer(loadConfig()).render({'ibm_intraday': ('intraday', df)})['ibm_intraday']
+    print(f"IBM chart {'unchanged' if result['cached'] else 'rendered'}: {', '.join(result['paths'])}")
 
 
-ibmPlot(ibmDF())
+df = ibmDF()
+if df is not None:
+    ibmPlot(df)
 
 #ibmPlot(ibmDF())
\ No newline at end of file
@@ -0,0 +1,141 @@
+#Cache
+import hashlib
+import json
+import os
+import threading
+import time
+import pandas as pd
+from typing import Dict, Optional
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+
+class responseCache:
+    """
+    On-disk cache of decoded API responses, keyed on the request URL.
+
+    Frames are kept as Parquet files, which hold only data, so a file
+    dropped into the cache directory cannot run code when it is loaded.
+    Without pyarrow nothing is cached.
+    """
+
+    def __init__(self, directory: str, ttl: float = 0, max_bytes: Optional[int] = None):
+        """
+        Args:
+            directory: Folder the cached frames and their metadata are kept in
+            ttl: Seconds a cached response is used without asking the server
+            max_bytes: Evict least recently used entries beyond this size
+        """
+
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _paths(self, url: str) -> tuple:
+        key = hashlib.sha256(url.encode()).hexdigest()
+        base = os.path.join(self.directory, key)
+        return base + '.parquet', base + '.json'
+
+    def meta(self, url: str) -> Optional[Dict]:
+        """Return the stored metadata for a URL, or None if it is not cached."""
+        data, meta = self._paths(url)
+        if not os.path.exists(data) or not os.path.exists(meta):
+            return None
+        with open(meta, 'r') as file:
+            return json.load(file)
+
+    def fresh(self, url: str) -> bool:
+        """True if the URL was fetched or revalidated less than ttl seconds ago."""
+        meta = self.meta(url)
+        return meta is not None and time.time() - meta['checked'] < self.ttl
+
+    def headers(self, url: str) -> Dict[str, str]:
+        """Conditional request headers for a cached URL."""
+        meta = self.meta(url) or {}
+        headers = {}
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+        return headers
+
+    def load(self, url: str) -> Optional[pd.DataFrame]:
+        """Return the cached frame for a URL, or None if it has been evicted."""
+        if pyarrow is None:
+            return None
+
+        data, _ = self._paths(url)
+        with self.lock:
+            try:
+                df = pd.read_parquet(data, engine='pyarrow')
+            except FileNotFoundError:
+                return None
+            # Mark as recently used for eviction
+            os.utime(data)
+        return df
+
+    def revalidated(self, url: str):
+        """Record that the server confirmed the cached copy is current."""
+        data, meta = self._paths(url)
+        entry = self.meta(url)
+        if entry is not None:
+            entry['checked'] = time.time()
+            self._write(meta, json.dumps(entry).encode())
+
+    def store(self, url: str, df: pd.DataFrame, headers: Dict[str, str]):
+        """Cache a decoded response along with its validators, unless Parquet cannot hold it."""
+        if pyarrow is None:
+            return
+
+        data, meta = self._paths(url)
+        entry = {
+            'url': url,
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+            'checked': time.time(),
+        }
+
+        with self.lock:
+            tmp = f'{data}.{threading.get_ident()}.tmp'
+            try:
+                df.to_parquet(tmp, engine='pyarrow')
+            except (pyarrow.ArrowException, TypeError, ValueError):
+                # e.g. a column mixing numbers and text; such responses go uncached
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                return
+            os.replace(tmp, data)
+            self._write(meta, json.dumps(entry).encode())
+            self._evict()
+
+    def _write(self, path: str, body: bytes):
+        tmp = f'{path}.{threading.get_ident()}.tmp'
+        with open(tmp, 'wb') as file:
+            file.write(body)
+        os.replace(tmp, path)
+
+    def _evict(self):
+        """Remove least recently used entries until the cache fits in max_bytes."""
+        if self.max_bytes is None:
+            return
+
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.parquet'):
+                path = os.path.join(self.directory, name)
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            os.remove(path[:-len('.parquet')] + '.json')
+            total -= size
@@ -0,0 +1,131 @@
+#Charts
+import hashlib
+import json
+import multiprocessing
+import os
+import matplotlib
+import numpy as np
+import pandas as pd
+import yaml
+from concurrent.futures import ProcessPoolExecutor
+from matplotlib.figure import Figure
+from typing import Any, Dict, List, Tuple
+
+# Never open a window, whoever imports pyplot after us
+matplotlib.use('Agg')
+
+
+def drawZipBars(df: pd.DataFrame, fig: Figure):
+    """Lead levels and tax balances per zip code, one bar chart above the other."""
+    axs = fig.subplots(2)
+    fig.suptitle('Compare')
+    for ax, column, color in ((axs[0], 'perc_5plus', 'red'), (axs[1], 'avg_balance', 'blue')):
+        rows = df[df[column].notna()]
+        ax.bar(rows['zip_code'].to_numpy(), rows[column].to_numpy(dtype=float), color=color)
+        ax.set_ylabel(column)
+
+
+def drawIntraday(df: pd.DataFrame, fig: Figure):
+    """A stock's low price over the day's intervals."""
+    ax = fig.subplots()
+    ax.plot(df['date'].to_numpy(), df['low'].to_numpy(dtype=float), color='red')
+    ax.set_title('Stocks')
+    ax.set_ylabel('USD (thousands)')
+    ax.tick_params(axis='x', labelbottom=False)
+
+
+# Chart kinds and the functions drawing them; module level so pool workers can find them
+CHARTS = {
+    'zip_bars': drawZipBars,
+    'intraday': drawIntraday,
+}
+
+
+def renderChart(kind: str, df: pd.DataFrame, paths: List[str]):
+    """Draw one chart and save it in each requested format (by path suffix)."""
+    fig = Figure(figsize=(10, 6))
+    CHARTS[kind](df, fig)
+    for path in paths:
+        tmp = f'{path}.tmp'
+        fig.savefig(tmp, format=os.path.splitext(path)[1][1:])
+        os.replace(tmp, path)
+
+
+def dataHash(kind: str, df: pd.DataFrame) -> str:
+    """Hash of a chart's kind and data, values and labels alike."""
+    digest = hashlib.sha256(kind.encode())
+    digest.update(json.dumps([str(col) for col in df.columns]).encode())
+    digest.update(np.ascontiguousarray(pd.util.hash_pandas_object(df, index=True).to_numpy()).tobytes())
+    return digest.hexdigest()
+
+
+class chartRenderer:
+    """
+    Renders charts headless to image files, skipping those whose data is unchanged.
+
+    Each chart is keyed on a hash of the query result it is drawn from. The
+    keys of the last render are kept beside the images, so a chart whose
+    data hashes the same and whose files exist is not drawn again. Stale
+    charts are drawn in a process pool when there are several of them.
+    """
+
+    def __init__(self, cfg: yaml):
+        """
+        Args:
+            cfg: Parsed YAML configuration; defaults.charts sets the directory, formats and workers
+        """
+
+        settings = cfg.get('defaults', {}).get('charts') or {}
+        self.directory = settings.get('dir', 'charts')
+        self.formats = settings.get('formats', ['png'])
+        self.workers = settings.get('workers', 1)
+        self.manifest = os.path.join(self.directory, 'charts.json')
+
+    def _keys(self) -> Dict[str, str]:
+        try:
+            with open(self.manifest) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def paths(self, name: str) -> List[str]:
+        return [os.path.join(self.directory, f'{name}.{fmt}') for fmt in self.formats]
+
+    def render(self, charts: Dict[str, Tuple[str, pd.DataFrame]]) -> Dict[str, Dict[str, Any]]:
+        """
+        Render charts to files and return each one's paths and whether the cache served it.
+
+        Args:
+            charts: {name: (kind, data)}, kind being one of CHARTS
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        keys = self._keys()
+        results, stale = {}, {}
+        for name, (kind, df) in charts.items():
+            if kind not in CHARTS:
+                raise ValueError(f"Unknown chart kind '{kind}'")
+            key = dataHash(kind, df)
+            paths = self.paths(name)
+            cached = keys.get(name) == key and all(os.path.exists(path) for path in paths)
+            results[name] = {'paths': paths, 'cached': cached}
+            if not cached:
+                stale[name] = (kind, df, paths, key)
+
+        if self.workers > 1 and len(stale) > 1:
+            method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            with ProcessPoolExecutor(min(self.workers, len(stale)),
+                                     mp_context=multiprocessing.get_context(method)) as pool:
+                futures = {name: pool.submit(renderChart, kind, df, paths)
+                           for name, (kind, df, paths, _) in stale.items()}
+                for future in futures.values():
+                    future.result()
+        else:
+            for kind, df, paths, _ in stale.values():
+                renderChart(kind, df, paths)
+
+        # Recorded once the images are written, so a failed render is retried next time
+        keys.update({name: key for name, (_, _, _, key) in stale.items()})
+        with open(f'{self.manifest}.tmp', 'w') as f:
+            json.dump(keys, f)
+        os.replace(f'{self.manifest}.tmp', self.manifest)
+        return results
@@ -1,6 +1,9 @@
 #Cleaner
+import json
+import numpy as np
 import pandas as pd
 import yaml
+from Planner import cleaningPlan
 
 class cleaner:
 
@@ -12,66 +15,119 @@ class cleaner:
 
         self.config = cfg
         self.sources = {src['name']: src for src in self.config.get('sources', [])}
-    
-    def clean(self, df: pd.DataFrame):
-        df.drop_duplicates(inplace=True)
+        self.workers = self.config.get('defaults', {}).get('workers', {}).get('columns', 1)
+
+        # Clean steps compiled per source, rebuilt only if that source's steps change
+        self._plans = {}
+        for name, src in self.sources.items():
+            if src.get('clean'):
+                self._plan(name)
 
+    def _plan(self, source_name: str) -> cleaningPlan:
+        """Return the compiled cleaning plan for a source."""
+        steps = self.sources[source_name]['clean']
+        fingerprint = json.dumps(steps, sort_keys=True, default=str)
 
-        df['num_bll_5plus'].fillna(2,inplace=True)
-        df['perc_5plus'].fillna(df['num_bll_5plus']/df['num_screen']*100,inplace=True)
+        plan = self._plans.get(source_name)
+        if plan is None or plan[0] != fingerprint:
+            plan = (fingerprint, cleaningPlan(steps, workers=self.workers))
+            self._plans[source_name] = plan
+
+        return plan[1]
+    
+    def cleanSource(self, df: pd.DataFrame, source_name: str):
+        """
+        Clean a DataFrame with the source's declarative clean steps, or with
+        the method named by its clean_method if it has none.
+        """
+        if source_name not in self.sources:
+            raise ValueError(f"Source '{source_name}' not found in config")
+
+        if self.sources[source_name].get('clean'):
+            self._plan(source_name).run(df)
+        else:
+            getattr(self, self.sources[source_name].get('clean_method', 'clean'))(df)
+    
+    def clean(self, df: pd.DataFrame):
+        """Alias of cleanlead, kept for existing callers."""
+        return self.cleanlead(df)
     
     def cleanlead(self, df: pd.DataFrame):
+        """
+        Clean lead data in place: drop duplicates, default num_bll_5plus to 2
+        and derive missing perc_5plus from num_bll_5plus / num_screen.
+
+        Columns are assigned back on the frame rather than filled in place
+        through column views, which copy-on-write pandas ignores.
+        """
         df.drop_duplicates(inplace=True)
 
+        df['num_bll_5plus'] = df['num_bll_5plus'].fillna(2)
+
+        perc = df['perc_5plus'].to_numpy(dtype=float, na_value=np.nan, copy=True)
+        missing = np.isnan(perc)
+        if missing.any():
+            bll = df['num_bll_5plus'].to_numpy(dtype=float, na_value=np.nan)
+            screen = df['num_screen'].to_numpy(dtype=float, na_value=np.nan)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                perc[missing] = bll[missing] / screen[missing] * 100
+            df['perc_5plus'] = perc
 
-        df['num_bll_5plus'].fillna(2,inplace=True)
-        df['perc_5plus'].fillna(df['num_bll_5plus']/df['num_screen']*100,inplace=True)
+        return df
     
     def cleantax(self, df: pd.DataFrame):
+        """
+        Clean tax balances in place as a few operations over one float matrix
+        of the financial columns: clip negatives, zero NaNs, rebuild a zero
+        balance from its components, derive avg_balance, round, and write the
+        matrix back in a single assignment.
+        """
         df.drop_duplicates(inplace=True)
 
         # Financial columns that should not be negative
         financial_cols = ['principal', 'interest', 'penalty', 'other', 'balance', 'avg_balance']
-        
-        for col in financial_cols:
-            if col in df.columns:
-                # Replace negative values with 0
-                df.loc[df[col] < 0, col] = 0
-                
-                # Fill NaN with 0 for financial columns
-                df[col].fillna(0, inplace=True)
-        
-        # Calculate balance from components if balance is missing or 0
-        if all(col in df.columns for col in ['principal', 'interest', 'penalty', 'other', 'balance']):
-            # Only recalculate if balance is 0 or NaN but components exist
-            mask = ((df['balance'] == 0) | (df['balance'].isna())) & (
-                (df['principal'] > 0) | (df['interest'] > 0) | 
-                (df['penalty'] > 0) | (df['other'] > 0)
-            )
-            df.loc[mask, 'balance'] = (
-                df.loc[mask, 'principal'] + 
-                df.loc[mask, 'interest'] + 
-                df.loc[mask, 'penalty'] + 
-                df.loc[mask, 'other']
-            )
-        
+        cols = [col for col in financial_cols if col in df.columns]
+        if not cols:
+            return df
+        idx = {col: i for i, col in enumerate(cols)}
+        cents = [col for col in df.attrs.get('money_cents', []) if col in idx]
+
+        # The one copy: every financial column as a single writable float matrix
+        money = df[cols].to_numpy(dtype=float, na_value=np.nan, copy=True)
+
+        # Replace negative values and NaN with 0
+        np.clip(money, 0, None, out=money)
+        np.nan_to_num(money, copy=False, nan=0.0)
+
+        # Calculate balance from components if balance is 0 but components exist
+        components = ['principal', 'interest', 'penalty', 'other']
+        if all(col in idx for col in components + ['balance']):
+            parts = money[:, [idx[col] for col in components]]
+            mask = (money[:, idx['balance']] == 0) & (parts > 0).any(axis=1)
+            money[mask, idx['balance']] = parts[mask].sum(axis=1)
+
+        props = None
+        if 'num_props' in df.columns:
+            props = df['num_props'].to_numpy(dtype=float, na_value=np.nan)
+
         # Calculate avg_balance from balance and num_props if missing
-        if all(col in df.columns for col in ['balance', 'num_props', 'avg_balance']):
-            mask = (df['avg_balance'].isna() | (df['avg_balance'] == 0)) & (
-                df['num_props'] > 0
-            )
-            df.loc[mask, 'avg_balance'] = (
-                df.loc[mask, 'balance'] / df.loc[mask, 'num_props']
-            )
-        
+        if props is not None and 'balance' in idx and 'avg_balance' in idx:
+            mask = (money[:, idx['avg_balance']] == 0) & (props > 0)
+            money[mask, idx['avg_balance']] = money[mask, idx['balance']] / props[mask]
+
+        # Round financial values to 2 decimal places (whole cents if compacted)
+        np.round(money, 2, out=money)
+        for col in cents:
+            money[:, idx[col]] = np.round(money[:, idx[col]])
+
+        df[cols] = money
+        for col in cents:
+            df[col] = df[col].astype('Int64')
+
         # Ensure num_props is at least 1 if there's a balance
-        if 'num_props' in df.columns and 'balance' in df.columns:
-            mask = (df['balance'] > 0) & ((df['num_props'].isna()) | (df['num_props'] == 0))
-            df.loc[mask, 'num_props'] = 1
-        
-        # Round financial values to 2 decimal places
-        for col in financial_cols:
-            if col in df.columns:
-                df[col] = df[col].round(2)
-        
+        if props is not None and 'balance' in idx:
+            mask = (money[:, idx['balance']] > 0) & (np.isnan(props) | (props == 0))
+            if mask.any():
+                df.loc[mask, 'num_props'] = 1
 
+        return df
@@ -0,0 +1,65 @@
+#Compactor
+import pandas as pd
+import yaml
+from typing import Dict, Any
+
+
+class compactor:
+    """Shrinks validated frames before cleaning: narrower ints, categoricals, money as cents."""
+
+    def __init__(self, cfg: yaml):
+        """      
+        Args:
+            cfg: Parsed YAML configuration
+        """
+
+        self.config = cfg
+        self.sources = {src['name']: src for src in self.config.get('sources', [])}
+        self.defaults = self.config.get('defaults', {}).get('compact', {})
+
+    def settings(self, source_name: str) -> Dict[str, Any]:
+        """The source's compact block layered over defaults.compact."""
+        return {**self.defaults, **(self.sources[source_name].get('compact') or {})}
+
+    def enabled(self, source_name: str) -> bool:
+        return bool(self.settings(source_name).get('enabled', False))
+
+    def compact(self, df: pd.DataFrame, source_name: str) -> tuple:
+        """
+        Compact a DataFrame in place and report the bytes saved.
+
+        Integer columns are downcast to the smallest width that holds their
+        values, configured (or low-cardinality text) columns become
+        categoricals and money_cents columns become Int64 cents. The cents
+        columns are recorded in df.attrs['money_cents'] for the cleaner and
+        loader.
+
+        Args:
+            df: The validated pandas DataFrame
+            source_name: Name of the source in the YAML config
+        """
+        if source_name not in self.sources:
+            raise ValueError(f"Source '{source_name}' not found in config")
+
+        settings = self.settings(source_name)
+        categoricals = set(settings.get('categoricals') or [])
+        money_cents = [col for col in settings.get('money_cents') or [] if col in df.columns]
+        max_ratio = settings.get('category_max_ratio', 0.5)
+
+        before = int(df.memory_usage(deep=True).sum())
+
+        for col in money_cents:
+            df[col] = (pd.to_numeric(df[col], errors='coerce') * 100).round().astype('Int64')
+        if money_cents:
+            df.attrs['money_cents'] = money_cents
+
+        for col in df.columns:
+            series = df[col]
+            if col in categoricals or (pd.api.types.is_string_dtype(series.dtype) and len(series)
+                                       and series.nunique() / len(series) <= max_ratio):
+                df[col] = series.astype('category')
+            elif pd.api.types.is_integer_dtype(series.dtype) and col not in money_cents:
+                df[col] = pd.to_numeric(series, downcast='integer')
+
+        saved = before - int(df.memory_usage(deep=True).sum())
+        return df, saved
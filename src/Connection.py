@@ -0,0 +1,107 @@
+#Connection
+import threading
+import time
+import sqlalchemy
+import yaml
+from contextlib import contextmanager
+from sqlalchemy import event
+from sqlalchemy.engine import Engine, make_url
+from typing import Dict, Any
+
+
+class connectionManager:
+    """One pooled SQLAlchemy engine for defaults.db_url, shared by every component."""
+
+    def __init__(self, cfg: yaml):
+        """      
+        Args:
+            cfg: Parsed YAML configuration
+        """
+
+        self.defaults = cfg.get('defaults', {})
+        self.db_url = self.defaults['db_url']
+        self.pool = self.defaults.get('pool', {})
+
+        self._engine = None
+        self.lock = threading.Lock()
+        self.stats = {'checkouts': 0, 'connections_opened': 0,
+                      'wait_seconds_total': 0.0, 'wait_seconds_max': 0.0}
+
+    @property
+    def engine(self) -> Engine:
+        """The shared engine, created on first use."""
+        with self.lock:
+            if self._engine is None:
+                self._engine = sqlalchemy.create_engine(self.db_url, **self._poolArgs())
+                if isinstance(self._engine, Engine):
+                    event.listen(self._engine, 'connect', self._opened)
+                    event.listen(self._engine, 'checkout', self._checkedOut)
+        return self._engine
+
+    def _poolArgs(self) -> Dict[str, Any]:
+        args = {'pool_pre_ping': self.pool.get('pre_ping', True)}
+
+        # SQLite pools are per-thread/file and take no sizing options
+        if make_url(self.db_url).get_backend_name() != 'sqlite':
+            options = {'size': 'pool_size', 'max_overflow': 'max_overflow',
+                       'timeout': 'pool_timeout', 'recycle': 'pool_recycle'}
+            for key, arg in options.items():
+                if key in self.pool:
+                    args[arg] = self.pool[key]
+
+        return args
+
+    def _opened(self, dbapi_connection, connection_record):
+        with self.lock:
+            self.stats['connections_opened'] += 1
+
+    def _checkedOut(self, dbapi_connection, connection_record, connection_proxy):
+        with self.lock:
+            self.stats['checkouts'] += 1
+
+    def _waited(self, seconds: float):
+        with self.lock:
+            self.stats['wait_seconds_total'] += seconds
+            self.stats['wait_seconds_max'] = max(self.stats['wait_seconds_max'], seconds)
+
+    @contextmanager
+    def begin(self):
+        """Check out a pooled connection inside a transaction."""
+        engine = self.engine
+        start = time.perf_counter()
+        with engine.begin() as conn:
+            self._waited(time.perf_counter() - start)
+            yield conn
+
+    @contextmanager
+    def connect(self):
+        """Check out a pooled connection without starting a transaction."""
+        engine = self.engine
+        start = time.perf_counter()
+        with engine.connect() as conn:
+            self._waited(time.perf_counter() - start)
+            yield conn
+
+    def raw_connection(self):
+        """Check out a pooled DBAPI connection; close() returns it to the pool."""
+        engine = self.engine
+        start = time.perf_counter()
+        conn = engine.raw_connection()
+        self._waited(time.perf_counter() - start)
+        return conn
+
+    def metrics(self) -> Dict[str, Any]:
+        """Connection reuse and pool wait figures since the engine was created."""
+        with self.lock:
+            metrics = dict(self.stats)
+        metrics['connections_reused'] = max(metrics['checkouts'] - metrics['connections_opened'], 0)
+        if isinstance(self._engine, Engine):
+            metrics['pool_status'] = self._engine.pool.status()
+        return metrics
+
+    def dispose(self):
+        """Close every pooled connection."""
+        with self.lock:
+            if self._engine is not None:
+                self._engine.dispose()
+                self._engine = None
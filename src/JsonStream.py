@@ -0,0 +1,108 @@
+#JsonStream
+import json
+import numpy as np
+import pandas as pd
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+
+# Parse dtypes whose columns are built as float64 arrays straight from the decoded values
+_NUMERIC = ('float64', 'float32', 'Int64')
+
+
+def recordColumns(pairs: List[Tuple[Optional[str], dict]], key: Optional[str] = None,
+                  names: Optional[Dict[str, str]] = None, dtypes: Optional[Dict[str, str]] = None,
+                  fields: Optional[Dict[str, None]] = None) -> pd.DataFrame:
+    """
+    Turn a batch of decoded records into a frame a column at a time.
+
+    Each field is gathered across the batch in one pass and numeric schema
+    columns become float64 arrays directly, NumPy parsing numeric strings
+    such as "306.4600" itself, rather than one astype per column after a
+    frame of objects is built. Fields a record lacks are missing values.
+
+    Args:
+        pairs: (member name, record) for each record in the batch
+        key: Column the member names go in, if any
+        names: Renames from JSON field names to column names
+        dtypes: Parse dtypes of the (renamed) columns
+        fields: Fields seen in earlier batches, updated with this one's, so
+            every batch of a stream has the same columns
+    """
+    names, dtypes = names or {}, dtypes or {}
+    fields = {} if fields is None else fields
+    fields.update(dict.fromkeys(field for _, record in pairs for field in record))
+
+    data = {key: np.array([name for name, _ in pairs], dtype=object)} if key else {}
+    for field in fields:
+        col = names.get(field, field)
+        values = [record.get(field) for _, record in pairs]
+        if dtypes.get(col) in _NUMERIC:
+            try:
+                data[col] = np.array(values, dtype=np.float64)
+                continue
+            except (ValueError, TypeError):
+                # Dirty values are left to the validator's conversion step
+                pass
+        data[col] = np.array(values, dtype=object)
+    return pd.DataFrame(data)
+
+
+def _container(document: Any, records: List[str]) -> Any:
+    for name in records:
+        document = document.get(name) if isinstance(document, dict) else None
+    return document
+
+
+def jsonRecords(source, records: List[str], keyed: bool) -> Iterable[Tuple[Optional[str], dict]]:
+    """
+    (member name, record) pairs of a JSON document's records.
+
+    With ijson installed records are decoded one at a time as the stream is
+    read (by its C backend where available), so neither the document nor a
+    list of its records is ever held whole. Otherwise the document is
+    decoded with json.load first.
+
+    Args:
+        source: Binary file object of the document
+        records: Key path from the root to the object (keyed) or array of records
+        keyed: Whether the records are the members of an object rather than an array
+    """
+    if ijson is not None:
+        prefix = '.'.join(records)
+        if keyed:
+            return ijson.kvitems(source, prefix, use_float=True)
+        return ((None, record) for record in ijson.items(source, f'{prefix}.item' if prefix else 'item',
+                                                         use_float=True))
+
+    container = _container(json.load(source), records)
+    if keyed:
+        return container.items() if isinstance(container, dict) else ()
+    return ((None, record) for record in container) if isinstance(container, list) else ()
+
+
+def streamJson(source, records: List[str], key: Optional[str] = None, names: Optional[Dict[str, str]] = None,
+               dtypes: Optional[Dict[str, str]] = None, batch_size: Optional[int] = None) -> Iterator[pd.DataFrame]:
+    """
+    Decode a JSON document's records into frames of up to batch_size rows.
+
+    An object of records (e.g. Alphavantage's "Time Series (5min)") needs
+    key, the column its member names go in; without it the records are an
+    array (e.g. Carto's "rows"). Members that are not objects are skipped.
+    At least one (possibly empty) frame is always yielded.
+    """
+    pairs = ((name, record) for name, record in jsonRecords(source, records, bool(key))
+             if isinstance(record, dict))
+    fields, yielded = {}, False
+    while True:
+        batch = list(islice(pairs, batch_size)) if batch_size else list(pairs)
+        if batch or not yielded:
+            yield recordColumns(batch, key, names, dtypes, fields)
+            yielded = True
+        if not batch or not batch_size:
+            return
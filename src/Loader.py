@@ -1,24 +1,316 @@
 #Loader
+import io
+import os
+import shutil
+import uuid
 import pandas as pd
 import yaml
-from sqlalchemy import create_engine
+from sqlalchemy import inspect, text, Numeric
+from sqlalchemy.engine import make_url
+from typing import Iterable, List, Optional
+from Connection import connectionManager
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as pads
+except ImportError:
+    pa = None
+
+
+# zip_summary columns, aggregated per zip code from the lead and tax tables
+SUMMARY_COLUMNS = {
+    'lead': {'num_screen': 'SUM', 'perc_5plus': 'AVG'},
+    'tax': {'num_props': 'SUM', 'balance': 'SUM', 'avg_balance': 'AVG'},
+}
 
 class loader:
     
-    def __init__(self, cfg: yaml):
+    def __init__(self, cfg: yaml, connections: Optional[connectionManager] = None):
         """      
         Args:
             config_path: Path to the YAML configuration file
+            connections: Shared connection manager, one is built if not given
         """
 
         self.defaults = cfg.get('defaults', {})
         self.db_url = self.defaults['db_url']
+        self.connections = connections or connectionManager(cfg)
+        self.batch_size = self.defaults.get('batch_size')
+
+        # Per-zip summary of the lead and tax tables, refreshed by each load into either
+        summary = self.defaults.get('summary')
+        self.summary = {'table': 'zip_summary', 'lead': 'lead_levels', 'tax': 'tax_levels', **summary} \
+            if summary else None
+
+    @property
+    def postgres(self) -> bool:
+        return make_url(self.db_url).get_backend_name() == 'postgresql'
     
-    def load(self, df: pd.DataFrame, name: str):
-        engine = create_engine(self.db_url)
+    def summarizes(self, name: str) -> bool:
+        """Whether loads into a table feed zip_summary."""
+        return bool(self.summary) and name in (self.summary['lead'], self.summary['tax'])
+
+    def load(self, df: pd.DataFrame, name: str, if_exists: str = 'replace',
+             pk: Optional[List[str]] = None, on_conflict: Optional[str] = None, summarize: bool = True) -> bool:
+        """
+        Write a DataFrame (or one chunk of a streamed source) to a table and
+        return whether it was written.
+
+        With a pk and an on_conflict mode of append, upsert or fail the rows
+        are merged into the table through a staging table. Otherwise the
+        table is replaced or appended to according to if_exists; PostgreSQL
+        targets are bulk loaded with COPY FROM STDIN and anything else
+        (e.g. SQLite in tests) goes through DataFrame.to_sql.
+
+        Loading into the summary's lead or tax table also refreshes the
+        zip_summary rows of the zip codes in df, in the same transaction,
+        unless summarize is False; a streamed source then calls summarize
+        once after its last chunk instead.
+
+        Args:
+            df: The pandas DataFrame to write
+            name: Target table name
+            if_exists: 'replace' for the first chunk, 'append' for the rest
+            pk: Primary key columns of the source
+            on_conflict: append | upsert | fail, defaults.on_conflict if not given
+            summarize: Refresh zip_summary along with this load
+        """
+        mode = on_conflict or self.defaults.get('on_conflict')
+        df, dtype = self._sqlFrame(df)
 
         try:
-            df.to_sql(name, con=engine, if_exists='replace', index=False)
+            merge = bool(pk) and mode in ('append', 'upsert', 'fail')
+            with self.connections.begin() as conn:
+                if merge:
+                    self._mergeLoad(conn, df, name, pk, mode, dtype)
+                elif self.postgres:
+                    self._copyLoad(conn, df, name, if_exists, dtype)
+                else:
+                    df.to_sql(name, con=conn, if_exists=if_exists, index=False, dtype=dtype)
+                if summarize and self.summarizes(name):
+                    # A replaced table may have lost zip codes, so everything is recomputed
+                    zips = None if if_exists == 'replace' and not merge else df.get('zip_code', [])
+                    self._summarize(conn, zips)
             print("DataFrame successfully written to PostgreSQL.")
+            return True
         except Exception as e:
             print(f"Error writing DataFrame to PostgreSQL: {e}")
+            return False
+
+    def summarize(self, name: str, zips: Optional[Iterable] = None) -> bool:
+        """
+        Refresh the zip_summary rows of the given zip codes (every row if
+        zips is None) after loads into name, and return whether it worked.
+
+        Args:
+            name: The lead or tax table that was loaded
+            zips: Zip codes the loads touched
+        """
+        if not self.summarizes(name):
+            return True
+        try:
+            with self.connections.begin() as conn:
+                self._summarize(conn, zips)
+            return True
+        except Exception as e:
+            print(f"Error refreshing {self.summary['table']}: {e}")
+            return False
+
+    def parquetLoad(self, df: pd.DataFrame, path: str, partition_by: Optional[List[str]] = None,
+                    if_exists: str = 'replace') -> bool:
+        """
+        Write a DataFrame (or one chunk of a streamed source) to a Parquet
+        dataset, hive-partitioned on partition_by (e.g. zip_code=19104/),
+        and return whether it was written.
+
+        A replace writes the whole dataset beside the old one and swaps the
+        directories once it is complete; an append adds uniquely named files
+        to the existing partitions. Parquet sources can read the result back.
+
+        Args:
+            df: The pandas DataFrame to write
+            path: Dataset directory
+            partition_by: Columns to partition the files on
+            if_exists: 'replace' for the first chunk, 'append' for the rest
+        """
+        if pa is None:
+            raise ImportError(f"Writing Parquet to '{path}' needs pyarrow: pip install pyarrow")
+
+        df, _ = self._sqlFrame(df)
+        target = f'{path}.tmp' if if_exists == 'replace' else path
+
+        try:
+            if if_exists == 'replace':
+                shutil.rmtree(target, ignore_errors=True)
+            pads.write_dataset(pa.Table.from_pandas(df, preserve_index=False), target, format='parquet',
+                               partitioning=partition_by or None, partitioning_flavor='hive',
+                               basename_template=f'part-{uuid.uuid4().hex}-{{i}}.parquet',
+                               existing_data_behavior='overwrite_or_ignore')
+            if if_exists == 'replace':
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                os.replace(target, path)
+            print("DataFrame successfully written to Parquet.")
+            return True
+        except Exception as e:
+            print(f"Error writing DataFrame to Parquet: {e}")
+            return False
+
+    def _sqlFrame(self, df: pd.DataFrame) -> tuple:
+        """
+        Undo compaction for the database and pick matching SQL column types.
+
+        Categoricals are written as their category values and money_cents
+        columns as NUMERIC(18, 2) dollars. Downcast integers go back to 64
+        bits: the first chunk creates the table, and a SMALLINT sized to its
+        values would reject wider ones in later chunks and runs.
+        """
+        money_cents = [col for col in df.attrs.get('money_cents', []) if col in df.columns]
+        categoricals = [col for col in df.columns if isinstance(df[col].dtype, pd.CategoricalDtype)]
+        narrow = [col for col in df.columns if col not in money_cents
+                  and pd.api.types.is_integer_dtype(df[col].dtype) and df[col].dtype.itemsize < 8]
+        if not money_cents and not categoricals and not narrow:
+            return df, None
+
+        columns = {col: df[col].astype(df[col].cat.categories.dtype) for col in categoricals}
+        columns.update({col: df[col].astype('Float64') / 100 for col in money_cents})
+        columns.update({col: df[col].astype('Int64' if isinstance(df[col].dtype, pd.api.extensions.ExtensionDtype)
+                                            else 'int64') for col in narrow})
+        return df.assign(**columns), {col: Numeric(18, 2) for col in money_cents}
+
+    def _copyLoad(self, conn, df: pd.DataFrame, name: str, if_exists: str, dtype: Optional[dict] = None):
+        """
+        Stream a DataFrame into PostgreSQL with COPY, batch_size rows per COPY.
+
+        The table is created (or replaced) from the frame's columns and the
+        rows are copied in the same transaction, so a failed load leaves the
+        previous table in place.
+        """
+        # Let pandas create the table with the same column types to_sql would
+        df.head(0).to_sql(name, con=conn, if_exists=if_exists, index=False, dtype=dtype)
+        self._copyRows(conn, df, name)
+
+    def _copyRows(self, conn, df: pd.DataFrame, name: str):
+        columns = ', '.join(f'"{col}"' for col in df.columns)
+        sql = f'COPY "{name}" ({columns}) FROM STDIN WITH (FORMAT csv)'
+        step = self.batch_size or max(len(df), 1)
+
+        cursor = conn.connection.cursor()
+        try:
+            for start in range(0, len(df), step):
+                buf = io.StringIO()
+                df.iloc[start:start + step].to_csv(buf, index=False, header=False)
+                buf.seek(0)
+                cursor.copy_expert(sql, buf)
+        finally:
+            cursor.close()
+
+    def _mergeLoad(self, conn, df: pd.DataFrame, name: str, pk: List[str], mode: str, dtype: Optional[dict] = None):
+        """
+        Bulk load rows into a temp staging table, then merge them into the
+        target with one set-based INSERT ... SELECT.
+
+        append skips rows whose key already exists, upsert updates them (only
+        where a value actually changed) and fail raises on any key conflict.
+        The target table and a unique index on pk are created if missing.
+        """
+        if mode != 'fail':
+            # ON CONFLICT cannot touch the same target row twice in one statement
+            df = df.drop_duplicates(subset=pk, keep='last')
+
+        stage = f'{name}__stage'
+        columns = ', '.join(f'"{col}"' for col in df.columns)
+        keys = ', '.join(f'"{col}"' for col in pk)
+
+        df.head(0).to_sql(name, con=conn, if_exists='append', index=False, dtype=dtype)
+        conn.execute(text(f'CREATE UNIQUE INDEX IF NOT EXISTS "{name}_pk" ON "{name}" ({keys})'))
+        conn.execute(text(f'CREATE TEMP TABLE "{stage}" AS SELECT {columns} FROM "{name}" WHERE 1 = 0'))
+
+        if self.postgres:
+            self._copyRows(conn, df, stage)
+        elif len(df):
+            binds = ', '.join(f':p{i}' for i in range(len(df.columns)))
+            rows = df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+            conn.execute(text(f'INSERT INTO "{stage}" ({columns}) VALUES ({binds})'),
+                         [{f'p{i}': value for i, value in enumerate(row)} for row in rows])
+
+        conn.execute(text(self._mergeSql(name, stage, list(df.columns), pk, mode)))
+        conn.execute(text(f'DROP TABLE "{stage}"'))
+
+    def _mergeSql(self, name: str, stage: str, cols: List[str], pk: List[str], mode: str) -> str:
+        columns = ', '.join(f'"{col}"' for col in cols)
+        keys = ', '.join(f'"{col}"' for col in pk)
+        # WHERE true keeps SQLite from reading ON CONFLICT as part of the SELECT
+        sql = f'INSERT INTO "{name}" ({columns}) SELECT {columns} FROM "{stage}" WHERE true'
+
+        updates = [col for col in cols if col not in pk]
+        if mode == 'append' or (mode == 'upsert' and not updates):
+            sql += f' ON CONFLICT ({keys}) DO NOTHING'
+        elif mode == 'upsert':
+            distinct = 'IS DISTINCT FROM' if self.postgres else 'IS NOT'
+            sets = ', '.join(f'"{col}" = excluded."{col}"' for col in updates)
+            changed = ' OR '.join(f'"{name}"."{col}" {distinct} excluded."{col}"' for col in updates)
+            sql += f' ON CONFLICT ({keys}) DO UPDATE SET {sets} WHERE {changed}'
+
+        return sql
+
+    def _summarize(self, conn, zips: Optional[Iterable] = None):
+        """
+        Recompute the zip_summary rows of the given zip codes, or every row
+        if zips is None.
+
+        The touched zip codes go into a temp table and only their rows of
+        the lead and tax tables are aggregated, so a refresh costs a few
+        hundred grouped rows rather than a scan of both tables. A table not
+        loaded yet (or missing a column) leaves its columns null.
+
+        On PostgreSQL refreshes are serialised by a transaction-level
+        advisory lock taken first. Two sources loading at once would
+        otherwise both insert a zip code's row, and the second would fail
+        on the primary key once the first committed. Each statement after
+        the lock sees what the other refresh committed.
+        """
+        table = self.summary['table']
+        if self.postgres:
+            conn.execute(text('SELECT pg_advisory_xact_lock(hashtext(:t))'), {'t': table})
+
+        columns = {col: kind for side in SUMMARY_COLUMNS.values() for col, kind in side.items()}
+        names = ', '.join(['zip_code'] + list(columns))
+        types = ', '.join(f'{col} {"FLOAT" if kind == "AVG" or col == "balance" else "BIGINT"}'
+                          for col, kind in columns.items())
+        conn.execute(text(f'CREATE TABLE IF NOT EXISTS "{table}" (zip_code BIGINT PRIMARY KEY, {types})'))
+
+        scope = ''
+        if zips is not None:
+            touched = pd.unique(pd.to_numeric(pd.Series(list(zips), dtype=object), errors='coerce')
+                                .dropna().astype('int64'))
+            if not len(touched):
+                return
+            zip_table = f'{table}__zips'
+            conn.execute(text(f'CREATE TEMP TABLE "{zip_table}" (zip_code BIGINT)'))
+            conn.execute(text(f'INSERT INTO "{zip_table}" (zip_code) VALUES (:z)'), [{'z': int(z)} for z in touched])
+            scope = f' WHERE zip_code IN (SELECT zip_code FROM "{zip_table}")'
+
+        inspector = inspect(conn)
+        sources, selects, joins = [], [], []
+        for side, aggregates in SUMMARY_COLUMNS.items():
+            source = self.summary[side]
+            present = {col['name'] for col in inspector.get_columns(source)} \
+                if inspector.has_table(source) else set()
+            if 'zip_code' not in present:
+                selects += [f'NULL AS {col}' for col in aggregates]
+                continue
+            sources.append(f'SELECT DISTINCT zip_code FROM "{source}"{scope}')
+            parts = ', '.join(f'{kind}("{col}") AS {col}' for col, kind in aggregates.items() if col in present)
+            joins.append(f'LEFT JOIN (SELECT zip_code{", " + parts if parts else ""} FROM "{source}"{scope} '
+                         f'GROUP BY zip_code) {side}_totals ON {side}_totals.zip_code = z.zip_code')
+            selects += [f'{side}_totals.{col}' if col in present else f'NULL AS {col}' for col in aggregates]
+
+        conn.execute(text(f'DELETE FROM "{table}"{scope}'))
+        if sources:
+            conn.execute(text(
+                f'INSERT INTO "{table}" ({names}) SELECT z.zip_code, {", ".join(selects)} '
+                f'FROM ({" UNION ".join(sources)}) z {" ".join(joins)} WHERE z.zip_code IS NOT NULL'
+            ))
+        if zips is not None:
+            conn.execute(text(f'DROP TABLE "{zip_table}"'))
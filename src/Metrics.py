@@ -0,0 +1,141 @@
+#Metrics
+import json
+import os
+import threading
+import time
+import uuid
+import pandas as pd
+import yaml
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+# Counters summed per source and stage, with the Prometheus help text for each
+_COUNTERS = {
+    'wall_s': ('pipeline_stage_wall_seconds_total', 'Wall time spent in the stage.'),
+    'cpu_s': ('pipeline_stage_cpu_seconds_total', 'CPU time of the thread running the stage.'),
+    'rows_in': ('pipeline_stage_rows_in_total', 'Rows handed to the stage.'),
+    'rows_out': ('pipeline_stage_rows_out_total', 'Rows the stage passed on.'),
+    'rows_rejected': ('pipeline_stage_rows_rejected_total', 'Rows the stage rejected or dropped.'),
+    'bytes': ('pipeline_stage_bytes_total', 'Bytes of data the stage read, wrote or saved.'),
+    'calls': ('pipeline_stage_calls_total', 'Times the stage ran.'),
+}
+
+
+def _peakRss() -> int:
+    """Peak resident set size of this process in bytes (0 where unavailable)."""
+    if resource is None:
+        return 0
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def frameBytes(df: Optional[pd.DataFrame]) -> int:
+    """In-memory size of a frame's columns, the bytes a stage moved for it."""
+    if df is None:
+        return 0
+    return int(df.memory_usage(index=False, deep=True).sum())
+
+
+@contextmanager
+def measure(stage: str, **fields) -> Iterator[Dict[str, Any]]:
+    """
+    Time one stage call and yield its record for the caller to fill in
+    rows_in, rows_out, rows_rejected and bytes.
+
+    Works anywhere, including process pool workers, which send the
+    finished records back with their results.
+    """
+    record = {'stage': stage, **fields, 'rows_in': 0, 'rows_out': 0, 'rows_rejected': 0, 'bytes': 0}
+    rss = _peakRss()
+    wall = time.perf_counter()
+    cpu = time.thread_time()
+    try:
+        yield record
+    finally:
+        record['wall_s'] = time.perf_counter() - wall
+        record['cpu_s'] = time.thread_time() - cpu
+        record['rss_delta_bytes'] = _peakRss() - rss
+        record['pid'] = os.getpid()
+
+
+class metrics:
+    """Collects stage records for a run and writes them as JSON lines and Prometheus text."""
+
+    def __init__(self, cfg: yaml):
+        """
+        Args:
+            cfg: Parsed YAML configuration; defaults.metrics sets the output files
+        """
+
+        settings = cfg.get('defaults', {}).get('metrics') or {}
+        self.path = settings.get('path')
+        self.prometheus = settings.get('prometheus')
+        self.run_id = uuid.uuid4().hex[:12]
+        self.records: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+        for path in (self.path, self.prometheus):
+            if path and os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    @contextmanager
+    def stage(self, source: str, stage: str, chunk: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+        """Measure a stage call made on this thread and record it when it finishes."""
+        with measure(stage, chunk=chunk) as record:
+            try:
+                yield record
+            except Exception as e:
+                record['error'] = repr(e)
+                self.record(source, record)
+                raise
+        self.record(source, record)
+
+    def record(self, source: str, record: Dict[str, Any], **fields):
+        """Add a finished record (e.g. one sent back by a worker) and append it to the JSON-lines file."""
+        record = {'run': self.run_id, 'ts': time.time(), 'source': source, **record, **fields}
+        with self._lock:
+            self.records.append(record)
+            if self.path:
+                with open(self.path, 'a') as f:
+                    f.write(json.dumps(record, default=str) + '\n')
+
+    def summary(self, source: Optional[str] = None) -> Dict[str, Dict[str, Dict[str, float]]]:
+        """Counters summed per source and stage, plus the largest peak RSS growth seen."""
+        totals = defaultdict(lambda: defaultdict(lambda: defaultdict(float)))
+        with self._lock:
+            records = [record for record in self.records if source is None or record['source'] == source]
+        for record in records:
+            stage = totals[record['source']][record['stage']]
+            for key in _COUNTERS:
+                stage[key] += 1 if key == 'calls' else record.get(key, 0)
+            stage['rss_delta_bytes_max'] = max(stage['rss_delta_bytes_max'], record.get('rss_delta_bytes', 0))
+        return {src: {stage: dict(values) for stage, values in stages.items()} for src, stages in totals.items()}
+
+    def writePrometheus(self, path: Optional[str] = None):
+        """Write the summary in Prometheus text exposition format, e.g. for a node_exporter textfile collector."""
+        path = path or self.prometheus
+        if not path:
+            return
+
+        summary = self.summary()
+        lines = []
+        gauges = {'rss_delta_bytes_max': ('pipeline_stage_rss_delta_bytes_max',
+                                          'Largest peak RSS growth during one call of the stage.', 'gauge')}
+        for key, (name, help_text, kind) in {**{k: v + ('counter',) for k, v in _COUNTERS.items()}, **gauges}.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for source, stages in sorted(summary.items()):
+                for stage, values in sorted(stages.items()):
+                    lines.append(f'{name}{{source="{source}",stage="{stage}"}} {values.get(key, 0):g}')
+
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp, path)
@@ -0,0 +1,143 @@
+#Partition
+import numpy as np
+import pandas as pd
+from multiprocessing import shared_memory
+from typing import List, Optional, Tuple
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+
+def partitionRows(df: pd.DataFrame, pk: Optional[List[str]], n: int) -> List[np.ndarray]:
+    """
+    Split a frame's row positions into up to n partitions by a hash of the pk.
+
+    Rows sharing a pk (and so every full-row duplicate) land in the same
+    partition, so duplicate checks and dedupes inside a partition see every
+    row they would have seen over the whole frame. Without a pk the whole
+    row is hashed. Positions stay in frame order within each partition.
+    """
+    columns = [col for col in pk or [] if col in df.columns]
+    hashes = pd.util.hash_pandas_object(df[columns] if columns else df, index=False).to_numpy()
+    buckets = hashes % np.uint64(n)
+    parts = [np.flatnonzero(buckets == i) for i in range(n)]
+    return [part for part in parts if len(part)]
+
+
+def mergePartitions(df: pd.DataFrame, frames: List[pd.DataFrame]) -> pd.DataFrame:
+    """
+    Concatenate partition results back into the original frame's row order.
+
+    Row labels are the original frame's, so results are ordered by where
+    their label sits in it. Columns one partition compacted to a
+    categorical are categorical in the merged frame too.
+    """
+    frames = [frame for frame in frames if len(frame.columns)]
+    if not frames:
+        return pd.DataFrame()
+
+    merged = pd.concat(frames)
+    order = np.argsort(df.index.get_indexer(merged.index), kind='stable')
+    merged = merged.take(order)
+
+    categoricals = {col for frame in frames for col in frame.columns
+                    if isinstance(frame[col].dtype, pd.CategoricalDtype)}
+    for col in categoricals:
+        if not isinstance(merged[col].dtype, pd.CategoricalDtype):
+            merged[col] = merged[col].astype('category')
+
+    merged.attrs = dict(frames[0].attrs)
+    return merged
+
+
+def _keptAsArrow(dtype) -> bool:
+    """Whether to_pandas leaves a column of this Arrow type in its Arrow buffers."""
+    if pa.types.is_dictionary(dtype):
+        return _keptAsArrow(dtype.value_type)
+    return pa.types.is_string(dtype) or pa.types.is_large_string(dtype)
+
+
+def _copied(array):
+    """An Arrow array, with its dictionary if it has one, in freshly allocated buffers."""
+    if isinstance(array, pa.ChunkedArray):
+        return pa.chunked_array([_copied(chunk) for chunk in array.chunks], array.type)
+    if pa.types.is_dictionary(array.type):
+        return pa.DictionaryArray.from_arrays(_copied(array.indices), _copied(array.dictionary),
+                                              ordered=array.type.ordered)
+    return pa.concat_arrays([array])
+
+
+class sharedFrame:
+    """
+    A DataFrame written as an Arrow IPC stream into a shared memory block.
+
+    Only the block's name and size are pickled to another process, which
+    reads the frame straight out of the shared buffer. The reader of the
+    last copy unlinks the block.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        """
+        Args:
+            df: Frame to share; its index and attrs travel with it
+        """
+        if pa is None:
+            raise ImportError("Shared memory partitions need pyarrow: pip install pyarrow")
+
+        table = pa.Table.from_pandas(df)
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        data = sink.getvalue()
+        self.size = max(data.size, 1)
+
+        block = shared_memory.SharedMemory(create=True, size=self.size)
+        self.name = block.name
+        with pa.FixedSizeBufferWriter(pa.py_buffer(block.buf)) as out:
+            out.write(data)
+        # Drop every view of the buffer so the block can be closed
+        del out
+        block.close()
+
+    @property
+    def handle(self) -> Tuple[str, int]:
+        return self.name, self.size
+
+    @staticmethod
+    def load(handle: Tuple[str, int], unlink: bool = False) -> pd.DataFrame:
+        """
+        Read a shared frame into pandas, unlinking the block if this is its
+        last reader.
+
+        The frame is decoded straight from the shared buffer. to_pandas
+        copies the columns into pandas blocks, but may leave text and the
+        index as views of Arrow buffers, so those are copied out first;
+        either way each column is copied once and the frame outlives the
+        block.
+        """
+        name, size = handle
+        block = shared_memory.SharedMemory(name=name)
+        try:
+            with pa.ipc.open_stream(pa.py_buffer(block.buf).slice(0, size)) as stream:
+                table = stream.read_all()
+            index = {col for col in (table.schema.pandas_metadata or {}).get('index_columns', [])
+                     if isinstance(col, str)}
+            for i, field in enumerate(table.schema):
+                if field.name in index or _keptAsArrow(field.type):
+                    table = table.set_column(i, field, _copied(table.column(i)))
+            df = table.to_pandas()
+            del stream, table
+        finally:
+            block.close()
+            if unlink:
+                block.unlink()
+        return df
+
+    @staticmethod
+    def unlinkHandle(handle: Tuple[str, int]):
+        """Free a block whose reader will not unlink it."""
+        block = shared_memory.SharedMemory(name=handle[0])
+        block.close()
+        block.unlink()
@@ -0,0 +1,483 @@
+#Pipeline
+import json
+import logging
+import multiprocessing
+import pandas as pd
+import yaml
+from itertools import count, islice
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from contextlib import nullcontext
+from typing import Dict, Any, Optional
+from sqlalchemy import inspect
+from Reader import reader
+from Validator import validator
+from Cleaner import cleaner
+from Loader import loader
+from Compactor import compactor
+from Connection import connectionManager
+from State import stateStore, stateKey
+from Stage import stageStore
+from Partition import partitionRows, mergePartitions, sharedFrame, pa
+from Metrics import metrics, measure, frameBytes
+
+
+# Per-process validator/cleaner, built once by the pool initializer
+_worker = {}
+
+
+def _init_worker(cfg: yaml):
+    _worker['validator'] = validator(cfg)
+    _worker['compactor'] = compactor(cfg)
+    _worker['cleaner'] = cleaner(cfg)
+    _worker['stages'] = _stageStore(cfg)
+
+
+def _stageStore(cfg: yaml) -> Optional[stageStore]:
+    stages = cfg.get('defaults', {}).get('stages')
+    return stageStore(stages.get('dir', '.cache/stages')) if stages else None
+
+
+def _transform(df: pd.DataFrame, source_name: str, readonly: bool = False) -> tuple:
+    """Validate and clean one chunk inside a process pool worker, returning its stage timings last."""
+    timings = []
+    return transform(_worker['validator'], _worker['compactor'], _worker['cleaner'], df, source_name,
+                     timings, readonly) + (timings,)
+
+
+def _transformStaged(source_name: str, chunk: int) -> tuple:
+    """Validate and clean one staged chunk inside a process pool worker, returning saved bytes and timings."""
+    timings = []
+    saved = transformStaged(_worker['validator'], _worker['compactor'], _worker['cleaner'],
+                            _worker['stages'], source_name, chunk, timings)
+    return saved, timings
+
+
+def transform(v: validator, k: compactor, c: cleaner, df: pd.DataFrame, source_name: str,
+              timings: Optional[list] = None, readonly: bool = False) -> tuple:
+    """
+    Validate a chunk, compact it if enabled, then clean the rows that passed.
+
+    A record of each stage's timing and row counts is appended to timings
+    if given (see Metrics.measure). A readonly chunk (memory-mapped from a
+    stage file or read out of shared memory) is copied before the in-place
+    clean if validation passed it through as is.
+    """
+    timings = [] if timings is None else timings
+
+    with measure('validate') as record:
+        valid, invalidSchema, invalidRules = v.validate(df, source_name)
+        record.update(rows_in=len(df), rows_out=len(valid), rows_rejected=len(invalidSchema) + len(invalidRules))
+    timings.append(record)
+
+    if readonly and valid is df:
+        valid = df.copy()
+
+    saved = 0
+    if k.enabled(source_name):
+        with measure('compact') as record:
+            valid, saved = k.compact(valid, source_name)
+            record.update(rows_in=len(valid), rows_out=len(valid), bytes=saved)
+        timings.append(record)
+
+    with measure('clean') as record:
+        c.cleanSource(valid, source_name)
+        record.update(rows_in=len(valid), rows_out=len(valid))
+    timings.append(record)
+
+    return valid, invalidSchema, invalidRules, saved
+
+
+def _share(df: pd.DataFrame):
+    """A shared memory handle for a frame, or the frame itself (pickled) if Arrow cannot hold it."""
+    try:
+        return sharedFrame(df).handle
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # e.g. an object column mixing numbers and dirty text
+        return df
+
+
+def _unshare(shared) -> pd.DataFrame:
+    return shared if isinstance(shared, pd.DataFrame) else sharedFrame.load(shared, unlink=True)
+
+
+def _transformShared(shared, source_name: str) -> tuple:
+    """Transform one partition read from shared memory, sharing the results back the same way."""
+    readonly = not isinstance(shared, pd.DataFrame)
+    df = sharedFrame.load(shared) if readonly else shared
+    valid, invalidSchema, invalidRules, saved, timings = _transform(df, source_name, readonly)
+    return tuple(_share(frame) for frame in (valid, invalidSchema, invalidRules)) + (saved, timings)
+
+
+def transformPartitioned(pool: ProcessPoolExecutor, df: pd.DataFrame, source_name: str,
+                         partitions: int, pk: Optional[list] = None, timings: Optional[list] = None) -> tuple:
+    """
+    Transform a chunk as row partitions spread over a process pool.
+
+    Rows are split by pk hash (see partitionRows) so duplicate handling is
+    unchanged, and the results are merged back in the chunk's row order,
+    giving the same valid and rejected frames as transform would. With
+    pyarrow installed partitions travel through shared memory as Arrow
+    IPC rather than being pickled. Each partition's stage timings are
+    appended to timings if given.
+    """
+    timings = [] if timings is None else timings
+    parts = [df.take(rows) for rows in partitionRows(df, pk, partitions)]
+    if len(parts) < 2:
+        *results, worker = pool.submit(_transform, df, source_name).result()
+        timings.extend(worker)
+        return tuple(results)
+
+    if pa is None:
+        results = [future.result() for future in [pool.submit(_transform, part, source_name) for part in parts]]
+    else:
+        shared = [_share(part) for part in parts]
+        try:
+            futures = [pool.submit(_transformShared, part, source_name) for part in shared]
+            outputs = [future.exception() or future.result() for future in futures]
+        finally:
+            for part in shared:
+                if not isinstance(part, pd.DataFrame):
+                    sharedFrame.unlinkHandle(part)
+
+        results, error = [], None
+        for output in outputs:
+            if isinstance(output, BaseException):
+                error = error or output
+                continue
+            *frames, saved, worker = output
+            results.append(tuple(_unshare(frame) for frame in frames) + (saved, worker))
+        if error is not None:
+            raise error
+
+    for result in results:
+        timings.extend(result[4])
+    valid, invalidSchema, invalidRules = (mergePartitions(df, [result[i] for result in results]) for i in range(3))
+    return valid, invalidSchema, invalidRules, sum(result[3] for result in results)
+
+
+def transformStaged(v: validator, k: compactor, c: cleaner, stages: stageStore, source_name: str, chunk: int,
+                    timings: Optional[list] = None) -> int:
+    """
+    Transform a chunk's staged rows and stage the results.
+
+    Only the source name and chunk number cross a process boundary: the
+    rows are reopened memory-mapped from the stage files and the results
+    are written back to them. Returns the bytes compaction saved.
+    """
+    df = stages.read(source_name, chunk, 'read')
+    valid, invalidSchema, invalidRules, saved = transform(v, k, c, df, source_name, timings, readonly=True)
+    stages.write(source_name, chunk, 'invalid_schema', invalidSchema)
+    stages.write(source_name, chunk, 'invalid_rules', invalidRules)
+    stages.write(source_name, chunk, 'valid', valid)
+    return saved
+
+
+class pipeline:
+    """Runs read, validate, clean and load for every configured source concurrently."""
+
+    def __init__(self, cfg: yaml, connections: Optional[connectionManager] = None):
+        """      
+        Args:
+            cfg: Parsed YAML configuration
+            connections: Shared connection manager, one is built if not given
+        """
+
+        self.config = cfg
+        # Sources with enabled: false stay readable by name but are not run
+        self.sources = {src['name']: src for src in self.config.get('sources', []) if src.get('enabled', True)}
+
+        workers = self.config.get('defaults', {}).get('workers', {})
+        self.threads = workers.get('threads') or max(len(self.sources), 1)
+        self.processes = workers.get('processes', 0)
+        self.partitions = workers.get('partitions', 0)
+
+        self.reader = reader(cfg)
+        self.validator = validator(cfg)
+        self.compactor = compactor(cfg)
+        self.cleaner = cleaner(cfg)
+        self.connections = connections or connectionManager(cfg)
+        self.loader = loader(cfg, self.connections)
+        self.logger = logging.getLogger("app")
+        self.metrics = metrics(cfg)
+
+        # Row fingerprints and watermarks, so a source can skip rows already loaded
+        defaults = self.config.get('defaults', {})
+        self.state = stateStore(defaults.get('state', {}).get('path', '.cache/state.db')) \
+            if any(self._skipUnchanged(name) for name in self.sources) else None
+
+        # Arrow IPC files of each chunk's stages, so a failed run resumes where it stopped
+        self.stages = _stageStore(cfg)
+
+    def _merges(self, source_name: str) -> bool:
+        """Whether a source is merged into its table on a pk, keeping rows from earlier runs."""
+        source = self.sources[source_name]
+        mode = source.get('on_conflict') or self.config.get('defaults', {}).get('on_conflict')
+        return bool(source.get('pk')) and mode in ('append', 'upsert', 'fail') and \
+            (source.get('target') or {}).get('format') != 'parquet'
+
+    def _skipUnchanged(self, source_name: str) -> bool:
+        """
+        Whether a source drops rows unchanged since its last load.
+
+        Only sources merged on a pk keep their earlier rows in the table, so
+        only those can skip re-sending them. Incremental sources always do.
+        """
+        source = self.sources[source_name]
+        enabled = source.get('skip_unchanged', self.config.get('defaults', {}).get('skip_unchanged'))
+        return bool(enabled or self._watermark(source_name)) and self._merges(source_name)
+
+    def _watermark(self, source_name: str) -> Optional[str]:
+        """Column an incremental source's watermark is kept on, if it has one."""
+        incremental = self.sources[source_name].get('incremental') or {}
+        return incremental.get('watermark') if self._merges(source_name) else None
+
+    def _table(self, source_name: str) -> str:
+        source = self.sources[source_name]
+        target = source.get('target') or {}
+        return target['path'] if target.get('format') == 'parquet' else source.get('target_table') or source_name
+
+    def _stateKey(self, source_name: str) -> str:
+        """
+        Name of a source's fingerprints and watermark, tied to the database
+        and table it loads and to the config that shapes its rows.
+        """
+        source = self.sources[source_name]
+        transform = {key: source.get(key) for key in ('schema', 'rules', 'clean', 'clean_method')}
+        transform['compact'] = self.compactor.settings(source_name)
+        return stateKey(source_name, self.config['defaults']['db_url'], self._table(source_name), transform)
+
+    def _changes(self, chunk: pd.DataFrame, source_name: str, column: Optional[str], mark: Any) -> tuple:
+        """
+        Drop rows unchanged since the last load, before they are validated.
+
+        Rows beyond the watermark are new and kept without a fingerprint
+        lookup; only the rest are looked up, and kept if their content hash
+        differs from the stored one. Returns the kept rows with their key
+        and content hashes.
+        """
+        lookup = None
+        if column is not None and mark is not None:
+            lookup = ~(chunk[column] > mark).fillna(False).to_numpy(dtype=bool)
+        unchanged, keys, digests = self.state.unchanged(chunk, self._stateKey(source_name),
+                                                        self.sources[source_name]['pk'], lookup)
+        return chunk[~unchanged], keys[~unchanged], digests[~unchanged], int(unchanged.sum())
+
+    def run(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Process all sources at once and return a result dict per source.
+
+        Reads and loads are network/database bound and run on a thread pool.
+        When workers.processes is set, validate and clean are handed to a
+        process pool instead of running on the source's thread, and with
+        workers.partitions each chunk is split across the pool by row.
+        """
+        # Workers are started from the source threads while others read and load;
+        # forking then can copy a lock another thread holds, so start them clean
+        method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        procs = ProcessPoolExecutor(self.processes, mp_context=multiprocessing.get_context(method),
+                                    initializer=_init_worker, initargs=(self.config,)) \
+            if self.processes else nullcontext()
+
+        with procs as pool, ThreadPoolExecutor(self.threads) as threads:
+            futures = {name: threads.submit(self.runSource, name, pool) for name in self.sources}
+            results = {name: future.result() for name, future in futures.items()}
+
+        self.metrics.writePrometheus()
+        return results
+
+    def _chunks(self, source_name: str, since: Optional[tuple], manifest: Optional[dict]):
+        """
+        Yield (chunk number, frame) for a source's run.
+
+        Chunks an earlier, unfinished run already staged are yielded with a
+        frame of None, to be picked up from their stage files. If that run
+        had not finished reading, the rest of the source is read after them,
+        timing each chunk's read.
+        """
+        staged = sorted(int(i) for i in manifest['chunks']) if manifest else []
+        for i in staged:
+            yield i, None
+        if manifest and manifest['complete']:
+            return
+
+        stream = islice(self.reader.stream(source_name, since=since), len(staged), None)
+        for i in count(len(staged)):
+            with measure('read', chunk=i) as record:
+                chunk = next(stream, None)
+                if chunk is not None:
+                    record.update(rows_out=len(chunk), bytes=frameBytes(chunk))
+            if chunk is None:
+                break
+            self.metrics.record(source_name, record)
+            yield i, chunk
+
+        if manifest is not None:
+            manifest['complete'] = True
+            self.stages.save(source_name, manifest)
+
+    def runSource(self, source_name: str, pool: ProcessPoolExecutor = None) -> Dict[str, Any]:
+        """
+        Stream one source through validate, clean and load a chunk at a time.
+
+        Sources that skip unchanged rows drop them before validation, and
+        record fingerprints for each chunk once it is loaded. Incremental
+        sources skip the fingerprint lookup for rows beyond their watermark
+        and advance it after every chunk has loaded; append_only ones also
+        only request those rows where the reader can push that down.
+
+        With a stage store configured each chunk's read and transformed rows
+        are written to Arrow IPC files, process pool workers exchange only
+        chunk numbers, and a run that failed part way resumes each chunk
+        after its last completed stage.
+
+        Loads into the summary's lead or tax table refresh zip_summary once,
+        after the last chunk, for the zip codes all the chunks touched.
+
+        Each stage call is timed into self.metrics, and the result's metrics
+        entry holds the source's totals per stage.
+
+        Args:
+            source_name: Name of the source in the YAML config
+            pool: Optional process pool for the validate/clean step
+        """
+        source = self.sources[source_name]
+        target = source.get('target') or {}
+        table = self._table(source_name)
+        result = {'table': table, 'chunks': 0, 'rows_loaded': 0, 'rows_unchanged': 0, 'bytes_saved': 0,
+                  'invalid_schema': [], 'invalid_rules': [], 'error': None}
+        # Also read by the except path, so set before any setup that can fail
+        summarize, touched, everything = False, set(), False
+
+        try:
+            skip = self._skipUnchanged(source_name)
+            if skip and not inspect(self.connections.engine).has_table(table):
+                # A dropped table holds none of the rows the state says were loaded
+                self.state.reset(self._stateKey(source_name))
+            column = self._watermark(source_name)
+            mark = self.state.watermark(self._stateKey(source_name), column) if column else None
+            high = mark
+            # Only an append-only source may leave rows at or below the mark unread
+            append_only = (source.get('incremental') or {}).get('append_only')
+            since = (column, mark) if mark is not None and append_only else None
+
+            # zip_summary is refreshed once for the zip codes of every loaded chunk, not per chunk
+            summarize = target.get('format') != 'parquet' and self.loader.summarizes(table)
+
+            stages = self.stages
+            manifest = stages.manifest(source_name, json.dumps([source, since], sort_keys=True, default=str)) \
+                if stages else None
+
+            for i, chunk in self._chunks(source_name, since, manifest):
+                progress = manifest['chunks'].setdefault(str(i), {}) if stages else {}
+
+                if chunk is not None:
+                    if skip:
+                        with self.metrics.stage(source_name, 'unchanged', i) as record:
+                            record['rows_in'] = len(chunk)
+                            chunk, keys, digests, progress['unchanged'] = self._changes(chunk, source_name, column, mark)
+                            record.update(rows_out=len(chunk), rows_rejected=progress['unchanged'])
+                    if stages:
+                        stages.write(source_name, i, 'read', chunk)
+                        if skip:
+                            stages.write(source_name, i, 'hashes', pd.DataFrame({'key': keys, 'digest': digests}))
+                        progress['stage'] = 'read'
+                        stages.save(source_name, manifest)
+                elif skip:
+                    hashes = stages.read(source_name, i, 'hashes')
+                    keys, digests = hashes['key'].to_numpy(), hashes['digest'].to_numpy()
+                    chunk = stages.read(source_name, i, 'read')
+
+                timings = []
+                if stages:
+                    if progress['stage'] == 'read':
+                        if pool and self.partitions > 1:
+                            *frames, progress['saved'] = transformPartitioned(pool, stages.read(source_name, i, 'read'),
+                                                                              source_name, self.partitions,
+                                                                              source.get('pk'), timings)
+                            for stage, frame in zip(('valid', 'invalid_schema', 'invalid_rules'), frames):
+                                stages.write(source_name, i, stage, frame)
+                        elif pool:
+                            progress['saved'], timings = pool.submit(_transformStaged, source_name, i).result()
+                        else:
+                            progress['saved'] = transformStaged(
+                                self.validator, self.compactor, self.cleaner, stages, source_name, i, timings)
+                        progress['stage'] = 'transformed'
+                        stages.save(source_name, manifest)
+                    valid = stages.read(source_name, i, 'valid')
+                    invalidSchema = stages.read(source_name, i, 'invalid_schema')
+                    invalidRules = stages.read(source_name, i, 'invalid_rules')
+                    saved = progress['saved']
+                elif pool and self.partitions > 1:
+                    valid, invalidSchema, invalidRules, saved = transformPartitioned(
+                        pool, chunk, source_name, self.partitions, source.get('pk'), timings)
+                elif pool:
+                    valid, invalidSchema, invalidRules, saved, timings = \
+                        pool.submit(_transform, chunk, source_name).result()
+                else:
+                    valid, invalidSchema, invalidRules, saved = transform(
+                        self.validator, self.compactor, self.cleaner, chunk, source_name, timings)
+                for record in timings:
+                    self.metrics.record(source_name, record, chunk=i)
+
+                if progress.get('stage') != 'loaded':
+                    if_exists = 'replace' if i == 0 else 'append'
+                    with self.metrics.stage(source_name, 'load', i) as record:
+                        record.update(rows_in=len(valid), bytes=frameBytes(valid))
+                        if target.get('format') == 'parquet':
+                            loaded = self.loader.parquetLoad(valid, table, target.get('partition_by'), if_exists)
+                        else:
+                            loaded = (skip and valid.empty) or self.loader.load(
+                                valid, table, if_exists=if_exists, pk=source.get('pk'),
+                                on_conflict=source.get('on_conflict'), summarize=False)
+                        record['rows_out'] = len(valid) if loaded else 0
+                    if not loaded:
+                        raise RuntimeError(f'Loading {table} failed')
+
+                    if skip:
+                        # Only rows that were loaded; rejected rows are checked again next run
+                        rows = chunk.index.get_indexer(valid.index)
+                        self.state.commit(self._stateKey(source_name), keys[rows], digests[rows])
+                    if stages:
+                        progress['stage'] = 'loaded'
+                        stages.save(source_name, manifest)
+                    result['rows_loaded'] += len(valid)
+
+                if summarize:
+                    # A replaced table may have lost zip codes, so everything is recomputed
+                    everything = everything or (i == 0 and not self._merges(source_name))
+                    if not everything and 'zip_code' in valid.columns:
+                        touched.update(valid['zip_code'].dropna().unique().tolist())
+
+                if column and not valid.empty:
+                    top = valid[column].max()
+                    high = top if high is None or top > high else high
+
+                result['chunks'] += 1
+                result['rows_unchanged'] += progress.get('unchanged', 0)
+                result['bytes_saved'] += saved
+                result['invalid_schema'].append(invalidSchema)
+                result['invalid_rules'].append(invalidRules)
+                self.logger.info(f'{source_name} chunk {i}: {len(valid)} rows loaded into {table}')
+
+            if summarize and (everything or touched):
+                zips, touched, everything = None if everything else touched, set(), False
+                with self.metrics.stage(source_name, 'summarize'):
+                    if not self.loader.summarize(table, zips):
+                        raise RuntimeError(f"Refreshing {self.loader.summary['table']} failed")
+            if column and high is not None and high != mark:
+                self.state.setWatermark(self._stateKey(source_name), column, high)
+            if stages:
+                stages.clear(source_name)
+
+        except Exception as e:
+            result['error'] = e
+            self.logger.error(f'{source_name} failed: {e}')
+            # Chunks loaded before the failure are in the table, so they count in the summary
+            if summarize and (everything or touched):
+                self.loader.summarize(table, None if everything else touched)
+
+        for key in ('invalid_schema', 'invalid_rules'):
+            result[key] = pd.concat(result[key]) if result[key] else pd.DataFrame()
+        result['metrics'] = self.metrics.summary(source_name).get(source_name, {})
+
+        return result
@@ -0,0 +1,203 @@
+#Planner
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+from Rules import expressionEvaluator, ruleEvaluator
+
+
+# Steps that act on each listed column independently and can share one matrix pass
+_ELEMENTWISE = ('clip_negative', 'fillna', 'round')
+
+
+class _dedupe:
+    def __init__(self, subset: Optional[List[str]]):
+        self.subset = subset
+
+    def run(self, df: pd.DataFrame, pool):
+        df.drop_duplicates(subset=self.subset, inplace=True)
+
+
+class _block:
+    """Consecutive clip/fill/round steps fused into one pass over a float matrix."""
+
+    def __init__(self):
+        self.columns = []
+        self.ops = []
+
+    def add(self, kind: str, columns: List[str], arg: Any):
+        for col in columns:
+            if col not in self.columns:
+                self.columns.append(col)
+        self.ops.append((kind, columns, arg))
+
+    def run(self, df: pd.DataFrame, pool):
+        cols = [col for col in self.columns if col in df.columns]
+        numeric = [col for col in cols if pd.api.types.is_numeric_dtype(df[col].dtype)]
+
+        # Text columns can only be filled, and only through pandas
+        for kind, columns, arg in self.ops:
+            if kind == 'fillna':
+                for col in columns:
+                    if col in df.columns and col not in numeric:
+                        df[col] = df[col].fillna(arg)
+        if not numeric:
+            return
+
+        # Column-major so each column is one contiguous slice a thread can own
+        matrix = np.array(df[numeric].to_numpy(dtype=float, na_value=np.nan), order='F')
+        index = {col: i for i, col in enumerate(numeric)}
+        ops = {col: [(kind, arg) for kind, columns, arg in self.ops if col in columns] for col in numeric}
+
+        def apply(col):
+            values = matrix[:, index[col]]
+            for kind, arg in ops[col]:
+                if kind == 'clip_negative':
+                    np.clip(values, 0, None, out=values)
+                elif kind == 'fillna':
+                    values[np.isnan(values)] = arg
+                elif kind == 'round':
+                    np.round(values, arg, out=values)
+
+        if pool is not None and len(numeric) > 1:
+            list(pool.map(apply, numeric))
+        else:
+            for col in numeric:
+                apply(col)
+
+        originals = {col: df[col].dtype for col in numeric}
+        df[numeric] = matrix
+        for col in numeric:
+            _restoreInteger(df, col, originals[col])
+
+
+class _derive:
+    """Set a column from an expression, where a condition holds (or where it is missing)."""
+
+    def __init__(self, column: str, expr: str, when: Optional[str] = None, missing_only: bool = False):
+        self.column = column
+        self.expr = expressionEvaluator(expr)
+        self.when = ruleEvaluator(when) if when else None
+        self.missing_only = missing_only
+        self.reads = set(self.expr.columns) | set(self.when.columns if self.when else [])
+
+    def compute(self, df: pd.DataFrame) -> Optional[np.ndarray]:
+        if self.column not in df.columns or not self.reads.issubset(df.columns):
+            return None
+
+        current = df[self.column].to_numpy(dtype=float, na_value=np.nan)
+        if self.missing_only:
+            mask = np.isnan(current)
+        elif self.when is not None:
+            mask = self.when(df)
+        else:
+            mask = np.ones(len(df), dtype=bool)
+
+        if not mask.any():
+            return None
+        return np.where(mask, self.expr(df), current)
+
+    def apply(self, df: pd.DataFrame, values: Optional[np.ndarray]):
+        if values is None:
+            return
+        original = df[self.column].dtype
+        df[self.column] = values
+        _restoreInteger(df, self.column, original)
+
+
+class _derivations:
+    """Derive steps that do not read each other's targets, computed concurrently."""
+
+    def __init__(self):
+        self.steps = []
+
+    def accepts(self, step: _derive) -> bool:
+        targets = {other.column for other in self.steps}
+        return step.column not in targets and not (step.reads & targets) and \
+            not any(other.reads & {step.column} for other in self.steps)
+
+    def run(self, df: pd.DataFrame, pool):
+        if pool is not None and len(self.steps) > 1:
+            results = list(pool.map(lambda step: step.compute(df), self.steps))
+        else:
+            results = [step.compute(df) for step in self.steps]
+
+        for step, values in zip(self.steps, results):
+            step.apply(df, values)
+
+
+def _restoreInteger(df: pd.DataFrame, col: str, original):
+    """Put an integer column back to its dtype, rounding any derived values."""
+    if not pd.api.types.is_integer_dtype(original):
+        return
+    values = np.rint(df[col].to_numpy(dtype=float, na_value=np.nan))
+    if isinstance(original, pd.api.extensions.ExtensionDtype):
+        df[col] = pd.array(values, dtype='Float64').astype(original)
+    elif not np.isnan(values).any():
+        df[col] = values.astype(original)
+
+
+class cleaningPlan:
+    """
+    A source's clean steps from sources.yml, compiled once into fused stages.
+
+    Supported steps:
+        dedupe: {subset: [cols]}                     drop duplicate rows
+        clip_negative: [cols]                        negative values become 0
+        fillna: {columns: [cols], value: v}          fill missing values with a constant
+        fillna: {column: col, expr: "..."}           fill missing values from an expression
+        derive: {column: col, expr: "...", when: "..."}
+                                                     set col from expr (where when holds)
+        round: {columns: [cols], decimals: n}        round to n decimals
+    """
+
+    def __init__(self, steps: List[Dict[str, Any]], workers: int = 1):
+        """
+        Args:
+            steps: The source's clean list from the YAML config
+            workers: Threads used for column-parallel stages
+        """
+
+        self.workers = workers
+        self.stages = []
+
+        for step in steps:
+            (kind, spec), = step.items()
+            spec = {} if spec is None else spec
+
+            if kind in _ELEMENTWISE and not (kind == 'fillna' and 'expr' in spec):
+                columns, arg = self._elementwise(kind, spec)
+                if not self.stages or not isinstance(self.stages[-1], _block):
+                    self.stages.append(_block())
+                self.stages[-1].add(kind, columns, arg)
+
+            elif kind in ('derive', 'fillna'):
+                derive = _derive(spec['column'], spec['expr'], spec.get('when'), missing_only=(kind == 'fillna'))
+                if not self.stages or not isinstance(self.stages[-1], _derivations) \
+                        or not self.stages[-1].accepts(derive):
+                    self.stages.append(_derivations())
+                self.stages[-1].steps.append(derive)
+
+            elif kind == 'dedupe':
+                self.stages.append(_dedupe(spec.get('subset')))
+
+            else:
+                raise ValueError(f"Unknown clean step '{kind}'")
+
+    def _elementwise(self, kind: str, spec) -> tuple:
+        if kind == 'clip_negative':
+            return list(spec), None
+        if kind == 'fillna':
+            return list(spec['columns']), spec['value']
+        return list(spec['columns']), spec.get('decimals', 2)
+
+    def run(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Apply every stage to the DataFrame in place."""
+        if self.workers > 1:
+            with ThreadPoolExecutor(self.workers) as pool:
+                for stage in self.stages:
+                    stage.run(df, pool)
+        else:
+            for stage in self.stages:
+                stage.run(df, None)
+        return df
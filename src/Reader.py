@@ -2,6 +2,22 @@
 import pandas as pd
 import yaml
 import requests
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+import os
+from typing import Iterator, Optional
+from urllib.parse import urlsplit, urlunsplit, parse_qs, urlencode
+from Cache import responseCache
+from Rules import schemaDtypes, textDtypes, compileRules, arrowFilter
+from JsonStream import streamJson
+from contextlib import contextmanager
+
+try:
+    import pyarrow.dataset as pads
+    from pyarrow import fs as pafs
+except ImportError:
+    pads = None
 
 url = "https://phl.carto.com/api/v2/sql?q=SELECT%20cartodb_id%20AS%20id,%20zip_code,%20num_screen,%20num_bll_5plus,%20perc_5plus%20FROM%20child_blood_lead_levels_by_zip"
 
@@ -15,6 +31,24 @@ class reader:
 
         self.config = cfg
         self.sources = {src['name']: src for src in self.config.get('sources', [])}
+        self.batch_size = self.config.get('defaults', {}).get('batch_size')
+
+        # Parse dtypes derived from each source's schema
+        self.dtypes = {name: schemaDtypes(src.get('schema') or {}) for name, src in self.sources.items()}
+
+        # Columnar file formats, read through pyarrow datasets
+        self.formats = {'parquet': 'parquet', 'arrow_ipc': 'ipc'}
+
+        # Response caches for API sources that configure one
+        self.caches = {}
+        for name, src in self.sources.items():
+            if src.get('type') == 'api_json' and 'cache' in src:
+                cache = src['cache']
+                self.caches[name] = responseCache(
+                    os.path.join(cache.get('dir', '.cache/http'), name),
+                    ttl=cache.get('ttl', 0),
+                    max_bytes=cache.get('max_bytes'),
+                )
 
     def read(self, source_name: str) -> pd.DataFrame:
         df = pd.DataFrame
@@ -26,21 +60,193 @@ class reader:
         source_type = self.sources[source_name]['type']
 
 
-        if source_type == 'api_json':
-            df = self.apiReader(source_path)
+        dtypes = self.dtypes[source_name]
+
+        if source_type == 'api_json' and 'paginate' in self.sources[source_name]:
+            pages = self.pagedReader(source_path, cache=self.caches.get(source_name),
+                                     **self.sources[source_name]['paginate'])
+            frames = [self.applyDtypes(page, dtypes) for page in pages]
+            if frames:
+                df = pd.concat(frames, ignore_index=True)
+            else:
+                # COUNT was 0, so no page was requested
+                df = self.applyDtypes(pd.DataFrame(columns=list(dtypes)), dtypes)
+        elif source_type == 'api_json':
+            df = self.applyDtypes(self.apiReader(source_path, cache=self.caches.get(source_name)), dtypes)
         elif source_type == 'csv':
-            df = self.csvReader(source_path)
+            df = self.csvReader(source_path, dtypes)
+        elif source_type in self.formats:
+            dataset, columns, where = self.columnarScan(source_name)
+            df = self.applyDtypes(dataset.to_table(columns=columns, filter=where).to_pandas(), dtypes)
+        elif source_type == 'json_stream':
+            df = pd.concat(self.jsonReader(source_name), ignore_index=True)
         
         return df
+
+
+    def stream(self, source_name: str, since: Optional[tuple] = None) -> Iterator[pd.DataFrame]:
+        """
+        Read a source as a sequence of DataFrame chunks.
+
+        CSV sources are parsed batch_size rows at a time so only one chunk is
+        held in memory, paginated API sources are yielded a page at a time,
+        json_stream sources are decoded batch_size records at a time, and
+        other source types are yielded as a single frame.
+
+        Args:
+            source_name: Name of the source in the YAML config
+            since: Optional (column, value) watermark. API sources only request
+                rows with column > value; file sources are read whole and
+                left to the caller to filter.
+        """
+        if source_name not in self.sources:
+            raise ValueError(f"Source '{source_name}' not found in config")
+
+        source_path = self.sources[source_name]['path']
+        source_type = self.sources[source_name]['type']
+        dtypes = self.dtypes[source_name]
+
+        if source_type == 'api_json' and since is not None:
+            source_path = self.sinceQuery(source_path, *since)
+
+        if source_type == 'csv' and self.batch_size:
+            yield from self.csvChunks(source_path, self.batch_size, dtypes)
+        elif source_type in self.formats and self.batch_size:
+            dataset, columns, where = self.columnarScan(source_name)
+            for batch in dataset.to_batches(columns=columns, filter=where, batch_size=self.batch_size):
+                if batch.num_rows:
+                    yield self.applyDtypes(batch.to_pandas(), dtypes)
+        elif source_type == 'api_json' and 'paginate' in self.sources[source_name]:
+            pages = self.pagedReader(source_path, cache=self.caches.get(source_name),
+                                     **self.sources[source_name]['paginate'])
+            for page in pages:
+                yield self.applyDtypes(page, dtypes)
+        elif source_type == 'api_json':
+            yield self.applyDtypes(self.apiReader(source_path, cache=self.caches.get(source_name)), dtypes)
+        elif source_type == 'json_stream':
+            yield from self.jsonReader(source_name, self.batch_size)
+        else:
+            yield self.read(source_name)
+
+
+    def columnarScan(self, source_name: str) -> tuple:
+        """
+        Open a parquet or arrow_ipc source as a pyarrow dataset, with the
+        columns and row filter to push down into the scan.
+
+        Only the schema's columns (plus pk and rule columns) are read, and
+        rows the source's rules would reject are skipped where a rule maps
+        onto an Arrow comparison; the validator still checks every rule on
+        what is read. Paths may be single files or hive-partitioned
+        directories (e.g. written by loader.parquetLoad), and files are
+        memory-mapped.
+        """
+        if pads is None:
+            raise ImportError(f"Reading '{source_name}' needs pyarrow: pip install pyarrow")
+
+        source = self.sources[source_name]
+        dataset = pads.dataset(source['path'], format=self.formats[source['type']], partitioning='hive',
+                               filesystem=pafs.LocalFileSystem(use_mmap=True))
+        names = dataset.schema.names
+
+        rules = compileRules(source.get('rules') or [])
+        wanted = set(source.get('schema') or {}) | set(source.get('pk') or [])
+        wanted |= {col for rule in rules for col in rule.columns}
+        wanted |= {(source.get('incremental') or {}).get('watermark')}
+        columns = [col for col in names if col in wanted] if source.get('schema') else None
+
+        return dataset, columns, arrowFilter(rules, names)
+
+
+    def sinceQuery(self, path: str, column: str, value) -> str:
+        """Rewrite a Carto SQL API URL so the server only returns rows with column > value."""
+        parts = urlsplit(path)
+        params = parse_qs(parts.query)
+        literal = "'" + value.replace("'", "''") + "'" if isinstance(value, str) else repr(value)
+        params['q'] = [f'SELECT * FROM ({params["q"][0]}) AS t WHERE {column} > {literal}']
+        return urlunsplit(parts._replace(query=urlencode(params, doseq=True)))
         
 
-    def apiReader(self, path: str) -> pd.DataFrame:
-        response = requests.get(path)
+    def apiReader(self, path: str, cache: Optional[responseCache] = None) -> pd.DataFrame:
+        return self._getFrame(requests.get, path, cache)
+
+
+    def pagedReader(self, path: str, key: str, page_size: int = 1000, workers: int = 4,
+                    cache: Optional[responseCache] = None) -> Iterator[pd.DataFrame]:
+        """
+        Fetch a Carto SQL API query in ORDER BY key LIMIT/OFFSET pages.
+
+        Pages are requested concurrently over one pooled session, with at most
+        2 * workers pages in flight, and yielded in order as DataFrames.
+
+        Args:
+            path: Carto SQL API URL with the query in its q parameter
+            key: Column the pages are ordered on (e.g. the cartodb_id alias)
+            page_size: Rows per page
+            workers: Concurrent page requests
+            cache: Optional response cache, applied to each page URL
+        """
+        parts = urlsplit(path)
+        base = urlunsplit(parts._replace(query=''))
+        query = parse_qs(parts.query)['q'][0]
+
+        with requests.Session() as session, ThreadPoolExecutor(workers) as pool:
+            session.mount(f'{parts.scheme}://', HTTPAdapter(pool_maxsize=workers))
+
+            def fetch(sql):
+                return self._getFrame(session.get, f'{base}?{urlencode({"q": sql})}', cache)
+
+            count = int(fetch(f'SELECT COUNT(*) AS n FROM ({query}) AS t')['n'].iloc[0])
+            offsets = iter(range(0, count, page_size))
+            pending = deque()
+
+            def submit():
+                offset = next(offsets, None)
+                if offset is not None:
+                    page = f'SELECT * FROM ({query}) AS t ORDER BY {key} LIMIT {page_size} OFFSET {offset}'
+                    pending.append(pool.submit(fetch, page))
+
+            for _ in range(2 * workers):
+                submit()
+
+            while pending:
+                df = pending.popleft().result()
+                submit()
+                yield df
+
+
+    def _getFrame(self, get, url: str, cache: Optional[responseCache] = None) -> pd.DataFrame:
+        """
+        GET a Carto-style URL and decode its rows, going through the cache if given.
+
+        A cached copy younger than the cache ttl is returned without a request;
+        an older one is revalidated with ETag/Last-Modified so a 304 skips both
+        the download and the JSON decode.
+        """
+        headers = {}
+        if cache:
+            if cache.fresh(url):
+                df = cache.load(url)
+                if df is not None:
+                    return df
+            headers = cache.headers(url)
+
+        response = get(url, headers=headers)
         scode = response.status_code
+        if scode == 304 and cache:
+            df = cache.load(url)
+            if df is not None:
+                cache.revalidated(url)
+                return df
+            response = get(url)
+            scode = response.status_code
+
         if scode == 200:
             data = response.json()["rows"]
 
             df = pd.DataFrame(data)
+            if cache:
+                cache.store(url, df, response.headers)
             
             return df
         
@@ -48,7 +254,83 @@ class reader:
             raise requests.exceptions.HTTPError('Failed to retrieve data. Status Code: ' + str(scode))
 
 
-    def csvReader(self, path: str) -> pd.DataFrame:
-        df = pd.read_csv(path)
+    @contextmanager
+    def _jsonSource(self, path: str):
+        """A binary stream of a local JSON file or an HTTP(S) response body."""
+        if urlsplit(path).scheme in ('http', 'https'):
+            with requests.get(path, stream=True) as response:
+                if response.status_code != 200:
+                    raise requests.exceptions.HTTPError(
+                        'Failed to retrieve data. Status Code: ' + str(response.status_code))
+                response.raw.decode_content = True
+                yield response.raw
+        else:
+            with open(path, 'rb') as f:
+                yield f
+
+
+    def jsonReader(self, source_name: str, batch_size: Optional[int] = None) -> Iterator[pd.DataFrame]:
+        """
+        Decode a json_stream source's records into typed frames of up to batch_size rows.
+
+        The source's records setting is the key path to the object or array
+        holding the records (e.g. ["Time Series (5min)"] for Alphavantage,
+        ["rows"] for Carto). For an object of records, key names the column
+        its member names go in; columns renames fields. The body is parsed
+        incrementally when ijson is installed, and each batch's numeric
+        schema columns are built as whole NumPy arrays (see JsonStream).
+        """
+        src = self.sources[source_name]
+        records = src.get('records', [])
+        records = [records] if isinstance(records, str) else list(records)
+        dtypes = self.dtypes[source_name]
+
+        with self._jsonSource(src['path']) as source:
+            for df in streamJson(source, records, src.get('key'), src.get('columns'), dtypes, batch_size):
+                yield self.applyDtypes(df, dtypes)
+
+
+    def csvReader(self, path: str, dtype: Optional[dict] = None) -> pd.DataFrame:
+        """
+        Parse a CSV with the schema's dtypes applied during parsing.
+
+        If a column holds values its dtype cannot parse, the file is read
+        again with only the text dtypes fixed and the rest inferred, leaving
+        the dirty column(s) to the validator's conversion step.
+        """
+        try:
+            df = pd.read_csv(path, dtype=dtype)
+        except (ValueError, TypeError):
+            df = pd.read_csv(path, dtype=textDtypes(dtype or {}))
+
+        return df
+
+
+    def csvChunks(self, path: str, chunksize: int, dtype: Optional[dict] = None) -> Iterator[pd.DataFrame]:
+        """Parse a CSV batch by batch, falling back as csvReader does from the first dirty chunk on."""
+        consumed = 0
+        columns = None
+        try:
+            with pd.read_csv(path, chunksize=chunksize, dtype=dtype) as chunks:
+                for chunk in chunks:
+                    consumed += len(chunk)
+                    columns = list(chunk.columns)
+                    yield chunk
+            return
+        except (ValueError, TypeError):
+            pass
+
+        # Resume after the rows already handed out, without the failing dtypes
+        resume = {'skiprows': consumed + 1, 'header': None, 'names': columns} if columns else {}
+        with pd.read_csv(path, chunksize=chunksize, dtype=textDtypes(dtype or {}), **resume) as chunks:
+            for chunk in chunks:
+                yield chunk
+
 
-        return df
\ No newline at end of file
+    def applyDtypes(self, df: pd.DataFrame, dtypes: dict) -> pd.DataFrame:
+        """Cast decoded API columns to their schema dtypes, leaving dirty ones to the validator."""
+        present = {col: dtype for col, dtype in dtypes.items() if col in df.columns}
+        try:
+            return df.astype(present)
+        except (ValueError, TypeError):
+            return df.astype(textDtypes(present))
@@ -0,0 +1,151 @@
+#Reports
+import numpy as np
+import pandas as pd
+import yaml
+from typing import Dict, Iterator, List, Optional, Union
+from sqlalchemy import text
+from sqlalchemy.sql.elements import TextClause
+from Connection import connectionManager
+
+
+def percentileSql(column: str, p: float) -> str:
+    """
+    A percentile_cont(p) of column per group, as an aggregate over a window query.
+
+    The inner query must number each group's rows ordered by the column
+    with nulls last (rn) and count its non-null values (n). Only integer
+    arithmetic and CASE are used, so SQLite and Postgres give the same
+    linearly interpolated value.
+    """
+    k = int(round(p * 10000))
+    low = f'(1 + ({k} * (n - 1)) / 10000)'
+    frac = f'((({k} * (n - 1)) % 10000) / 10000.0)'
+    return (f'SUM(CASE WHEN rn = {low} THEN {column} * (1 - {frac}) '
+            f'WHEN rn = {low} + 1 THEN {column} * {frac} END)')
+
+
+class reports:
+    """
+    Aggregated reporting queries over the loaded tables.
+
+    Grouping, percentiles and the lead/tax join run in the database, so a
+    report returns one row per zip code however large the tables grow.
+    Results are read through a server-side cursor (a psycopg2 named cursor
+    on Postgres) fetch_size rows at a time, and come back as DataFrames or
+    NumPy arrays without building Python lists of rows.
+    """
+
+    def __init__(self, cfg: yaml, connections: Optional[connectionManager] = None):
+        """
+        Args:
+            cfg: Parsed YAML configuration; defaults.reports sets tables, percentiles and fetch size
+            connections: Shared connection manager, one is built if not given
+        """
+
+        settings = cfg.get('defaults', {}).get('reports') or {}
+        self.fetch_size = settings.get('fetch_size', 10000)
+        self.percentiles = settings.get('percentiles', [0.5, 0.9])
+        self.tables = {'lead': 'lead_levels', 'tax': 'tax_levels', 'ibm': 'ibm', **(settings.get('tables') or {})}
+        self.tables['summary'] = (cfg.get('defaults', {}).get('summary') or {}).get('table', 'zip_summary')
+        self.connections = connections or connectionManager(cfg)
+
+        self.queries = {
+            'lead_by_zip': self.leadByZip,
+            'tax_by_zip': self.taxByZip,
+            'lead_vs_tax': self.leadVsTax,
+            'zip_summary': self.zipSummary,
+            'intraday': self.intraday,
+        }
+
+    def _table(self, name: str) -> str:
+        return self.connections.engine.dialect.identifier_preparer.quote(self.tables[name])
+
+    def _grouped(self, table: str, column: str, aggregates: List[str]) -> str:
+        """Per-zip aggregates of a table plus percentiles of one of its columns."""
+        percentiles = [f'{percentileSql(column, p)} AS {column}_p{round(p * 100):g}'
+                       for p in self.percentiles]
+        return (
+            f'SELECT zip_code, {", ".join(aggregates + percentiles)} FROM ('
+            f'SELECT t.*, '
+            f'ROW_NUMBER() OVER (PARTITION BY zip_code ORDER BY {column} IS NULL, {column}) AS rn, '
+            f'COUNT({column}) OVER (PARTITION BY zip_code) AS n '
+            f'FROM {table} t) ranked GROUP BY zip_code'
+        )
+
+    def leadByZip(self) -> TextClause:
+        """Screenings and the share of elevated blood lead levels per zip code."""
+        return text(self._grouped(self._table('lead'), 'perc_5plus', [
+            'COUNT(*) AS row_count',
+            'SUM(num_screen) AS num_screen',
+            'SUM(num_bll_5plus) AS num_bll_5plus',
+            'AVG(perc_5plus) AS perc_5plus',
+        ]) + ' ORDER BY zip_code')
+
+    def taxByZip(self) -> TextClause:
+        """Delinquent properties and balances per zip code."""
+        return text(self._grouped(self._table('tax'), 'avg_balance', [
+            'COUNT(*) AS row_count',
+            'SUM(num_props) AS num_props',
+            'SUM(balance) AS balance',
+            'AVG(avg_balance) AS avg_balance',
+        ]) + ' ORDER BY zip_code')
+
+    def leadVsTax(self) -> TextClause:
+        """Lead levels beside tax balances for the zip codes in both tables."""
+        lead = self._grouped(self._table('lead'), 'perc_5plus', ['AVG(perc_5plus) AS perc_5plus'])
+        tax = self._grouped(self._table('tax'), 'avg_balance',
+                            ['SUM(num_props) AS num_props', 'AVG(avg_balance) AS avg_balance'])
+        lead_percentiles = ''.join(f', lead.perc_5plus_p{round(p * 100):g}' for p in self.percentiles)
+        return text(
+            f'SELECT lead.zip_code, lead.perc_5plus{lead_percentiles}, tax.num_props, tax.avg_balance '
+            f'FROM ({lead}) lead JOIN ({tax}) tax ON lead.zip_code = tax.zip_code ORDER BY lead.zip_code'
+        )
+
+    def zipSummary(self) -> TextClause:
+        """The per-zip summary the loader keeps up to date (see loader._summarize)."""
+        return text(f'SELECT * FROM {self._table("summary")} ORDER BY zip_code')
+
+    def intraday(self) -> TextClause:
+        """IBM's 5 minute lows, in time order."""
+        return text(f'SELECT date, low FROM {self._table("ibm")} ORDER BY date')
+
+    def _sql(self, query: Union[str, TextClause]) -> TextClause:
+        if isinstance(query, TextClause):
+            return query
+        if query in self.queries:
+            return self.queries[query]()
+        return text(query)
+
+    def batches(self, query: Union[str, TextClause], params: Optional[dict] = None) -> Iterator[pd.DataFrame]:
+        """
+        Stream a query's rows as DataFrames of up to fetch_size rows.
+
+        Args:
+            query: A report name (see self.queries), SQL text or a text() clause
+            params: Bind parameters for the query
+
+        An empty result yields one empty frame with the result's columns.
+        """
+        with self.connections.connect() as conn:
+            result = conn.execution_options(stream_results=True, max_row_buffer=self.fetch_size) \
+                .execute(self._sql(query), params or {})
+            columns = list(result.keys())
+            empty = True
+            while True:
+                rows = result.fetchmany(self.fetch_size)
+                if not rows:
+                    break
+                empty = False
+                yield pd.DataFrame.from_records(rows, columns=columns)
+            if empty:
+                yield pd.DataFrame(columns=columns)
+
+    def frame(self, query: Union[str, TextClause], params: Optional[dict] = None) -> pd.DataFrame:
+        """A query's whole result as one DataFrame."""
+        frames = list(self.batches(query, params))
+        return frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+
+    def arrays(self, query: Union[str, TextClause], params: Optional[dict] = None) -> Dict[str, np.ndarray]:
+        """A query's whole result as one NumPy array per column."""
+        df = self.frame(query, params)
+        return {col: df[col].to_numpy() for col in df.columns}
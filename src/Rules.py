@@ -0,0 +1,327 @@
+#Rules
+import ast
+import copy
+import io
+import re
+import tokenize
+import numpy as np
+import pandas as pd
+from typing import Dict, List
+
+try:
+    import numexpr
+except ImportError:
+    numexpr = None
+
+try:
+    import pyarrow.dataset as pads
+except ImportError:
+    pads = None
+
+
+# Node types a rule may contain; anything else (calls, attributes, ...) is rejected
+_ALLOWED = (
+    ast.Expression, ast.BoolOp, ast.BinOp, ast.UnaryOp, ast.Compare, ast.Name, ast.Load,
+    ast.Constant, ast.And, ast.Or, ast.Not, ast.BitAnd, ast.BitOr, ast.Invert, ast.USub, ast.UAdd,
+    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Mod, ast.Pow, ast.FloorDiv,
+    ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.In, ast.NotIn, ast.List, ast.Tuple,
+)
+
+# Name the vectorized tree calls for `in` tests against a list of constants
+_ISIN = '__isin'
+
+
+def _isin(values, options: tuple) -> np.ndarray:
+    """Elementwise membership, with missing values never matching."""
+    return pd.Series(values).isin(options).to_numpy()
+
+
+class _Vectorize(ast.NodeTransformer):
+    """Rewrite query-style boolean logic into elementwise array operators."""
+
+    def visit_BoolOp(self, node):
+        self.generic_visit(node)
+        op = ast.BitAnd() if isinstance(node.op, ast.And) else ast.BitOr()
+        result = node.values[0]
+        for value in node.values[1:]:
+            result = ast.BinOp(left=result, op=op, right=value)
+        return result
+
+    def visit_UnaryOp(self, node):
+        self.generic_visit(node)
+        if isinstance(node.op, ast.Not):
+            return ast.UnaryOp(op=ast.Invert(), operand=node.operand)
+        return node
+
+    def visit_Compare(self, node):
+        self.generic_visit(node)
+        # a < b < c  ->  (a < b) & (b < c)
+        parts = []
+        left = node.left
+        for op, right in zip(node.ops, node.comparators):
+            parts.append(self._compare(left, op, right))
+            left = right
+        result = parts[0]
+        for part in parts[1:]:
+            result = ast.BinOp(left=result, op=ast.BitAnd(), right=part)
+        return result
+
+    def _compare(self, left, op, right):
+        # a in [1, 2] (or a == [1, 2], as pandas reads it)  ->  __isin(a, (1, 2))
+        if isinstance(right, (ast.List, ast.Tuple)) and isinstance(op, (ast.In, ast.NotIn, ast.Eq, ast.NotEq)):
+            options = tuple(_literal(elt) for elt in right.elts)
+            if None not in options and not isinstance(left, (ast.List, ast.Tuple)):
+                call = ast.Call(func=ast.Name(id=_ISIN, ctx=ast.Load()),
+                                args=[left, ast.Constant(value=options)], keywords=[])
+                if isinstance(op, (ast.NotIn, ast.NotEq)):
+                    return ast.UnaryOp(op=ast.Invert(), operand=call)
+                return call
+        if isinstance(op, (ast.In, ast.NotIn)):
+            raise ValueError("'in' needs a list of constants")
+        return ast.Compare(left=left, ops=[op], comparators=[right])
+
+
+def _replaceBooleans(source: str) -> str:
+    """
+    Spell `&` and `|` as `and` and `or`, as pandas does before parsing, so
+    they bind looser than comparisons: `a > 1 & a < 5` is `(a > 1) & (a < 5)`.
+    """
+    try:
+        tokens = [(tokenize.NAME, 'and' if tok.string == '&' else 'or')
+                  if tok.type == tokenize.OP and tok.string in ('&', '|') else (tok.type, tok.string)
+                  for tok in tokenize.generate_tokens(io.StringIO(source).readline)]
+    except tokenize.TokenError:
+        # Unbalanced brackets: let the parser report it
+        return source
+    return tokenize.untokenize(tokens)
+
+
+def _values(series: pd.Series) -> np.ndarray:
+    """Column values as a NumPy array, with nullable numbers as float/NaN."""
+    if isinstance(series.dtype, pd.api.extensions.ExtensionDtype) and pd.api.types.is_numeric_dtype(series.dtype):
+        return series.to_numpy(dtype=float, na_value=np.nan)
+    return series.to_numpy()
+
+
+class expressionEvaluator:
+    """A column expression parsed and compiled once, then evaluated per frame."""
+
+    def __init__(self, expr: str):
+        """
+        Args:
+            expr: A pandas query style expression, e.g. "balance / num_props"
+        """
+
+        self.expr = str(expr)
+
+        # `quoted names` become plain identifiers the parser accepts
+        self.names = {}
+        def rename(match):
+            alias = f'__col{len(self.names)}'
+            self.names[alias] = match.group(1)
+            return alias
+        source = re.sub(r'`([^`]*)`', rename, self.expr)
+
+        tree = ast.parse(_replaceBooleans(source), mode='eval')
+        for node in ast.walk(tree):
+            if not isinstance(node, _ALLOWED):
+                raise ValueError(f"Unsupported expression in rule '{self.expr}': {type(node).__name__}")
+        # Kept before vectorizing, for translating the rule to other engines
+        self.tree = copy.deepcopy(tree)
+
+        try:
+            tree = ast.fix_missing_locations(_Vectorize().visit(tree))
+        except ValueError as e:
+            raise ValueError(f"Unsupported expression in rule '{self.expr}': {e}") from None
+        for node in ast.walk(tree):
+            if isinstance(node, (ast.List, ast.Tuple)):
+                raise ValueError(f"Unsupported expression in rule '{self.expr}': {type(node).__name__}")
+        self.columns = sorted({self.names.get(node.id, node.id) for node in ast.walk(tree)
+                               if isinstance(node, ast.Name) and node.id != _ISIN})
+        self.source = ast.unparse(tree)
+        self.code = compile(tree, f'<rule {self.expr}>', 'eval')
+        # numexpr has no membership test
+        self.numexpr = not any(isinstance(node, ast.Call) for node in ast.walk(tree))
+
+    def evaluate(self, df: pd.DataFrame):
+        """Evaluate the expression to an array (or a scalar for constant expressions)."""
+        aliases = {col: alias for alias, col in self.names.items()}
+        env = {}
+        for col in self.columns:
+            if col not in df.columns:
+                raise KeyError(f"Rule '{self.expr}' references missing column '{col}'")
+            env[aliases.get(col, col)] = _values(df[col])
+
+        if numexpr is not None and self.numexpr and env and all(values.dtype != object for values in env.values()):
+            return numexpr.evaluate(self.source, local_dict=env)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return eval(self.code, {'__builtins__': {}, _ISIN: _isin}, env)
+
+    def __call__(self, df: pd.DataFrame) -> np.ndarray:
+        """Evaluate the expression to a float array the length of the frame."""
+        result = self.evaluate(df)
+        if np.ndim(result) == 0:
+            return np.full(len(df), result, dtype=float)
+        return np.asarray(result, dtype=float)
+
+
+class ruleEvaluator(expressionEvaluator):
+    """A validation rule parsed and compiled once, then evaluated per frame."""
+
+    def __call__(self, df: pd.DataFrame) -> np.ndarray:
+        """Evaluate the rule to a boolean array, treating missing results as failures."""
+        result = self.evaluate(df)
+        if np.ndim(result) == 0:
+            return np.full(len(df), bool(result))
+        return np.asarray(result, dtype=bool)
+
+
+# Comparisons that drop the same rows in Arrow as in the validator. != is left
+# out: NaN != x passes the validator, but a null comparison is dropped by Arrow.
+_ARROW_OPS = {
+    ast.Eq: lambda a, b: a == b,
+    ast.Lt: lambda a, b: a < b,
+    ast.LtE: lambda a, b: a <= b,
+    ast.Gt: lambda a, b: a > b,
+    ast.GtE: lambda a, b: a >= b,
+}
+_FLIPPED = {ast.Lt: ast.Gt, ast.LtE: ast.GtE, ast.Gt: ast.Lt, ast.GtE: ast.LtE, ast.Eq: ast.Eq}
+
+
+def _literal(node):
+    """A rule constant as a Python value, or None if it is not one."""
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+        value = _literal(node.operand)
+        return -value if value is not None and isinstance(node.op, ast.USub) else value
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float, str)):
+        return node.value
+    return None
+
+
+def _arrowExpr(node, names: Dict[str, str], available: set, strict: bool):
+    """
+    Translate a parsed rule into an Arrow filter expression.
+
+    Returns None where the rule cannot be expressed without changing which
+    rows it keeps. Outside an `or` (strict=False) untranslatable `and` terms
+    are dropped instead, which only lets more rows through to the validator.
+    """
+    if isinstance(node, ast.Expression):
+        return _arrowExpr(node.body, names, available, strict)
+
+    if isinstance(node, ast.BoolOp):
+        inner = strict or isinstance(node.op, ast.Or)
+        parts = [_arrowExpr(value, names, available, inner) for value in node.values]
+        if isinstance(node.op, ast.Or):
+            if any(part is None for part in parts):
+                return None
+            result = parts[0]
+            for part in parts[1:]:
+                result = result | part
+            return result
+        parts = [part for part in parts if part is not None]
+        if not parts or (strict and len(parts) < len(node.values)):
+            return None
+        result = parts[0]
+        for part in parts[1:]:
+            result = result & part
+        return result
+
+    if isinstance(node, ast.Compare):
+        terms = []
+        left = node.left
+        for op, right in zip(node.ops, node.comparators):
+            term = None
+            if type(op) in _ARROW_OPS:
+                if isinstance(left, ast.Name) and _literal(right) is not None:
+                    term = (left.id, _literal(right), type(op))
+                elif isinstance(right, ast.Name) and _literal(left) is not None:
+                    term = (right.id, _literal(left), _FLIPPED[type(op)])
+            if term is None or names.get(term[0], term[0]) not in available:
+                return None
+            column, value, cmp = term
+            terms.append(_ARROW_OPS[cmp](pads.field(names.get(column, column)), value))
+            left = right
+        result = terms[0]
+        for term in terms[1:]:
+            result = result & term
+        return result
+
+    return None
+
+
+def arrowFilter(rules: List[ruleEvaluator], columns: List[str]):
+    """
+    Combine the parts of a source's rules Arrow can evaluate into one filter
+    for predicate pushdown, or None if no part can be pushed down.
+
+    Rows the filter drops would all have failed validation, so the validator
+    still runs every rule on what is read; it just sees fewer rows.
+
+    Args:
+        rules: The source's compiled rules
+        columns: Columns present in the dataset being read
+    """
+    if pads is None:
+        return None
+    result = None
+    for rule in rules:
+        part = _arrowExpr(rule.tree, rule.names, set(columns), False)
+        if part is not None:
+            result = part if result is None else result & part
+    return result
+
+
+# Accepted dtypes for each schema type
+type_map = {
+    'int': ['int64', 'int32', 'int16', 'int8', 'Int64', 'Int32', 'Int16', 'Int8'],
+    'float': ['float64', 'float32', 'float16', 'Float64', 'Float32'],
+    'float32': ['float32', 'Float32'],
+    'bool': ['bool', 'boolean'],
+    'str': ['object', 'string', 'str'],
+    'category': ['category'],
+}
+
+# Dtype each schema type is parsed as
+parse_map = {
+    'int': 'Int64',
+    'float': 'float64',
+    'float32': 'float32',
+    'bool': 'boolean',
+    'str': 'string',
+    'category': 'category',
+}
+
+# Parse dtypes that accept any text, so they can never fail on dirty values
+text_dtypes = ('string', 'category')
+
+
+def schemaDtypes(schema: Dict[str, str]) -> Dict[str, str]:
+    """Map a source's schema to the dtypes its columns should be parsed as."""
+    return {col: parse_map[expected_type] for col, expected_type in schema.items() if expected_type in parse_map}
+
+
+def textDtypes(dtypes: Dict[str, str]) -> Dict[str, str]:
+    """The subset of parse dtypes that cannot fail on dirty data."""
+    return {col: dtype for col, dtype in dtypes.items() if dtype in text_dtypes}
+
+
+class schemaCheck:
+    """A schema column and the dtypes it accepts, resolved once."""
+
+    def __init__(self, column: str, expected_type: str):
+        self.column = column
+        self.expected_type = expected_type
+        self.dtypes = frozenset(type_map.get(expected_type, [expected_type]))
+
+    def matches(self, series: pd.Series) -> bool:
+        return str(series.dtype) in self.dtypes
+
+
+def compileRules(rules: List[Dict[str, str]]) -> List[ruleEvaluator]:
+    return [ruleEvaluator(rule_spec['rule']) for rule_spec in rules]
+
+
+def compileSchema(schema: Dict[str, str]) -> List[schemaCheck]:
+    return [schemaCheck(col, expected_type) for col, expected_type in schema.items()]
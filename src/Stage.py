@@ -0,0 +1,92 @@
+#Stage
+import json
+import os
+import shutil
+import pandas as pd
+from typing import Any, Dict
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:
+    pa = None
+
+
+class stageStore:
+    """
+    Intermediate results of a source's run, kept on disk as Arrow IPC files.
+
+    Each chunk's read, validated and rejected rows are written once as
+    uncompressed Arrow IPC (Feather v2) and reopened memory-mapped, so a
+    worker process or a resumed run reads the same pages instead of
+    receiving a pickled copy. A manifest per source records how far each
+    chunk got, so a run that failed part way resumes after the last
+    completed stage. A source's files are removed once its run finishes.
+    """
+
+    def __init__(self, directory: str):
+        """
+        Args:
+            directory: Directory the stage files are kept in, one subdirectory per source
+        """
+        if pa is None:
+            raise ImportError("The stage store needs pyarrow: pip install pyarrow")
+
+        self.directory = directory
+
+    def path(self, source: str, chunk: int, stage: str) -> str:
+        return os.path.join(self.directory, source, f'{chunk:06d}.{stage}.arrow')
+
+    def write(self, source: str, chunk: int, stage: str, df: pd.DataFrame):
+        """Write one chunk's output of a stage, replacing it atomically."""
+        path = self.path(source, chunk, stage)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f'{path}.tmp'
+        # Uncompressed, so reopening it is a memory map rather than a decode
+        try:
+            feather.write_feather(df, tmp, compression='uncompressed')
+        except (pa.ArrowTypeError, pa.ArrowInvalid):
+            # Object columns mixing types (dirty values) are kept as their text
+            text = {col: 'string' for col in df.columns if df[col].dtype == object}
+            feather.write_feather(df.astype(text), tmp, compression='uncompressed')
+        os.replace(tmp, path)
+
+    def read(self, source: str, chunk: int, stage: str) -> pd.DataFrame:
+        """Reopen one chunk's output of a stage memory-mapped."""
+        with pa.memory_map(self.path(source, chunk, stage)) as source_file:
+            table = pa.ipc.open_file(source_file).read_all()
+        return table.to_pandas(split_blocks=True)
+
+    def has(self, source: str, chunk: int, stage: str) -> bool:
+        return os.path.exists(self.path(source, chunk, stage))
+
+    def manifest(self, source: str, fingerprint: str) -> Dict[str, Any]:
+        """
+        Progress of the source's unfinished run, or a fresh manifest.
+
+        Stage files from a run with a different config fingerprint are
+        discarded rather than resumed.
+        """
+        try:
+            with open(os.path.join(self.directory, source, 'manifest.json')) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            manifest = None
+
+        if manifest is None or manifest.get('fingerprint') != fingerprint:
+            self.clear(source)
+            manifest = {'fingerprint': fingerprint, 'complete': False, 'chunks': {}}
+        return manifest
+
+    def save(self, source: str, manifest: Dict[str, Any]):
+        """Record a source's progress; called after each stage a chunk completes."""
+        path = os.path.join(self.directory, source, 'manifest.json')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(f'{path}.tmp', 'w') as f:
+            json.dump(manifest, f)
+        os.replace(f'{path}.tmp', path)
+
+    def clear(self, source: str):
+        """Remove a source's stage files once its run has finished."""
+        shutil.rmtree(os.path.join(self.directory, source), ignore_errors=True)
+
@@ -0,0 +1,142 @@
+#State
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import numpy as np
+import pandas as pd
+from contextlib import closing
+from sqlalchemy.engine import make_url
+from typing import Any, Dict, List, Optional, Tuple
+
+
+def rowHashes(df: pd.DataFrame, pk: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Hash each row's primary key and its full content to 64-bit integers.
+
+    Both are vectorized over the columns, so a chunk costs one pass per
+    column rather than a Python call per row.
+    """
+    keys = pd.util.hash_pandas_object(df[pk], index=False).to_numpy()
+    digests = pd.util.hash_pandas_object(df, index=False).to_numpy()
+    # SQLite integers are signed
+    return keys.view(np.int64), digests.view(np.int64)
+
+
+def stateKey(source: str, db_url: str, table: str, transform: Optional[Dict[str, Any]] = None) -> str:
+    """
+    The name a source's state is kept under for one database and target table.
+
+    Fingerprints and watermarks describe what is in a particular table, so
+    pointing a source at another database or table starts from no state.
+    The URL's password is masked.
+
+    Args:
+        source: Name of the source in the YAML config
+        db_url: Database the source loads into
+        table: Target table
+        transform: Config that shapes the loaded rows (schema, rules, clean,
+            compact); a change to it also starts from no state, so rows
+            loaded under the old config are loaded again
+    """
+    key = f'{source}|{make_url(db_url).render_as_string(hide_password=True)}|{table}'
+    if transform is not None:
+        key += '|' + hashlib.sha1(json.dumps(transform, sort_keys=True, default=str).encode()).hexdigest()[:16]
+    return key
+
+
+class stateStore:
+    """
+    Pipeline state kept between runs in a local SQLite file.
+
+    Holds one (key hash, content hash) fingerprint per loaded row and source,
+    so rows unchanged since the last successful load can be dropped before
+    they reach the loader, and the watermark of each incremental source.
+    The pipeline names each source's state with stateKey.
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: SQLite file the state is kept in
+        """
+
+        self.path = path
+        self._lock = threading.Lock()
+        self._fingerprints = {}
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as db, db:
+            db.execute('CREATE TABLE IF NOT EXISTS fingerprints ('
+                       'source TEXT, key INTEGER, digest INTEGER, PRIMARY KEY (source, key)) WITHOUT ROWID')
+            db.execute('CREATE TABLE IF NOT EXISTS watermarks (source TEXT PRIMARY KEY, col TEXT, value)')
+
+    def _connect(self) -> sqlite3.Connection:
+        return closing(sqlite3.connect(self.path, timeout=30))
+
+    def fingerprints(self, source: str) -> pd.Series:
+        """Content hashes of a source's loaded rows, indexed by key hash and read once per store."""
+        with self._lock:
+            if source not in self._fingerprints:
+                with self._connect() as db:
+                    rows = db.execute('SELECT key, digest FROM fingerprints WHERE source = ?', (source,)).fetchall()
+                keys, digests = zip(*rows) if rows else ((), ())
+                self._fingerprints[source] = pd.Series(np.array(digests, dtype=np.int64),
+                                                       index=pd.Index(np.array(keys, dtype=np.int64)))
+            return self._fingerprints[source]
+
+    def unchanged(self, df: pd.DataFrame, source: str, pk: List[str], lookup: Optional[np.ndarray] = None) -> tuple:
+        """
+        Flag rows whose content matches what was last loaded for their key.
+
+        Returns the mask along with the rows' key and content hashes, which
+        are passed to commit once the changed rows have been loaded. Every
+        row is hashed, but with a lookup mask only those rows are looked up;
+        the rest count as changed.
+        """
+        keys, digests = rowHashes(df, pk)
+        stored = self.fingerprints(source)
+        rows = np.arange(len(df)) if lookup is None else np.flatnonzero(lookup)
+        position = stored.index.get_indexer(keys[rows])
+        found = position >= 0
+        mask = np.zeros(len(df), dtype=bool)
+        mask[rows[found]] = stored.to_numpy()[position[found]] == digests[rows[found]]
+        return mask, keys, digests
+
+    def commit(self, source: str, keys: np.ndarray, digests: np.ndarray):
+        """Record fingerprints for rows that were loaded successfully."""
+        if not len(keys):
+            return
+        with self._lock:
+            with self._connect() as db, db:
+                db.executemany('INSERT OR REPLACE INTO fingerprints VALUES (?, ?, ?)',
+                               zip([source] * len(keys), keys.tolist(), digests.tolist()))
+            stored = self._fingerprints.get(source)
+            if stored is not None:
+                update = pd.Series(digests, index=pd.Index(keys))
+                update = update[~update.index.duplicated(keep='last')]
+                self._fingerprints[source] = pd.concat([stored[~stored.index.isin(keys)], update])
+
+    def watermark(self, source: str, column: str) -> Any:
+        """Highest loaded value of a source's watermark column, None before its first load."""
+        with self._connect() as db:
+            row = db.execute('SELECT col, value FROM watermarks WHERE source = ?', (source,)).fetchone()
+        # A watermark kept on a different column says nothing about this one
+        return row[1] if row and row[0] == column else None
+
+    def setWatermark(self, source: str, column: str, value: Any):
+        """Advance a source's watermark; called only once all of a run's rows are loaded."""
+        value = value.item() if isinstance(value, np.generic) else value
+        with self._lock:
+            with self._connect() as db, db:
+                db.execute('INSERT OR REPLACE INTO watermarks VALUES (?, ?, ?)', (source, column, value))
+
+    def reset(self, source: str):
+        """Forget a source's fingerprints and watermark, e.g. after its table was dropped, so every row loads again."""
+        with self._lock:
+            with self._connect() as db, db:
+                db.execute('DELETE FROM fingerprints WHERE source = ?', (source,))
+                db.execute('DELETE FROM watermarks WHERE source = ?', (source,))
+            self._fingerprints.pop(source, None)
@@ -1,7 +1,10 @@
 #Validator
+import json
+import numpy as np
 import pandas as pd
 import yaml
 from typing import Dict, List, Any
+from Rules import ruleEvaluator, schemaCheck, compileRules, compileSchema
 
 
 class validator:
@@ -15,6 +18,29 @@ class validator:
 
         self.config = cfg
         self.sources = {src['name']: src for src in self.config.get('sources', [])}
+
+        # Rules and schema checks compiled per source, rebuilt only if that source's config changes
+        self._compiled = {}
+        for name in self.sources:
+            self._compiled_source(name)
+    
+    def _compiled_source(self, source_name: str) -> Dict[str, Any]:
+        """Return the compiled rules and schema checks for a source."""
+        source_config = self.sources[source_name]
+        fingerprint = json.dumps(
+            [source_config.get('schema'), source_config.get('rules')], sort_keys=True, default=str
+        )
+
+        compiled = self._compiled.get(source_name)
+        if compiled is None or compiled['fingerprint'] != fingerprint:
+            compiled = {
+                'fingerprint': fingerprint,
+                'schema': compileSchema(source_config.get('schema') or {}),
+                'rules': compileRules(source_config.get('rules') or []),
+            }
+            self._compiled[source_name] = compiled
+
+        return compiled
     
     def validate(self, df: pd.DataFrame, source_name: str) -> tuple:
         """
@@ -29,9 +55,11 @@ class validator:
             raise ValueError(f"Source '{source_name}' not found in config")
         
         source_config = self.sources[source_name]
+        compiled = self._compiled_source(source_name)
         
-        validS,invalidS = self._validate_schema(df, source_config.get('schema', []), source_config['pk'])
-        valid,invalidR = self._validate_rules(validS, source_config.get('rules', []))
+        unique_pk = source_config.get('unique_pk', self.config.get('defaults', {}).get('unique_pk', False))
+        validS,invalidS = self._validate_schema(df, compiled['schema'], source_config['pk'], unique_pk)
+        valid,invalidR = self._validate_rules(validS, compiled['rules'])
 
         #invalid = pd.concat([invalidS,invalidR])
         
@@ -39,60 +67,68 @@ class validator:
         return valid, invalidS, invalidR
     
     
-    def _validate_rules(self, df: pd.DataFrame, rules: List[Dict[str, str]]) -> tuple:
+    def _validate_rules(self, df: pd.DataFrame, rules: List[ruleEvaluator]) -> tuple:
         """
         Validate that all rows in DataFrame satisfy the rules.
+
+        Every compiled rule is evaluated once (with numexpr when it is
+        installed) into one boolean column of a rows x rules matrix; valid and
+        invalid rows are split off the combined mask in a single pass. Invalid
+        rows get a failed_rules column naming the rule(s) they broke.
         """
-        invalid = pd.DataFrame()
-        valid = df
-        
+        if not rules:
+            return df, df.iloc[0:0]
 
-        for rule_spec in rules:
-            valid = valid.query(rule_spec['rule'])
-        
-        invalid = df.drop(valid.index)
+        exprs = [rule.expr for rule in rules]
+        passed = np.column_stack([rule(df) for rule in rules])
+        mask = passed.all(axis=1)
+
+        valid = df[mask]
+        invalid = df[~mask]
+
+        failed = ~passed[~mask]
+        invalid = invalid.assign(failed_rules=[
+            '; '.join(expr for expr, hit in zip(exprs, row) if hit) for row in failed
+        ])
         
         return valid,invalid
-    
 
-    def _validate_schema(self, df: pd.DataFrame, schema: List[Dict[str, str]], pk: List[str]) -> tuple:
+
+    def _validate_schema(self, df: pd.DataFrame, schema: List[schemaCheck], pk: List[str],
+                         unique_pk: bool = False) -> tuple:
         """
         Validate that all rows in DataFrame satisfy the schema.
-        """
-        invalid = pd.DataFrame()
-
 
+        Primary keys are checked in one vectorized pass: a row with any null
+        pk column is rejected as null_pk and, when unique_pk is set, a repeat
+        of an earlier row's pk tuple is rejected as duplicate_pk. Each
+        rejected row appears once in the invalid frame with its reason.
+        """
         # Check and attempt to convert data types
-        for col, expected_type in schema.items():
-            if col not in df.columns:
+        for check in schema:
+            if check.column not in df.columns:
                 continue
             
-            type_valid = self._check_column_type(df[col], expected_type)
-            if not type_valid:
+            if not check.matches(df[check.column]):
                 # Try to convert to the expected type
-                self._try_convert_column(df, col, expected_type)
+                self._try_convert_column(df, check.column, check.expected_type)
 
 
-        for key in pk:
-            drop = df.dropna(subset=key)
-            invalid = pd.concat([invalid,df.drop(drop.index)])
+        null_pk = df[pk].isna().any(axis=1).to_numpy()
+        bad = null_pk
+        reasons = np.full(len(df), None, dtype=object)
+        reasons[null_pk] = 'null_pk'
 
-        df.drop(invalid.index, inplace=True)
+        if unique_pk:
+            # duplicated() hashes the pk tuples, so this stays linear in rows
+            duplicate_pk = df.duplicated(subset=pk, keep='first').to_numpy() & ~null_pk
+            reasons[duplicate_pk] = 'duplicate_pk'
+            bad = null_pk | duplicate_pk
 
-        return df,invalid
+        if not bad.any():
+            return df, df.iloc[0:0].assign(reason=pd.Series(dtype=object))
 
-
-    def _check_column_type(self, series: pd.Series, expected_type: str) -> bool:
-        """Check if a series matches the expected type."""
-        type_map = {
-            'int': ['int64', 'int32', 'int16', 'int8'],
-            'float': ['float64', 'float32', 'float16'],
-            'bool': ['bool'],
-            'str': ['object', 'string']
-        }
-        
-        expected_dtypes = type_map.get(expected_type, [expected_type])
-        return str(series.dtype) in expected_dtypes
+        return df[~bad], df[bad].assign(reason=reasons[bad])
 
 
     def _try_convert_column(self, df: pd.DataFrame, col: str, expected_type: str) -> tuple:
@@ -112,9 +148,15 @@ class validator:
                 # Try to convert to bool
                 df[col] = df[col].astype(bool)
                 
+            elif expected_type == 'float32':
+                df[col] = pd.to_numeric(df[col], errors='coerce').astype('float32')
+                
             elif expected_type == 'str':
                 # Convert to string
                 df[col] = df[col].astype(str)
+                
+            elif expected_type == 'category':
+                df[col] = df[col].astype('category')
             
         except Exception as e:
             # If conversion fails, revert to original
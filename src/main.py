@@ -1,14 +1,13 @@
 import yaml
-import matplotlib.pyplot as plt
-import psycopg2 as psy
 import logging
-from Reader import reader
-from Validator import validator
-from Cleaner import cleaner
-from Loader import loader
+from Pipeline import pipeline
+from Connection import connectionManager
+from Reports import reports
+from Charts import chartRenderer
+from sqlalchemy.exc import SQLAlchemyError
 
 
-def run():
+def run(cfg, connections):
     logger = logging.getLogger("app")
     logger.setLevel(logging.INFO)
 
@@ -20,34 +19,29 @@ def run():
     logger.handlers.clear()
     logger.addHandler(ch)
 
-    with open('config/sources.yml', 'r') as file:
-        cfg = yaml.safe_load(file)
-    logger.info('yaml good to go')
-    r = reader(cfg)
-    csvDF = r.read('tax_csv')    
-    logger.info('csv too')
-    apiDF = r.read('lead_api')
-    logger.info('api is ready as well')
-    v = validator(cfg)
-    apiDF,invalidSchemaAPI, invalidRulesAPI = v.validate(apiDF,'lead_api')
-    csvDF,invalidSchemaCSV, invalidRulesCSV = v.validate(csvDF,'tax_csv')
-    c = cleaner(cfg)
-    c.cleanlead(apiDF)
-    c.cleantax(csvDF)
-    l = loader(cfg)
-    l.load(apiDF,"lead_levels")
-    l.load(csvDF,"tax_levels")
-
-    logger.info('Rows Rejected for violating Schema:')
-    logger.info(invalidSchemaAPI)
-    logger.info(invalidSchemaCSV)
-    logger.info('Rows Rejected for violating Rules:')
-    logger.info(invalidRulesAPI)
-    logger.info(invalidRulesCSV)
-
-
-
-def graphOut():
+    results = pipeline(cfg, connections).run()
+
+    for name, result in results.items():
+        if result['error'] is not None:
+            logger.info(f"{name} failed: {result['error']}")
+            continue
+        logger.info(f"{name}: {result['rows_loaded']} rows loaded into {result['table']}")
+        logger.info(f"{name}: {result['rows_unchanged']} rows unchanged since the last load")
+        logger.info(f"{name}: compaction saved {result['bytes_saved']} bytes")
+        for stage, totals in result['metrics'].items():
+            logger.info(f"{name} {stage}: {totals['wall_s']:.2f}s wall, {totals['cpu_s']:.2f}s cpu, "
+                        f"{int(totals['rows_in'])} rows in, {int(totals['rows_out'])} out, "
+                        f"{int(totals['rows_rejected'])} rejected")
+        logger.info('Rows Rejected for violating Schema:')
+        logger.info(result['invalid_schema'])
+        logger.info('Rows Rejected for violating Rules:')
+        logger.info(result['invalid_rules'])
+
+    logger.info(f'Connection pool: {connections.metrics()}')
+
+
+
+def graphOut(cfg, connections):
     logger = logging.getLogger("app")
     logger.setLevel(logging.INFO)
 
@@ -59,55 +53,43 @@ def graphOut():
     logger.handlers.clear()
     logger.addHandler(ch)
 
-    conn = psy.connect(
-            dbname="project_1",
-            user="postgres",
-            password="pointLester",
-            host="localhost"
-    )
-
-    if conn:
-        try:
-            cursor = conn.cursor()
-
-            fig, axs = plt.subplots(2)
-            fig.suptitle('Compare')
-            
-            
+    report = reports(cfg, connections)
+    charts = {}
 
-            cursor.execute("SELECT zip_code, perc_5plus FROM lead_levels;")
+    try:
+        if cfg.get('defaults', {}).get('summary'):
+            # Precomputed by the loader, one row per zip code
+            summary = report.frame('zip_summary')
+        else:
+            # Aggregated per zip code by the database
+            summary = report.frame('lead_by_zip')[['zip_code', 'perc_5plus']].merge(
+                report.frame('tax_by_zip')[['zip_code', 'avg_balance']], on='zip_code', how='outer')
+        charts['lead_vs_tax'] = ('zip_bars', summary)
 
-            # Fetch results
-            records = cursor.fetchall()  # Fetch all rows
+    except SQLAlchemyError as e:
+        logger.info(f"Error executing query: {e}")
 
-            zip1 = [row[0] for row in records]
-            perc = [row[1] for row in records]
+    try:
+        intraday = report.frame('intraday')
+        if not intraday.empty:
+            charts['ibm_intraday'] = ('intraday', intraday)
 
-            axs[0].bar(zip1, perc, color='red')
+    except SQLAlchemyError as e:
+        # Only there once an intraday source has been loaded
+        logger.info(f"No intraday data to chart: {e}")
 
+    # Drawn headless to files in one pass, and only those whose data changed since the last run
+    for name, chart in chartRenderer(cfg).render(charts).items():
+        state = 'unchanged' if chart['cached'] else 'rendered'
+        logger.info(f"Chart {name} {state}: {', '.join(chart['paths'])}")
 
-            cursor.execute("SELECT zip_code, avg_balance FROM tax_levels ORDER BY zip_code;")
 
-            records = cursor.fetchall()  # Fetch all rows
-
-            zip2 = [row[0] for row in records]
-            numprop = [row[1] for row in records]
-
-            axs[1].bar(zip2, numprop, color='blue')
-
-            plt.show()
-
-
-        except psy.Error as e:
-            logger.info(f"Error executing query: {e}")
-
-        finally:
-            # Close the cursor and connection
-            if cursor:
-                cursor.close()
-            if conn:
-                conn.close()
-                logger.info("PostgreSQL connection closed.")
+# Pool workers are started with forkserver/spawn and import this module again
+if __name__ == '__main__':
+    with open('config/sources.yml', 'r') as file:
+        cfg = yaml.safe_load(file)
 
-run()
-graphOut()
\ No newline at end of file
+    connections = connectionManager(cfg)
+    run(cfg, connections)
+    graphOut(cfg, connections)
+    connections.dispose()